@@ -0,0 +1,265 @@
+# alerts.py
+
+import json
+import queue
+import sqlite3
+import logging
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+import storage
+
+# ------------------------ Configuration ------------------------
+
+LINE_MOVE_THRESHOLD = 0.5        # Points a line must move to raise an event
+ODDS_MOVE_THRESHOLD = 10         # Cents (American odds) the price must move to raise an event
+MIDDLE_MIN_GAP = 0.5             # Minimum gap between over and under lines for a middle
+ALERTS_TABLE = "prop_alerts"
+
+Sink = Callable[[List[Dict[str, Any]]], None]
+
+# ------------------------ Helpers ------------------------
+
+def implied_probability(odds: float) -> float:
+    """Convert American odds to an implied probability."""
+    return -odds / (100.0 - odds) if odds < 0 else 100.0 / (odds + 100.0)
+
+
+def _numeric(value: Any) -> Optional[float]:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+# ------------------------ Change Detection ------------------------
+
+class ChangeDetector:
+    """
+    Keeps the latest main line of every offer still on the board in memory and
+    compares each new snapshot against it; offers that disappear are forgotten.
+    Work beyond the comparison pass is proportional to the number of offers that
+    changed: only their (event, player, market) groups are re-checked for
+    arbitrage and middles.
+    """
+
+    def __init__(self, line_threshold: float = LINE_MOVE_THRESHOLD, odds_threshold: float = ODDS_MOVE_THRESHOLD,
+                 middle_min_gap: float = MIDDLE_MIN_GAP, sinks: Iterable[Sink] = ()):
+        self.line_threshold = line_threshold
+        self.odds_threshold = odds_threshold
+        self.middle_min_gap = middle_min_gap
+        self.sinks = list(sinks)
+        # (event_id, player, market) -> {(side, bookie): (line, odds)}
+        self._groups: Dict[Tuple, Dict[Tuple[str, str], Tuple[float, float]]] = {}
+        # (event_id, player, market) -> opportunities already reported, so each fires once
+        self._open_opportunities: Dict[Tuple, set] = {}
+
+    @property
+    def primed(self) -> bool:
+        return bool(self._groups)
+
+    def prime(self, database: str, table_name: str = "prop_lines") -> int:
+        """
+        Load the most recent stored snapshot as the baseline state, so a fresh
+        process does not report every offer as new. Returns the number of offers loaded.
+        """
+        cursor = storage.get_connection(database).cursor()
+        try:
+            cursor.execute(f"PRAGMA table_info({table_name});")
+            columns = {row[1] for row in cursor.fetchall()}
+            if not columns:
+                return 0
+            main_filter = "AND COALESCE(is_main, 1) = 1" if "is_main" in columns else ""
+            cursor.execute(f"""
+                SELECT event_id, player, market, selection, bookie, prop_line, odds FROM {table_name}
+                WHERE script_timestamp = (SELECT MAX(script_timestamp) FROM {table_name}) {main_filter};
+            """)
+        except sqlite3.Error as e:
+            logging.error(f"Could not prime change detector from {database}: {e}")
+            return 0
+        loaded = 0
+        for event_id, player, market, selection, bookie, prop_line, odds in cursor.fetchall():
+            line, price = _numeric(prop_line), _numeric(odds)
+            side = str(selection)[:1].lower()
+            if line is None or price is None or side not in ("o", "u"):
+                continue
+            self._groups.setdefault((str(event_id), player, market), {})[(side, bookie)] = (line, price)
+            loaded += 1
+        # Opportunities already open in the stored snapshot were reported before the restart
+        for group_key in self._groups:
+            self._check_opportunities(group_key, None)
+        return loaded
+
+    def process(self, snapshot: Iterable[Any]) -> List[Dict[str, Any]]:
+        """
+        Compare a snapshot of PropOffer records with the previous state, update the
+        state, deliver the resulting events to every sink and return them.
+        """
+        events: List[Dict[str, Any]] = []
+        changed_groups = set()
+        script_timestamp = None
+        seen: Dict[Tuple, set] = {}
+
+        for offer in snapshot:
+            if not getattr(offer, "is_main", 1):
+                continue
+            line, price = _numeric(offer.prop_line), _numeric(offer.odds)
+            side = str(offer.selection)[:1].lower()
+            if line is None or price is None or side not in ("o", "u"):
+                continue
+            script_timestamp = offer.script_timestamp
+            group_key = (str(offer.event_id), offer.player, offer.market)
+            seen.setdefault(group_key, set()).add((side, offer.bookie))
+            group = self._groups.setdefault(group_key, {})
+            previous = group.get((side, offer.bookie))
+            if previous == (line, price):
+                continue
+
+            group[(side, offer.bookie)] = (line, price)
+            changed_groups.add(group_key)
+            if previous is None:
+                continue
+            old_line, old_price = previous
+            base = {
+                "script_timestamp": script_timestamp, "event_id": group_key[0], "player": offer.player,
+                "market": offer.market, "selection": offer.selection, "bookie": offer.bookie,
+            }
+            if abs(line - old_line) >= self.line_threshold:
+                events.append({**base, "type": "line_move", "old_line": old_line, "new_line": line,
+                               "old_odds": old_price, "new_odds": price})
+            elif abs(price - old_price) >= self.odds_threshold:
+                events.append({**base, "type": "odds_move", "old_line": old_line, "new_line": line,
+                               "old_odds": old_price, "new_odds": price})
+
+        if seen:
+            changed_groups |= self._drop_missing(seen)
+        for group_key in changed_groups:
+            if group_key in self._groups:
+                events.extend(self._check_opportunities(group_key, script_timestamp))
+
+        if events:
+            for sink in self.sinks:
+                try:
+                    sink(events)
+                except Exception as e:
+                    logging.error(f"Alert sink failed: {e}")
+        return events
+
+    def _drop_missing(self, seen: Dict[Tuple, set]) -> set:
+        """
+        Forget prices that are no longer quoted: books missing from a group the snapshot
+        covers, groups of a polled market missing from a listed event, and every group of
+        an event gone from the snapshot. Returns the surviving groups that lost a book,
+        so their opportunities are re-checked (and closed ones stop counting as open).
+        """
+        events = {group_key[0] for group_key in seen}
+        markets = {group_key[2] for group_key in seen}
+        shrunk = set()
+        for group_key in list(self._groups):
+            event_id, _, market = group_key
+            quoted = seen.get(group_key)
+            if quoted is None and (event_id not in events or market in markets):
+                del self._groups[group_key]
+                self._open_opportunities.pop(group_key, None)
+                continue
+            if quoted is None:
+                continue  # The market was not polled this time; keep its last prices
+            group = self._groups[group_key]
+            for book_key in [book_key for book_key in group if book_key not in quoted]:
+                del group[book_key]
+                shrunk.add(group_key)
+        return shrunk
+
+    def _check_opportunities(self, group_key: Tuple, script_timestamp: Optional[str]) -> List[Dict[str, Any]]:
+        """Look for cross-book arbitrage and middles within one (event, player, market) group."""
+        group = self._groups[group_key]
+        overs = [(line, odds, bookie) for (side, bookie), (line, odds) in group.items() if side == "o"]
+        unders = [(line, odds, bookie) for (side, bookie), (line, odds) in group.items() if side == "u"]
+        found = {}
+        for over_line, over_odds, over_book in overs:
+            for under_line, under_odds, under_book in unders:
+                if over_book == under_book:
+                    continue
+                if over_line == under_line:
+                    total = implied_probability(over_odds) + implied_probability(under_odds)
+                    if total < 1.0:
+                        found[("arbitrage", over_book, under_book, over_line, over_odds, under_odds)] = {
+                            "type": "arbitrage", "edge": round(1.0 - total, 4),
+                        }
+                elif under_line - over_line >= self.middle_min_gap:
+                    found[("middle", over_book, under_book, over_line, under_line)] = {
+                        "type": "middle", "gap": under_line - over_line,
+                    }
+
+        # Report only opportunities that were not already open on the previous poll
+        previously_open = self._open_opportunities.get(group_key, set())
+        self._open_opportunities[group_key] = set(found)
+        events = []
+        for key, detail in found.items():
+            if key in previously_open:
+                continue
+            over_book, under_book = key[1], key[2]
+            over_line, over_odds = group[("o", over_book)]
+            under_line, under_odds = group[("u", under_book)]
+            events.append({
+                "script_timestamp": script_timestamp, "event_id": group_key[0], "player": group_key[1],
+                "market": group_key[2], "over_book": over_book, "over_line": over_line, "over_odds": over_odds,
+                "under_book": under_book, "under_line": under_line, "under_odds": under_odds, **detail,
+            })
+        return events
+
+# ------------------------ Sinks ------------------------
+
+def queue_sink(event_queue: "queue.Queue") -> Sink:
+    """Deliver events to a local queue, one event per item."""
+    def sink(events):
+        for event in events:
+            event_queue.put(event)
+    return sink
+
+
+def log_sink(level: int = logging.INFO) -> Sink:
+    """Write each event to the log as JSON; a stand-in for a webhook during development."""
+    def sink(events):
+        for event in events:
+            logging.log(level, f"[alert] {json.dumps(event, default=str)}")
+    return sink
+
+
+def webhook_sink(url: str, timeout: float = 5.0) -> Sink:
+    """POST each batch of events as a JSON array to a webhook URL."""
+    import requests
+
+    def sink(events):
+        response = requests.post(url, json=events, timeout=timeout)
+        response.raise_for_status()
+    return sink
+
+
+def _save_alerts(conn: sqlite3.Connection, events: List[Dict[str, Any]]) -> None:
+    conn.execute(f"""
+    CREATE TABLE IF NOT EXISTS {ALERTS_TABLE} (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        script_timestamp TEXT,
+        type TEXT,
+        event_id TEXT,
+        player TEXT,
+        market TEXT,
+        details TEXT
+    );
+    """)
+    conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{ALERTS_TABLE}_time ON {ALERTS_TABLE} (script_timestamp, type);")
+    conn.executemany(f"""
+        INSERT INTO {ALERTS_TABLE} (script_timestamp, type, event_id, player, market, details)
+        VALUES (?, ?, ?, ?, ?, ?);
+    """, [(e["script_timestamp"], e["type"], e["event_id"], e["player"], e["market"], json.dumps(e, default=str))
+          for e in events])
+
+
+def table_sink(database: str) -> Sink:
+    """Append events to the prop_alerts table through the shared writer, logging failed writes."""
+    def report(future):
+        if future.exception() is not None:
+            logging.error(f"Saving alerts to {database} failed: {future.exception()}")
+
+    def sink(events):
+        storage.submit_write(database, _save_alerts, events).add_done_callback(report)
+    return sink
@@ -8,7 +8,7 @@ st.set_page_config(page_title="NBA Update Monitor", layout="wide")
 
 # Sidebar navigation
 st.sidebar.title("Navigation")
-page = st.sidebar.radio("Go to:", ["Trigger Updates", "View Update History"])
+page = st.sidebar.radio("Go to:", ["Trigger Updates", "View Update History", "Board As Of"])
 
 # Determine the correct Python executable
 python_executable = sys.executable  # Dynamically detects the current Python executable
@@ -69,3 +69,25 @@ elif page == "View Update History":
     except FileNotFoundError:
         st.warning("No update history found. Logs will appear here after updates are triggered.")
 
+# Page 3: Board As Of
+elif page == "Board As Of":
+    import pandas as pd
+    import board
+
+    st.title("Board As Of")
+    st.write("Every main line on the board at a given moment, from the prop line state history.")
+
+    col_date, col_time = st.columns(2)
+    as_of_date = col_date.date_input("Date", value=datetime.now().date())
+    as_of_time = col_time.time_input("Time", value=datetime.now().time().replace(microsecond=0), step=300)
+    col_market, col_player = st.columns(2)
+    market_filter = col_market.text_input("Market (optional)").strip() or None
+    player_filter = col_player.text_input("Player (optional)").strip() or None
+
+    as_of = datetime.combine(as_of_date, as_of_time).strftime("%Y-%m-%d %H:%M:%S")
+    lines = board.as_of_board(as_of, market=market_filter, player=player_filter)
+    if not lines:
+        st.warning(f"No lines on the board at {as_of}.")
+    else:
+        st.caption(f"{len(lines)} lines at {as_of}")
+        st.dataframe(pd.DataFrame(lines), use_container_width=True)
@@ -0,0 +1,409 @@
+# archive.py
+
+import os
+import gzip
+import json
+import sqlite3
+import hashlib
+import logging
+import argparse
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor
+from urllib.parse import urlsplit
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import storage
+import metrics
+
+# ------------------------ Configuration ------------------------
+
+ARCHIVE_DB = os.environ.get("NBAPROPS_ARCHIVE", "raw_payloads.db")   # Kept apart so blobs never bloat nba.db
+ARCHIVE_ENABLED = os.environ.get("NBAPROPS_ARCHIVE_ENABLED", "1") != "0"
+ARCHIVED_SOURCES = ("leaguegamelog", "offers")
+BLOBS_TABLE = "payload_blobs"
+INDEX_TABLE = "payload_index"
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+ZSTD_LEVEL = 10                  # zstd is used when the zstandard package is installed, gzip otherwise
+GZIP_LEVEL = 6
+
+_local = threading.local()       # Poll label applied to payloads archived on this thread
+
+# ------------------------ Compression ------------------------
+
+def _zstd():
+    """Import zstandard lazily; gzip is the fallback, so it is never required."""
+    try:
+        import zstandard
+    except ImportError:
+        return None
+    return zstandard
+
+
+def compress(body: bytes) -> Tuple[str, bytes]:
+    """Return (codec, compressed bytes), preferring zstd when available."""
+    zstandard = _zstd()
+    if zstandard is not None:
+        return "zstd", zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(body)
+    return "gzip", gzip.compress(body, compresslevel=GZIP_LEVEL, mtime=0)
+
+
+def decompress(codec: str, data: bytes) -> bytes:
+    if codec == "gzip":
+        return gzip.decompress(data)
+    if codec == "zstd":
+        zstandard = _zstd()
+        if zstandard is None:
+            raise ImportError("This payload was archived with zstd (pip install zstandard).")
+        return zstandard.ZstdDecompressor().decompress(data)
+    raise ValueError(f"Unknown payload codec '{codec}'.")
+
+# ------------------------ Schema ------------------------
+
+def _create_tables(conn: sqlite3.Connection) -> None:
+    """
+    payload_blobs holds each distinct payload once, keyed by the SHA-256 of its raw
+    bytes; payload_index records every fetch (source, params, time) pointing at a blob.
+    """
+    conn.execute(f"""
+    CREATE TABLE IF NOT EXISTS {BLOBS_TABLE} (
+        hash TEXT PRIMARY KEY,
+        codec TEXT NOT NULL,
+        raw_bytes INTEGER,
+        stored_bytes INTEGER,
+        data BLOB NOT NULL
+    );
+    """)
+    conn.execute(f"""
+    CREATE TABLE IF NOT EXISTS {INDEX_TABLE} (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        source TEXT NOT NULL,
+        path TEXT,
+        params TEXT,
+        poll TEXT,
+        fetched_at TEXT NOT NULL,
+        hash TEXT NOT NULL REFERENCES {BLOBS_TABLE} (hash)
+    );
+    """)
+    conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{INDEX_TABLE}_source ON {INDEX_TABLE} (source, fetched_at);")
+
+# ------------------------ Archiving ------------------------
+
+@contextmanager
+def poll(label: str) -> Iterator[None]:
+    """
+    Tag payloads archived on this thread with a poll label, e.g. the props
+    script_timestamp, so reprocessing can rebuild the snapshot under its original time.
+    """
+    previous = getattr(_local, "poll", None)
+    _local.poll = label
+    try:
+        yield
+    finally:
+        _local.poll = previous
+
+
+def source_for(url: str) -> str:
+    """Archive source name of a URL: its last path segment, e.g. 'leaguegamelog' or 'offers'."""
+    return os.path.basename(urlsplit(url).path.rstrip("/")) or "root"
+
+
+def _store_payload(conn: sqlite3.Connection, source: str, path: str, params: str, poll_label: Optional[str],
+                   fetched_at: str, digest: str, blob: Optional[Tuple[str, int, bytes]]) -> bool:
+    _create_tables(conn)
+    stored = False
+    if blob is not None:
+        codec, raw_bytes, data = blob
+        stored = conn.execute(f"""
+            INSERT OR IGNORE INTO {BLOBS_TABLE} (hash, codec, raw_bytes, stored_bytes, data) VALUES (?, ?, ?, ?, ?);
+        """, (digest, codec, raw_bytes, len(data), data)).rowcount > 0
+    conn.execute(f"""
+        INSERT INTO {INDEX_TABLE} (source, path, params, poll, fetched_at, hash) VALUES (?, ?, ?, ?, ?, ?);
+    """, (source, path, params, poll_label, fetched_at, digest))
+    return stored
+
+
+def _has_blob(database: str, digest: str) -> bool:
+    try:
+        cursor = storage.get_connection(database).execute(f"SELECT 1 FROM {BLOBS_TABLE} WHERE hash = ?;", (digest,))
+    except sqlite3.OperationalError:
+        return False
+    return cursor.fetchone() is not None
+
+
+def archive_payload(url: str, params: Optional[Dict[str, Any]], body: bytes,
+                    database: Optional[str] = None, wait: bool = True) -> Optional[str]:
+    """
+    Archive one raw response body and return its hash. A body already in the
+    store (e.g. an unchanged repeated poll) is only indexed, never stored or
+    compressed again. Sources outside ARCHIVED_SOURCES are skipped. With
+    wait=False the write is queued on the writer and failures are only logged.
+    """
+    import fixtures
+
+    source = source_for(url)
+    if not ARCHIVE_ENABLED or source not in ARCHIVED_SOURCES:
+        return None
+    database = database or ARCHIVE_DB
+    digest = hashlib.sha256(body).hexdigest()
+    with metrics.track("archive", "write") as m:
+        blob = None
+        if not _has_blob(database, digest):
+            codec, data = compress(body)
+            blob = (codec, len(body), data)
+            m.bytes += len(data)
+        params_json = json.dumps(sorted(fixtures.normalize_params(params).items()))
+        future = storage.submit_write(database, _store_payload, source, urlsplit(url).path, params_json,
+                                      getattr(_local, "poll", None), datetime.now().strftime(TIMESTAMP_FORMAT),
+                                      digest, blob)
+        if wait:
+            m.rows += future.result()
+        else:
+            future.add_done_callback(lambda done: _report_archive_failure(source, done))
+    return digest
+
+
+def _report_archive_failure(source: str, future) -> None:
+    if future.exception() is not None:
+        logging.error(f"Archiving {source} payload failed: {future.exception()}")
+
+
+def archive_response(url: str, params: Optional[Dict[str, Any]], body: bytes) -> None:
+    """
+    archive_payload() for the fetch path: the write is queued rather than waited on,
+    and archiving problems are logged, never raised into the fetch.
+    """
+    try:
+        archive_payload(url, params, body, wait=False)
+    except (sqlite3.Error, OSError, ImportError) as e:
+        logging.error(f"Archiving {source_for(url)} payload failed: {e}")
+
+# ------------------------ Reading ------------------------
+
+def load_payload(database: str, digest: str) -> Dict[str, Any]:
+    """Decompress and decode one archived payload."""
+    row = storage.get_connection(database).execute(
+        f"SELECT codec, data FROM {BLOBS_TABLE} WHERE hash = ?;", (digest,)).fetchone()
+    if row is None:
+        raise KeyError(f"No archived payload {digest}")
+    return json.loads(decompress(row[0], row[1]))
+
+
+def list_payloads(source: str, database: Optional[str] = None, since: Optional[str] = None,
+                  until: Optional[str] = None) -> List[Dict[str, Any]]:
+    """Index entries of one source in fetch order, optionally limited to [since, until)."""
+    filters, values = "", [source]
+    if since:
+        filters += " AND fetched_at >= ?"
+        values.append(since)
+    if until:
+        filters += " AND fetched_at < ?"
+        values.append(until)
+    try:
+        cursor = storage.get_connection(database or ARCHIVE_DB).execute(f"""
+            SELECT id, path, params, poll, fetched_at, hash FROM {INDEX_TABLE}
+            WHERE source = ? {filters} ORDER BY fetched_at, id;
+        """, values)
+    except sqlite3.OperationalError as e:
+        logging.warning(f"No payload archive in {database or ARCHIVE_DB}: {e}")
+        return []
+    return [{"id": row[0], "path": row[1], "params": dict(json.loads(row[2] or "[]")),
+             "poll": row[3], "fetched_at": row[4], "hash": row[5]} for row in cursor.fetchall()]
+
+
+def archive_stats(database: Optional[str] = None) -> List[Tuple]:
+    """(source, fetches, distinct payloads, raw bytes, stored bytes) per source."""
+    cursor = storage.get_connection(database or ARCHIVE_DB).execute(f"""
+        WITH fetches AS (SELECT source, COUNT(*) AS n FROM {INDEX_TABLE} GROUP BY source),
+             payloads AS (SELECT DISTINCT source, hash FROM {INDEX_TABLE})
+        SELECT f.source, f.n, COUNT(*), SUM(b.raw_bytes), SUM(b.stored_bytes)
+        FROM fetches AS f JOIN payloads AS p USING (source) JOIN {BLOBS_TABLE} AS b USING (hash)
+        GROUP BY f.source ORDER BY f.source;
+    """)
+    return cursor.fetchall()
+
+# ------------------------ Reprocessing ------------------------
+
+_worker_resolver = None
+
+
+def _init_offers_worker(players_db: str) -> None:
+    """Load the player resolver once per worker process rather than once per payload."""
+    global _worker_resolver
+    from names_manager import PlayerResolver
+    _worker_resolver = PlayerResolver.from_database(players_db)
+
+
+def _parse_offers_task(args) -> Tuple[str, str, list]:
+    """Worker: decompress one market's pages of a poll and run them through the current offers parser."""
+    import props
+
+    database, script_timestamp, market_name, digests, keep_all_lines = args
+    resolve = _worker_resolver.resolve if _worker_resolver is not None else None
+    rows = []
+    for digest in digests:
+        rows.extend(props.parse_offers_data(load_payload(database, digest), market_name, script_timestamp,
+                                            keep_all_lines, resolve))
+    return script_timestamp, market_name, rows
+
+
+def _load_task(args) -> Dict[str, Any]:
+    """Worker: decompress and decode one payload."""
+    database, digest = args
+    return load_payload(database, digest)
+
+
+def _offer_tasks(entries: List[Dict[str, Any]], database: str, keep_all_lines: bool) -> List[tuple]:
+    """Group page payloads by (poll, market) so each task rebuilds exactly one stored market snapshot."""
+    import props
+
+    groups: Dict[Tuple[str, str], List[str]] = {}
+    for entry in entries:
+        market_id = int(entry["params"].get("market_id", 0) or 0)
+        market_name = props.MARKET_MAP.get(market_id)
+        if market_name is None:
+            logging.warning(f"Skipping archived offers for unknown market_id {market_id}.")
+            continue
+        digests = groups.setdefault((entry["poll"] or entry["fetched_at"], market_name), [])
+        if entry["hash"] not in digests:
+            digests.append(entry["hash"])
+    return [(database, timestamp, market_name, digests, keep_all_lines)
+            for (timestamp, market_name), digests in groups.items()]
+
+
+def reprocess_offers(database: Optional[str] = None, since: Optional[str] = None, until: Optional[str] = None,
+                     workers: Optional[int] = None, keep_all_lines: bool = False, rebuild_states: bool = True) -> int:
+    """
+    Re-parse archived offers payloads with the current parser and replace the
+    matching (script_timestamp, market) rows in prop_lines. Parsing runs across a
+    process pool; writes go through the single writer as results stream back.
+    The consensus of every replaced snapshot is recomputed, and its Parquet
+    partitions are rewritten. Line states fold every later snapshot onto earlier
+    ones, so with rebuild_states they are rebuilt from all of prop_lines afterwards.
+    """
+    import props
+    import board
+    import markets
+    import columnar
+
+    database = database or ARCHIVE_DB
+    tasks = _offer_tasks(list_payloads("offers", database, since, until), database, keep_all_lines)
+    if not tasks:
+        return 0
+    written = 0
+    pending = []
+    consensus = []
+    partitions = set()
+
+    def replace(results):
+        for script_timestamp, market_name, rows in results:
+            pending.append(props.replace_market_snapshot(props.DB_FILE, "prop_lines",
+                                                         script_timestamp, market_name, rows))
+            consensus.append(markets.replace_consensus(props.DB_FILE, script_timestamp, market_name, rows))
+            partitions.add((script_timestamp[:10], market_name))
+
+    workers = min(workers or os.cpu_count() or 1, len(tasks))
+    with metrics.track("archive", "reprocess_offers") as m:
+        if workers == 1:
+            _init_offers_worker(props.DB_FILE)
+            replace(map(_parse_offers_task, tasks))
+        else:
+            with ProcessPoolExecutor(max_workers=workers, initializer=_init_offers_worker,
+                                     initargs=(props.DB_FILE,)) as executor:
+                replace(executor.map(_parse_offers_task, tasks))
+        for future in pending:
+            written += future.result()
+        for future in consensus:
+            future.result()
+        m.rows += written
+    logging.info(f"Reprocessed {len(tasks)} archived market snapshot(s) into {written} prop lines.")
+    columnar.export_after_ingest(lambda db: columnar.rewrite_prop_lines(db, partitions), props.DB_FILE)
+    if rebuild_states:
+        board.rebuild_line_states(props.DB_FILE)
+    return written
+
+
+def _store_game_log_payloads(payloads: Iterator[Dict[str, Any]]) -> int:
+    """Ingest decoded leaguegamelog payloads in order, so later corrections win."""
+    import logs
+    import game_logs
+
+    stored = 0
+    for payload in payloads:
+        stored += logs.ingest_game_logs(payload, logs.DATABASE_NAME)
+        game_logs.store_league_game_log(payload, game_logs.DATABASE_NAME)
+    return stored
+
+
+def reprocess_game_logs(database: Optional[str] = None, since: Optional[str] = None, until: Optional[str] = None,
+                        workers: Optional[int] = None) -> int:
+    """
+    Replay archived leaguegamelog payloads, in fetch order, through the current
+    ingest for both nba.db and nba_game_logs.db. Payloads are decompressed and
+    decoded in worker processes; the stores merge, so replays are idempotent.
+    """
+    import logs
+
+    database = database or ARCHIVE_DB
+    digests = []
+    for entry in list_payloads("leaguegamelog", database, since, until):
+        if entry["hash"] not in digests[-1:]:  # Consecutive identical polls add nothing
+            digests.append(entry["hash"])
+    if not digests:
+        return 0
+    stored = 0
+    tasks = [(database, digest) for digest in digests]
+    workers = min(workers or os.cpu_count() or 1, len(tasks))
+    logs.initialize_database(logs.DATABASE_NAME)
+    with metrics.track("archive", "reprocess_game_logs") as m:
+        if workers == 1:
+            stored += _store_game_log_payloads(map(_load_task, tasks))
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                stored += _store_game_log_payloads(executor.map(_load_task, tasks))
+        m.rows += stored
+    logging.info(f"Reprocessed {len(digests)} archived game log payload(s): {stored} game logs stored.")
+    return stored
+
+
+def reprocess(sources=ARCHIVED_SOURCES, database: Optional[str] = None, since: Optional[str] = None,
+              until: Optional[str] = None, workers: Optional[int] = None, keep_all_lines: bool = False,
+              rebuild_states: bool = True) -> int:
+    """Reprocess every requested archived source with the current parsers."""
+    total = 0
+    if "leaguegamelog" in sources:
+        total += reprocess_game_logs(database, since, until, workers)
+    if "offers" in sources:
+        total += reprocess_offers(database, since, until, workers, keep_all_lines, rebuild_states)
+    return total
+
+# ------------------------ Command Line ------------------------
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description="Inspect or reprocess the raw API payload archive.")
+    parser.add_argument("command", choices=["stats", "reprocess"])
+    parser.add_argument("--source", choices=ARCHIVED_SOURCES, action="append",
+                        help="reprocess: only this source (repeatable; default all).")
+    parser.add_argument("--since", default=None, help="Only payloads fetched at or after 'YYYY-MM-DD HH:MM:SS'.")
+    parser.add_argument("--until", default=None, help="Only payloads fetched before 'YYYY-MM-DD HH:MM:SS'.")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes (default: one per core).")
+    parser.add_argument("--all-lines", action="store_true", help="Keep alternate lines when re-parsing offers.")
+    parser.add_argument("--no-rebuild-states", action="store_true",
+                        help="reprocess: leave the line states as they are after replacing offers.")
+    parser.add_argument("--database", default=None, help=f"Archive database (default: {ARCHIVE_DB}).")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    if args.command == "stats":
+        for source, fetches, payloads, raw_bytes, stored_bytes in archive_stats(args.database):
+            print(f"{source}: {fetches} fetches, {payloads} distinct payloads, "
+                  f"{raw_bytes / 1e6:.1f} MB raw -> {stored_bytes / 1e6:.1f} MB stored")
+        return
+    reprocess(args.source or ARCHIVED_SOURCES, args.database, args.since, args.until, args.workers, args.all_lines,
+              not args.no_rebuild_states)
+    metrics.export(ARCHIVE_DB if args.database is None else args.database)
+
+
+if __name__ == "__main__":
+    main()
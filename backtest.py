@@ -0,0 +1,384 @@
+# backtest.py
+
+import os
+import sqlite3
+import logging
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, Iterable, Iterator, List, NamedTuple, Optional, Sequence, Tuple, Union
+
+import storage
+import markets
+import db_status
+from alerts import implied_probability
+from projections import MARKET_WEIGHTS
+
+# ------------------------ Configuration ------------------------
+
+DATABASE_NAME = "nba.db"
+CHUNK_SIZE = 20000               # prop_lines rows fetched per round trip
+DEFAULT_STAKE = 1.0
+EDGE_THRESHOLDS = (0.0, 0.02, 0.04, 0.06)
+
+# Projection stat names -> lowercase game_logs columns in nba.db
+STAT_COLUMNS = {"PTS": "pts", "REB": "reb", "AST": "ast", "FG3M": "fg3m", "STL": "stl", "BLK": "blk", "TOV": "tov"}
+
+# ------------------------ Records ------------------------
+
+class Offer(NamedTuple):
+    """One prop_lines row as seen by a strategy."""
+    script_timestamp: str
+    event_id: str
+    player: str
+    market: str
+    selection: str
+    prop_line: float
+    odds: float
+    bookie: str
+    player_id: Optional[int] = None
+
+
+class Bet(NamedTuple):
+    """A bet placed by a strategy on a single offer."""
+    strategy: str
+    offer: Offer
+    stake: float
+
+
+class BacktestContext:
+    """
+    Point-in-time view handed to strategies. Game history is limited to games
+    played before the snapshot's date, so strategies cannot look ahead.
+    """
+
+    def __init__(self, conn: sqlite3.Connection, as_of: str, resolver=None):
+        self._conn = conn
+        self._resolver = resolver
+        self.as_of = as_of
+        self.as_of_date = as_of[:10]
+
+    def player_games(self, player: Union[str, int], limit: int = 20) -> List[Dict[str, Any]]:
+        """
+        Return the player's most recent game logs strictly before the snapshot date.
+        `player` is a player_id or a name, resolved through primary and alternate names.
+        """
+        player_id = player if isinstance(player, int) or self._resolver is None else self._resolver.resolve(player)
+        cursor = self._conn.execute("""
+            SELECT * FROM game_logs WHERE player_id = ? AND game_date < ?
+            ORDER BY game_date DESC LIMIT ?;
+        """, (player_id, self.as_of_date, limit))
+        columns = [desc[0] for desc in cursor.description]
+        return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+# ------------------------ Strategies ------------------------
+
+class EdgeStrategy:
+    """
+    Bet any book's price whose implied probability is at least `threshold` below
+    the de-vigged cross-book consensus for the same (event, player, market, line).
+    Uses only the snapshot itself, so it is free of lookahead by construction.
+    """
+
+    def __init__(self, threshold: float = 0.0, stake: float = DEFAULT_STAKE):
+        self.threshold = threshold
+        self.stake = stake
+        self.name = f"edge>={threshold:.2f}"
+
+    def __call__(self, snapshot: Sequence[Offer], context: BacktestContext) -> List[Bet]:
+        fair = {}
+        for row in markets.compute_consensus(snapshot):
+            _, event_id, player, market, line, books, over_prob, under_prob = row[:8]
+            if books >= 2 and over_prob is not None:
+                fair[(event_id, player, market, line)] = (over_prob, under_prob)
+        bets = []
+        for offer in snapshot:
+            probs = fair.get((str(offer.event_id), offer.player, offer.market, offer.prop_line))
+            if probs is None:
+                continue
+            fair_prob = probs[0] if offer.selection[:1].lower() == "o" else probs[1]
+            if fair_prob - implied_probability(offer.odds) >= self.threshold:
+                bets.append(Bet(self.name, offer, self.stake))
+        return bets
+
+# ------------------------ Replay ------------------------
+
+def iter_snapshots(conn: sqlite3.Connection, date: str, resolver=None) -> Iterator[List[Offer]]:
+    """
+    Stream the main-line snapshots of the events first quoted on a day, from that day
+    on, in time order, CHUNK_SIZE rows at a time, yielding each complete snapshot as a
+    list of Offers. Every event belongs to exactly one day, so its offers are replayed once.
+    Offers stored without a player_id get one from `resolver` (a PlayerResolver), if given.
+    """
+    cursor = conn.execute("PRAGMA table_info(prop_lines);")
+    columns = {row[1] for row in cursor.fetchall()}
+    main_filter = "AND COALESCE(is_main, 1) = 1" if "is_main" in columns else ""
+    player_id = "player_id" if "player_id" in columns else "NULL"
+    cursor = conn.execute(f"""
+        SELECT script_timestamp, event_id, player, market, selection, prop_line, odds, bookie, {player_id}
+        FROM prop_lines
+        WHERE event_id IN ({_DAY_EVENTS}) AND script_timestamp >= ? {main_filter}
+        ORDER BY script_timestamp, id;
+    """, (date, date, date, date))
+    current: List[Offer] = []
+    while True:
+        rows = cursor.fetchmany(CHUNK_SIZE)
+        if not rows:
+            break
+        for row in rows:
+            player_id = row[8] if row[8] is not None or resolver is None else resolver.resolve(row[2])
+            try:
+                offer = Offer(row[0], str(row[1]), row[2], row[3], row[4], float(row[5]), float(row[6]), row[7], player_id)
+            except (TypeError, ValueError):
+                continue
+            if current and offer.script_timestamp != current[0].script_timestamp:
+                yield current
+                current = []
+            current.append(offer)
+    if current:
+        yield current
+
+
+# Events first quoted on a day (parameters: date, date, date)
+_DAY_EVENTS = """
+    SELECT DISTINCT day.event_id FROM prop_lines day
+    WHERE day.script_timestamp >= ? AND day.script_timestamp < date(?, '+1 day')
+      AND NOT EXISTS (
+          SELECT 1 FROM prop_lines earlier WHERE earlier.event_id = day.event_id AND earlier.script_timestamp < ?
+      )
+"""
+
+
+def _closing_odds(conn: sqlite3.Connection, date: str) -> Dict[tuple, float]:
+    """
+    Last quoted odds of every offer on the events first quoted on a day, used for
+    closing line value. An event's quotes on later days count, so a prop posted the
+    day before its game closes at its last pre-game price.
+    """
+    cursor = conn.execute(f"""
+        SELECT event_id, player, market, selection, bookie, prop_line, odds FROM prop_lines
+        WHERE id IN (
+            SELECT MAX(id) FROM prop_lines
+            WHERE event_id IN ({_DAY_EVENTS})
+            GROUP BY event_id, player, market, selection, bookie, prop_line
+        );
+    """, (date, date, date))
+    closing = {}
+    for event_id, player, market, selection, bookie, prop_line, odds in cursor.fetchall():
+        try:
+            closing[(str(event_id), player, market, selection, bookie, float(prop_line))] = float(odds)
+        except (TypeError, ValueError):
+            continue
+    return closing
+
+
+def _load_event_players(conn: sqlite3.Connection, date: str, resolver) -> None:
+    """
+    Fill temp.event_players with the player_id of every player quoted on the events first
+    quoted on a day: the stored player_id, or the name resolved through primary and
+    alternate names for rows stored without one.
+    """
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(prop_lines);").fetchall()}
+    player_id = "player_id" if "player_id" in columns else "NULL"
+    cursor = conn.execute(f"""
+        SELECT DISTINCT event_id, player, {player_id} FROM prop_lines WHERE event_id IN ({_DAY_EVENTS});
+    """, (date, date, date))
+    pairs = set()
+    for event_id, player, stored_id in cursor.fetchall():
+        resolved = stored_id if stored_id is not None else resolver.resolve(player)
+        if resolved is not None:
+            pairs.add((event_id, resolved))
+    conn.execute("CREATE TEMP TABLE IF NOT EXISTS event_players (event_id TEXT, player_id INTEGER);")
+    conn.execute("DELETE FROM temp.event_players;")
+    conn.executemany("INSERT INTO temp.event_players (event_id, player_id) VALUES (?, ?);", pairs)
+
+
+def _event_game_dates(conn: sqlite3.Connection, date: str, resolver) -> Dict[str, str]:
+    """
+    Game date of every event first quoted on a day. Offers carry no game date, and props
+    go up on game day or the day before, so it is the date within [first snapshot day,
+    next day] on which most of the event's players played (the earlier on a tie).
+    Events with no game logs in that window are left out, and their bets are void.
+    """
+    _load_event_players(conn, date, resolver)
+    cursor = conn.execute(f"""
+        WITH events AS (
+            SELECT event_id, substr(MIN(script_timestamp), 1, 10) AS first_seen FROM prop_lines
+            WHERE event_id IN ({_DAY_EVENTS})
+            GROUP BY event_id
+        ),
+        player_dates AS (
+            SELECT e.event_id, g.game_date, COUNT(DISTINCT g.player_id) AS players FROM events e
+            JOIN temp.event_players ep ON ep.event_id = e.event_id
+            JOIN game_logs g ON g.player_id = ep.player_id
+                AND g.game_date >= e.first_seen AND g.game_date < date(e.first_seen, '+2 days')
+            GROUP BY e.event_id, g.game_date
+        )
+        SELECT event_id, game_date FROM player_dates pd
+        WHERE NOT EXISTS (
+            SELECT 1 FROM player_dates other WHERE other.event_id = pd.event_id
+              AND (other.players > pd.players OR (other.players = pd.players AND other.game_date < pd.game_date))
+        );
+    """, (date, date, date))
+    return {str(event_id): game_date for event_id, game_date in cursor.fetchall() if game_date}
+
+
+def _results_for_dates(conn: sqlite3.Connection, dates: Iterable[str]) -> Dict[tuple, Dict[str, float]]:
+    """Box score stats for every player who played on the given dates, keyed by (game_date, player_id)."""
+    columns = ", ".join(STAT_COLUMNS.values())
+    results = {}
+    for date in sorted(set(dates)):
+        cursor = conn.execute(f"SELECT player_id, {columns} FROM game_logs WHERE game_date = ?;", (date,))
+        for row in cursor.fetchall():
+            results[(date, row[0])] = dict(zip(STAT_COLUMNS, row[1:]))
+    return results
+
+
+def _payout(odds: float, stake: float) -> float:
+    """Profit on a winning bet at American odds."""
+    return stake * odds / 100.0 if odds > 0 else stake * 100.0 / -odds
+
+
+def _settle(bet: Bet, stats: Optional[Dict[str, float]], closing_odds: Optional[float]) -> Optional[Tuple[float, float]]:
+    """Return (profit, clv) for a bet, or None when it is void (no game, unsupported market)."""
+    offer = bet.offer
+    weights = MARKET_WEIGHTS.get(offer.market)
+    if stats is None or weights is None or any(stats.get(stat) is None for stat in weights):
+        return None
+    outcome = sum(stats[stat] * weight for stat, weight in weights.items())
+    over = offer.selection[:1].lower() == "o"
+    if outcome == offer.prop_line:
+        profit = 0.0
+    elif (outcome > offer.prop_line) == over:
+        profit = _payout(offer.odds, bet.stake)
+    else:
+        profit = -bet.stake
+    # Positive CLV means the bet was placed at a better price than the close
+    clv = implied_probability(closing_odds) - implied_probability(offer.odds) if closing_odds is not None else None
+    return profit, clv
+
+
+def run_day(database: str, date: str, strategies: Sequence[Any]) -> Dict[tuple, List[float]]:
+    """
+    Replay the events first quoted on one day and return settled totals keyed by
+    (strategy, market, bookie): [bets, staked, profit, clv_sum, clv_count]. Each strategy
+    bets each side of a prop (event, player, market, selection) at most once in the run.
+    """
+    from names_manager import PlayerResolver
+
+    conn = storage.connect(database)
+    try:
+        # Offers stored without a player_id (or under a reconciled alias) are matched by name
+        resolver = PlayerResolver.from_connection(conn)
+        closing = _closing_odds(conn, date)
+        game_dates = _event_game_dates(conn, date, resolver)
+        results = _results_for_dates(conn, game_dates.values())
+        totals: Dict[tuple, List[float]] = defaultdict(lambda: [0, 0.0, 0.0, 0.0, 0])
+        placed = set()
+        for snapshot in iter_snapshots(conn, date, resolver):
+            context = BacktestContext(conn, snapshot[0].script_timestamp, resolver)
+            for strategy in strategies:
+                for bet in strategy(snapshot, context):
+                    offer = bet.offer
+                    key = (bet.strategy, offer.event_id, offer.player, offer.market, offer.selection)
+                    if key in placed:
+                        continue
+                    placed.add(key)
+                    closing_key = (offer.event_id, offer.player, offer.market, offer.selection,
+                                   offer.bookie, offer.prop_line)
+                    # Settle against the event's game, which may be after the snapshot's date
+                    stats = results.get((game_dates.get(offer.event_id), offer.player_id))
+                    settled = _settle(bet, stats, closing.get(closing_key))
+                    if settled is None:
+                        continue
+                    profit, clv = settled
+                    total = totals[(bet.strategy, offer.market, offer.bookie)]
+                    total[0] += 1
+                    total[1] += bet.stake
+                    total[2] += profit
+                    if clv is not None:
+                        total[3] += clv
+                        total[4] += 1
+        return dict(totals)
+    finally:
+        conn.close()
+
+
+def _run_day_task(args):
+    return run_day(*args)
+
+
+def _combine_totals(combined: Dict[tuple, List[float]], day_totals: Iterable[Dict[tuple, List[float]]]) -> None:
+    for totals in day_totals:
+        for key, values in totals.items():
+            combined[key] = [a + b for a, b in zip(combined[key], values)]
+
+
+def snapshot_dates(database: str, start: Optional[str] = None, end: Optional[str] = None) -> List[str]:
+    """Distinct snapshot dates in prop_lines, optionally limited to [start, end]."""
+    cursor = storage.get_connection(database).execute("""
+        SELECT DISTINCT substr(script_timestamp, 1, 10) FROM prop_lines
+        WHERE (? IS NULL OR script_timestamp >= ?) AND (? IS NULL OR script_timestamp < date(?, '+1 day'))
+        ORDER BY 1;
+    """, (start, start, end, end))
+    return [row[0] for row in cursor.fetchall()]
+
+
+def run_backtest(database: str = DATABASE_NAME, strategies: Optional[Sequence[Any]] = None,
+                 start: Optional[str] = None, end: Optional[str] = None,
+                 workers: Optional[int] = None) -> List[Dict[str, Any]]:
+    """
+    Replay stored snapshots through the strategies, one task per day of events first
+    quoted that day, across a process pool, and return ROI and CLV rows by
+    (strategy, market, bookie).
+    Strategies must be picklable (e.g. module-level classes) to run in workers.
+    """
+    strategies = list(strategies or [EdgeStrategy(threshold) for threshold in EDGE_THRESHOLDS])
+    dates = snapshot_dates(database, start, end)
+    if not dates:
+        logging.warning("No prop snapshots to backtest.")
+        return []
+    # Every day scans its snapshots by time and settles against game logs by date
+    db_status.record_query_pattern(database, "prop_lines", ["script_timestamp"], uses=len(dates))
+    db_status.record_query_pattern(database, "game_logs", ["game_date"], uses=len(dates))
+    workers = min(workers or os.cpu_count() or 1, len(dates))
+    tasks = [(database, date, strategies) for date in dates]
+    combined: Dict[tuple, List[float]] = defaultdict(lambda: [0, 0.0, 0.0, 0.0, 0])
+    if workers == 1:
+        _combine_totals(combined, map(_run_day_task, tasks))
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            _combine_totals(combined, executor.map(_run_day_task, tasks))
+
+    report = []
+    for (strategy, market, bookie), (bets, staked, profit, clv_sum, clv_count) in sorted(combined.items()):
+        report.append({
+            "strategy": strategy, "market": market, "bookie": bookie, "bets": bets,
+            "staked": staked, "profit": round(profit, 4),
+            "roi": round(profit / staked, 4) if staked else None,
+            "avg_clv": round(clv_sum / clv_count, 4) if clv_count else None,
+        })
+    logging.info(f"Backtested {len(dates)} days with {len(strategies)} strategies.")
+    return report
+
+
+def print_report(report: List[Dict[str, Any]]) -> None:
+    """Print ROI and CLV per strategy and per (strategy, market, bookie)."""
+    by_strategy: Dict[str, List[float]] = defaultdict(lambda: [0, 0.0, 0.0])
+    for row in report:
+        total = by_strategy[row["strategy"]]
+        total[0] += row["bets"]
+        total[1] += row["staked"]
+        total[2] += row["profit"]
+    print("\nStrategy summary:")
+    for strategy, (bets, staked, profit) in sorted(by_strategy.items()):
+        print(f"  {strategy:<14} bets {bets:>7}  profit {profit:>10.2f}  ROI {profit / staked if staked else 0:>7.2%}")
+    print("\nBy market and book:")
+    for row in report:
+        clv = f"{row['avg_clv']:+.4f}" if row["avg_clv"] is not None else "   n/a"
+        print(f"  {row['strategy']:<14} {row['market']:<24} {row['bookie']:<12} bets {row['bets']:>6}  "
+              f"ROI {row['roi'] or 0:>7.2%}  CLV {clv}")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    print_report(run_backtest())
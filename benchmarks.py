@@ -0,0 +1,363 @@
+# benchmarks.py
+
+import os
+import sys
+import json
+import time
+import random
+import logging
+import sqlite3
+import argparse
+import platform
+import tempfile
+import subprocess
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, List, Optional
+
+import storage
+
+# ------------------------ Configuration ------------------------
+
+SEED = 2024
+REPEATS = 3
+
+# (players, games) for game log payloads and (offers, books, lines per book) for offers payloads
+SCALES = {
+    "small": {"game_logs": (50, 10), "offers": (100, 5, 2), "names": 100},
+    "medium": {"game_logs": (450, 20), "offers": (500, 5, 4), "names": 450},
+    "large": {"game_logs": (450, 82), "offers": (2000, 5, 8), "names": 1000},
+}
+
+GAME_LOG_HEADERS = [
+    "SEASON_ID", "PLAYER_ID", "PLAYER_NAME", "TEAM_ID", "TEAM_ABBREVIATION", "TEAM_NAME",
+    "GAME_ID", "GAME_DATE", "MATCHUP", "WL", "MIN", "FGM", "FGA", "FG_PCT", "FG3M", "FG3A",
+    "FG3_PCT", "FTM", "FTA", "FT_PCT", "OREB", "DREB", "REB", "AST", "STL", "BLK", "TOV",
+    "PF", "PTS", "PLUS_MINUS", "FANTASY_PTS", "VIDEO_AVAILABLE",
+]
+
+PLAYER_INDEX_HEADERS = ["PERSON_ID", "PLAYER_LAST_NAME", "PLAYER_FIRST_NAME", "TEAM_ABBREVIATION", "POSITION"]
+PLAYER_POSITIONS = ["G", "G", "F", "F", "C", "G-F", "F-C"]
+
+TEAMS = [
+    "ATL", "BOS", "BKN", "CHA", "CHI", "CLE", "DAL", "DEN", "DET", "GSW", "HOU", "IND", "LAC", "LAL", "MEM",
+    "MIA", "MIL", "MIN", "NOP", "NYK", "OKC", "ORL", "PHI", "PHX", "POR", "SAC", "SAS", "TOR", "UTA", "WAS",
+]
+
+FIRST_NAMES = ["James", "Luka", "Jayson", "Nikola", "Anthony", "Kevin", "Stephen", "Devin", "Tyrese", "Jalen",
+               "Donovan", "Shai", "Trae", "Ja", "Zion", "Paolo", "Victor", "De'Aaron", "Karl-Anthony", "OG"]
+LAST_NAMES = ["Smith", "Johnson", "Williams", "Brown", "Jones", "Davis", "Miller", "Wilson", "Moore", "Taylor",
+              "Anderson", "Thomas", "Jackson", "White", "Harris", "Martin", "Thompson", "Garcia", "Martinez", "Robinson"]
+SUFFIXES = ["", "", "", "", " Jr.", " II", " III", " Sr."]
+
+# ------------------------ Synthetic Data Generators ------------------------
+
+def _player_names(count: int, rng: random.Random) -> List[str]:
+    """Return `count` distinct, realistic-looking player names."""
+    names = []
+    seen = set()
+    while len(names) < count:
+        name = f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}{rng.choice(SUFFIXES)}"
+        if name in seen:
+            name = f"{name} {len(names)}"
+        seen.add(name)
+        names.append(name)
+    return names
+
+
+def make_game_log_payload(n_players: int, n_games: int, seed: int = SEED) -> Dict[str, Any]:
+    """
+    Build a deterministic `leaguegamelog` response with n_players x n_games rows,
+    shaped exactly like the NBA Stats API payload.
+    """
+    rng = random.Random(seed)
+    names = _player_names(n_players, rng)
+    start = datetime(2024, 10, 22)
+    rows = []
+    for player_index, name in enumerate(names):
+        team_index = player_index % len(TEAMS)
+        team = TEAMS[team_index]
+        for game_index in range(n_games):
+            opponent = TEAMS[(team_index + game_index + 1) % len(TEAMS)]
+            home = game_index % 2 == 0
+            minutes = rng.randint(0, 42)
+            fga = rng.randint(0, max(1, minutes // 2))
+            fgm = rng.randint(0, fga)
+            fg3a = rng.randint(0, fga)
+            fg3m = rng.randint(0, min(fg3a, fgm))
+            fta = rng.randint(0, 12)
+            ftm = rng.randint(0, fta)
+            oreb, dreb = rng.randint(0, 5), rng.randint(0, 12)
+            ast, stl, blk, tov = rng.randint(0, 12), rng.randint(0, 4), rng.randint(0, 4), rng.randint(0, 6)
+            pts = 2 * (fgm - fg3m) + 3 * fg3m + ftm
+            reb = oreb + dreb
+            rows.append([
+                "22024", 1000 + player_index, name, 1610612700 + team_index, team, f"{team} Team",
+                f"00224{game_index * 15 + team_index // 2:05d}",
+                (start + timedelta(days=game_index * 2)).strftime("%Y-%m-%d"),
+                f"{team} vs. {opponent}" if home else f"{team} @ {opponent}",
+                rng.choice(["W", "L"]), minutes, fgm, fga, round(fgm / fga, 3) if fga else None,
+                fg3m, fg3a, round(fg3m / fg3a, 3) if fg3a else None, ftm, fta,
+                round(ftm / fta, 3) if fta else None, oreb, dreb, reb, ast, stl, blk, tov,
+                rng.randint(0, 6), pts, rng.randint(-25, 25),
+                round(pts + 1.2 * reb + 1.5 * ast + 3 * (stl + blk) - tov, 1), 1,
+            ])
+    return {
+        "resource": "leaguegamelog",
+        "resultSets": [{"name": "LeagueGameLog", "headers": GAME_LOG_HEADERS, "rowSet": rows}],
+    }
+
+
+def make_player_index_payload(n_players: int, seed: int = SEED) -> Dict[str, Any]:
+    """
+    Build a `playerindex` response for the players of make_game_log_payload(n_players, ...),
+    with the same ids, names and teams and a position per player.
+    """
+    rng = random.Random(seed)
+    names = _player_names(n_players, rng)
+    rows = []
+    for player_index, name in enumerate(names):
+        first_name, _, last_name = name.partition(" ")
+        rows.append([1000 + player_index, last_name, first_name, TEAMS[player_index % len(TEAMS)],
+                     PLAYER_POSITIONS[player_index % len(PLAYER_POSITIONS)]])
+    return {
+        "resource": "playerindex",
+        "resultSets": [{"name": "PlayerIndex", "headers": PLAYER_INDEX_HEADERS, "rowSet": rows}],
+    }
+
+
+def make_offers_payload(n_offers: int, n_books: int, n_lines: int, seed: int = SEED) -> Dict[str, Any]:
+    """
+    Build a deterministic bettingpros `offers` response: n_offers player offers, each with
+    Over/Under selections quoted by n_books books holding n_lines lines apiece.
+    """
+    rng = random.Random(seed)
+    names = _player_names(n_offers, rng)
+    book_ids = [0, 19, 12, 10, 33] + list(range(100, 100 + max(0, n_books - 5)))
+    start = datetime(2024, 11, 5, 12, 0, 0)
+    offers = []
+    for offer_index, name in enumerate(names):
+        base_line = rng.randint(5, 30) + 0.5
+        selections = []
+        for label in ("Over", "Under"):
+            books = []
+            for book_id in book_ids[:n_books]:
+                lines = []
+                for line_index in range(n_lines):
+                    updated = start + timedelta(minutes=rng.randint(0, 600))
+                    lines.append({
+                        "line": base_line + rng.choice([-1, -0.5, 0, 0, 0.5, 1]),
+                        "cost": rng.choice([-135, -125, -120, -115, -110, -105, 100, 105, 110]),
+                        "updated": updated.strftime("%Y-%m-%d %H:%M:%S"),
+                        "active": line_index == 0 or rng.random() < 0.7,
+                    })
+                books.append({"id": book_id, "lines": lines})
+            selections.append({"label": label, "books": books})
+        offers.append({
+            "event_id": 25313 + offer_index % 8,
+            "participants": [{
+                "name": name,
+                "player": {"position": rng.choice(["G", "F", "C"]), "team": TEAMS[offer_index % len(TEAMS)]},
+            }],
+            "selections": selections,
+        })
+    return {"offers": offers}
+
+
+def game_log_records(payload: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Convert a game log payload to the list of row dicts `logs.main` passes to the parsers."""
+    result_set = payload["resultSets"][0]
+    headers = result_set["headers"]
+    return [dict(zip(headers, row)) for row in result_set["rowSet"]]
+
+
+def perturb_names(names: List[str], seed: int = SEED) -> List[str]:
+    """Return sportsbook-style spellings of player names: dropped suffixes, typos, unchanged."""
+    rng = random.Random(seed)
+    perturbed = []
+    for name in names:
+        roll = rng.random()
+        if roll < 0.1:
+            for suffix in (" Jr.", " II", " III", " Sr."):
+                name = name.replace(suffix, "")
+        elif roll < 0.15 and len(name) > 4:
+            index = rng.randint(1, len(name) - 2)
+            name = name[:index] + name[index + 1] + name[index] + name[index + 2:]
+        perturbed.append(name)
+    return perturbed
+
+# ------------------------ Timing ------------------------
+
+def _time(func: Callable[[], Any], setup: Optional[Callable[[], Any]] = None, repeats: int = REPEATS) -> List[float]:
+    """Time func() `repeats` times, calling setup() untimed before each run."""
+    timings = []
+    for _ in range(repeats):
+        if setup:
+            setup()
+        started = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - started)
+    return timings
+
+
+def _legacy_game_logs_db(path: str, payload: Dict[str, Any]) -> None:
+    """Create the uppercase 'game_logs' table `minute.py` reads, filled from a payload."""
+    conn = sqlite3.connect(path)
+    text_columns = {"SEASON_ID", "PLAYER_NAME", "TEAM_ABBREVIATION", "TEAM_NAME",
+                    "GAME_ID", "GAME_DATE", "MATCHUP", "WL"}
+    real_columns = {"FG_PCT", "FG3_PCT", "FT_PCT", "FANTASY_PTS"}
+    columns = ", ".join(
+        f"{h} {'TEXT' if h in text_columns else 'REAL' if h in real_columns else 'INTEGER'}"
+        for h in GAME_LOG_HEADERS
+    )
+    conn.execute(f"CREATE TABLE game_logs ({columns});")
+    placeholders = ", ".join("?" for _ in GAME_LOG_HEADERS)
+    conn.executemany(f"INSERT INTO game_logs VALUES ({placeholders});", payload["resultSets"][0]["rowSet"])
+    conn.commit()
+    conn.close()
+
+
+def benchmark_scale(scale: str, workdir: str, repeats: int = REPEATS) -> List[Dict[str, Any]]:
+    """Run every stage benchmark at one scale and return the result records."""
+    config = SCALES[scale]
+    n_players, n_games = config["game_logs"]
+    n_offers, n_books, n_lines = config["offers"]
+    game_payload = make_game_log_payload(n_players, n_games)
+    offers_payload = make_offers_payload(n_offers, n_books, n_lines)
+    records = game_log_records(game_payload)
+    results = []
+    counter = iter(range(10 ** 9))
+
+    def fresh_db(prefix: str) -> str:
+        return os.path.join(workdir, f"{prefix}_{scale}_{next(counter)}.db")
+
+    def record(stage: str, rows: int, run: Callable[[], List[float]]) -> None:
+        try:
+            timings = run()
+        except ImportError as e:
+            logging.warning(f"Skipping {stage} at {scale}: {e}")
+            results.append({"stage": stage, "scale": scale, "rows": rows, "skipped": str(e)})
+            return
+        best = min(timings)
+        results.append({
+            "stage": stage, "scale": scale, "rows": rows,
+            "best_s": round(best, 6), "mean_s": round(sum(timings) / len(timings), 6),
+            "rows_per_s": round(rows / best, 1) if best else None,
+        })
+        print(f"{stage:<28} {scale:<7} {rows:>9} rows  best {best * 1000:9.2f} ms")
+
+    # Game log parsing and upserts
+    def run_parse_game_logs():
+        import logs
+        return _time(lambda: (logs.parse_players(records), logs.parse_game_log_data(records)), repeats=repeats)
+    record("parse_game_log_data", len(records), run_parse_game_logs)
+
+    def run_upsert_game_logs():
+        import logs
+        players = logs.parse_players(records)
+        parsed = logs.parse_game_log_data(records)
+        state = {}
+
+        def setup():
+            state["db"] = fresh_db("logs")
+            logs.initialize_database(state["db"])
+        return _time(lambda: storage.run_write(state["db"], logs.store_game_logs, players, parsed),
+                     setup=setup, repeats=repeats)
+    record("upsert_game_logs", len(records), run_upsert_game_logs)
+
+    # Offer parsing and writes
+    def run_parse_offers():
+        import props
+        return _time(lambda: props.parse_offers_data(offers_payload, "Points_o_u", "2024-11-05 18:00:00"),
+                     repeats=repeats)
+    offer_rows = n_offers * 2 * n_books
+    record("parse_offers_data", offer_rows, run_parse_offers)
+
+    def run_save_offers():
+        import props
+        parsed = props.parse_offers_data(offers_payload, "Points_o_u", "2024-11-05 18:00:00")
+        state = {}
+        return _time(lambda: props.save_to_database(state["db"], "prop_lines", parsed),
+                     setup=lambda: state.update(db=fresh_db("props")), repeats=repeats)
+    record("save_to_database", offer_rows, run_save_offers)
+
+    # Per-minute stats over the legacy game_logs table
+    def run_per_minute():
+        import minute
+        state = {}
+
+        def setup():
+            state["db"] = fresh_db("minute")
+            _legacy_game_logs_db(state["db"], game_payload)
+        return _time(lambda: minute.calculate_per_minute_stats(state["db"], "game_logs", "game_logs_per_minute"),
+                     setup=setup, repeats=repeats)
+    record("calculate_per_minute_stats", len(records), run_per_minute)
+
+    # Fuzzy name verification
+    def run_verify_names():
+        import names_manager
+        game_names = set(_player_names(config["names"], random.Random(SEED)))
+        props_names = set(perturb_names(sorted(game_names)))
+        return _time(lambda: names_manager.verify_names(props_names, game_names), repeats=repeats)
+    record("verify_names", config["names"], run_verify_names)
+
+    return results
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def compare(current: Dict[str, Any], baseline_path: str) -> None:
+    """Print the speed ratio of each stage against a previous results file."""
+    with open(baseline_path) as baseline_file:
+        baseline = json.load(baseline_file)
+    previous = {(r["stage"], r["scale"]): r for r in baseline["results"] if "best_s" in r}
+    print(f"\nComparison against {baseline_path} (commit {baseline.get('commit')}):")
+    for result in current["results"]:
+        old = previous.get((result["stage"], result["scale"]))
+        if not old or "best_s" not in result:
+            continue
+        ratio = old["best_s"] / result["best_s"] if result["best_s"] else float("inf")
+        print(f"  {result['stage']:<28} {result['scale']:<7} {ratio:6.2f}x "
+              f"({old['best_s'] * 1000:.2f} ms -> {result['best_s'] * 1000:.2f} ms)")
+
+
+def main(argv: Optional[List[str]] = None) -> Dict[str, Any]:
+    parser = argparse.ArgumentParser(description="Offline benchmarks for every pipeline stage.")
+    parser.add_argument("--scales", nargs="+", default=list(SCALES), choices=list(SCALES))
+    parser.add_argument("--repeats", type=int, default=REPEATS)
+    parser.add_argument("--output", default="bench_results.json", help="Where to write the JSON results.")
+    parser.add_argument("--compare", help="Previous results file to compare against.")
+    args = parser.parse_args(argv)
+
+    # Per-row INFO logging would dominate the timings
+    logging.disable(logging.INFO)
+
+    results = []
+    with tempfile.TemporaryDirectory() as workdir:
+        for scale in args.scales:
+            results.extend(benchmark_scale(scale, workdir, repeats=args.repeats))
+        storage.close_writers()
+        storage.close_connections()
+
+    report = {
+        "commit": _git_commit(),
+        "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        "python": platform.python_version(),
+        "sqlite": sqlite3.sqlite_version,
+        "results": results,
+    }
+    with open(args.output, "w") as output_file:
+        json.dump(report, output_file, indent=2)
+    print(f"\nResults written to {args.output}.")
+
+    if args.compare:
+        compare(report, args.compare)
+    return report
+
+if __name__ == "__main__":
+    sys.exit(0 if main() else 1)
@@ -0,0 +1,217 @@
+# board.py
+
+import sqlite3
+import logging
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+import storage
+import readers
+import db_status
+
+# ------------------------ Configuration ------------------------
+
+DATABASE_NAME = "nba.db"
+STATES_TABLE = "prop_line_states"
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+STATE_MAX_HOURS = 24             # Longer unchanged states are split, which bounds the as-of index scan
+REBUILD_CHUNK_SIZE = 50000
+
+BOARD_COLUMNS = ["event_id", "player", "player_id", "market", "selection", "bookie",
+                 "prop_line", "odds", "valid_from", "valid_to"]
+
+# ------------------------ Schema ------------------------
+
+def _create_states_table(conn: sqlite3.Connection) -> None:
+    """
+    One row per contiguous state of a book's main line: the (line, odds) quoted for
+    an (event, player, market, selection, bookie) from valid_from until valid_to.
+    valid_to is NULL while the state is still on the board.
+    """
+    conn.execute(f"""
+    CREATE TABLE IF NOT EXISTS {STATES_TABLE} (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        event_id TEXT,
+        player TEXT,
+        player_id INTEGER,
+        market TEXT,
+        selection TEXT,
+        bookie TEXT,
+        prop_line REAL,
+        odds REAL,
+        valid_from TEXT NOT NULL,
+        valid_to TEXT
+    );
+    """)
+    conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{STATES_TABLE}_from ON {STATES_TABLE} (valid_from, valid_to);")
+    # Only current states: the as-of query for long-lived lines and write-time maintenance both read these
+    conn.execute(f"""
+    CREATE INDEX IF NOT EXISTS idx_{STATES_TABLE}_open
+    ON {STATES_TABLE} (market, valid_from) WHERE valid_to IS NULL;
+    """)
+
+# ------------------------ Maintenance ------------------------
+
+def _shift(timestamp: str, hours: float) -> str:
+    return (datetime.strptime(timestamp[:19], TIMESTAMP_FORMAT) + timedelta(hours=hours)).strftime(TIMESTAMP_FORMAT)
+
+
+def _close_state(conn: sqlite3.Connection, state: Tuple, closed_at: str, inserts: List[Tuple]) -> None:
+    """
+    Close an open state at closed_at. A state open longer than STATE_MAX_HOURS
+    (e.g. across a polling gap) is cut into STATE_MAX_HOURS pieces so no closed
+    state is longer than the as-of lookback.
+    """
+    state_id, event_id, player, player_id, market, selection, bookie, line, odds, valid_from = state
+    cut = _shift(valid_from, STATE_MAX_HOURS)
+    if cut >= closed_at:
+        conn.execute(f"UPDATE {STATES_TABLE} SET valid_to = ? WHERE id = ?;", (closed_at, state_id))
+        return
+    conn.execute(f"UPDATE {STATES_TABLE} SET valid_to = ? WHERE id = ?;", (cut, state_id))
+    while cut < closed_at:
+        end = min(_shift(cut, STATE_MAX_HOURS), closed_at)
+        inserts.append((event_id, player, player_id, market, selection, bookie, line, odds, cut, end))
+        cut = end
+
+
+def _update_states(conn: sqlite3.Connection, snapshot: List[Any]) -> int:
+    _create_states_table(conn)
+    offers = [offer for offer in snapshot if getattr(offer, "is_main", 1)]
+    if not offers:
+        return 0
+    at = offers[0].script_timestamp
+    markets = sorted({offer.market for offer in offers})
+
+    # Open states of the markets in this snapshot, keyed like the offers
+    placeholders = ", ".join("?" for _ in markets)
+    cursor = conn.execute(f"""
+        SELECT id, event_id, player, player_id, market, selection, bookie, prop_line, odds, valid_from
+        FROM {STATES_TABLE} WHERE valid_to IS NULL AND market IN ({placeholders});
+    """, markets)
+    open_states = {(row[1], row[2], row[4], row[5], row[6]): row for row in cursor.fetchall()}
+
+    inserts: List[Tuple] = []
+    seen = set()
+    for offer in offers:
+        try:
+            line, odds = float(offer.prop_line), float(offer.odds)
+        except (TypeError, ValueError):
+            continue
+        key = (str(offer.event_id), offer.player, offer.market, offer.selection, offer.bookie)
+        if key in seen:
+            continue
+        seen.add(key)
+        state = open_states.get(key)
+        if state is not None:
+            if (state[7], state[8]) == (line, odds) and _shift(state[9], STATE_MAX_HOURS) > at:
+                continue
+            # Changed, or unchanged but due for a checkpoint: close it and open a new state at `at`
+            _close_state(conn, state, at, inserts)
+        inserts.append((key[0], offer.player, getattr(offer, "player_id", None), offer.market,
+                        offer.selection, offer.bookie, line, odds, at, None))
+
+    # Lines missing from a market that was polled have come off the board
+    for key, state in open_states.items():
+        if key not in seen:
+            _close_state(conn, state, at, inserts)
+
+    conn.executemany(f"""
+        INSERT INTO {STATES_TABLE} (
+            event_id, player, player_id, market, selection, bookie, prop_line, odds, valid_from, valid_to
+        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?);
+    """, inserts)
+    return len(inserts)
+
+
+def update_line_states(database: str, snapshot: List[Any]) -> int:
+    """
+    Fold one snapshot of PropOffer records into the interval table: unchanged lines
+    keep their open state, changed lines close it and open a new one, and lines
+    gone from a polled market are closed. Returns the number of states written.
+    """
+    return storage.run_write(database, _update_states, snapshot)
+
+
+class _StoredOffer(NamedTuple):
+    """A stored prop_lines main line, with the attributes _update_states reads from a PropOffer."""
+    script_timestamp: str
+    event_id: Any
+    player: str
+    player_id: Optional[int]
+    market: str
+    selection: str
+    bookie: str
+    prop_line: Any
+    odds: Any
+    is_main: int = 1
+
+
+def rebuild_line_states(database: str = DATABASE_NAME, table_name: str = "prop_lines") -> int:
+    """Rebuild the interval table from every stored snapshot, replayed in time order."""
+    columns = set(readers.table_columns(database, table_name))
+    main_filter = "COALESCE(is_main, 1) = 1" if "is_main" in columns else None
+    player_id = "player_id" if "player_id" in columns else "NULL"
+    storage.run_write(database, lambda write_conn: write_conn.execute(f"DROP TABLE IF EXISTS {STATES_TABLE};"))
+
+    # Keyset pages on (script_timestamp, id), which the script_timestamp index covers
+    written = 0
+    pending: List[_StoredOffer] = []
+    for rows in readers.iter_chunks(database, table_name,
+                                    ["script_timestamp", "event_id", "player", player_id, "market",
+                                     "selection", "bookie", "prop_line", "odds"],
+                                    where=main_filter, key=("script_timestamp", "id"),
+                                    chunk_size=REBUILD_CHUNK_SIZE):
+        for row in rows:
+            offer = _StoredOffer(*row)
+            if pending and offer.script_timestamp != pending[0].script_timestamp:
+                written += update_line_states(database, pending)
+                pending = []
+            pending.append(offer)
+    if pending:
+        written += update_line_states(database, pending)
+    logging.info(f"Rebuilt {STATES_TABLE} with {written} line states.")
+    return written
+
+
+# ------------------------ As-Of Queries ------------------------
+
+def as_of_board(at: str, database: str = DATABASE_NAME, market: Optional[str] = None,
+                player: Optional[str] = None) -> List[Dict[str, Any]]:
+    """
+    Return the full board (every player x market x book main line) as it stood at
+    `at` ('YYYY-MM-DD HH:MM:SS'), optionally narrowed to one market or player.
+
+    Closed states are never longer than STATE_MAX_HOURS, so only states that began
+    within that window before `at` are scanned through the valid_from index; states
+    still open come from the partial index over the current board.
+    """
+    at = at[:19]
+    floor = _shift(at, -STATE_MAX_HOURS)
+    filters, params = "", []
+    if market is not None:
+        filters += " AND market = ?"
+        params.append(market)
+    if player is not None:
+        filters += " AND player = ?"
+        params.append(player)
+    columns = ", ".join(BOARD_COLUMNS)
+    conn = storage.get_connection(database)
+    try:
+        cursor = conn.execute(f"""
+            SELECT {columns} FROM {STATES_TABLE}
+            WHERE valid_from > ? AND valid_from <= ? AND (valid_to IS NULL OR valid_to > ?) {filters}
+            UNION ALL
+            SELECT {columns} FROM {STATES_TABLE} INDEXED BY idx_{STATES_TABLE}_open
+            WHERE valid_to IS NULL AND valid_from <= ? {filters}
+            ORDER BY market, player, selection, bookie;
+        """, [floor, at, at, *params, floor, *params])
+    except sqlite3.OperationalError as e:
+        logging.warning(f"No line states in {database}: {e}")
+        return []
+    db_status.record_query_pattern(database, STATES_TABLE, ["valid_from"])
+    return [dict(zip(BOARD_COLUMNS, row)) for row in cursor.fetchall()]
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    rebuild_line_states()
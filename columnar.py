@@ -0,0 +1,282 @@
+# columnar.py
+
+import os
+import sqlite3
+import logging
+from collections import defaultdict
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+import storage
+
+# ------------------------ Configuration ------------------------
+
+DATABASE_NAME = "nba.db"
+EXPORT_ROOT = "columnar"         # Root directory of the partitioned Parquet datasets
+CHUNK_SIZE = 50000               # Rows read from SQLite per batch
+COMPRESSION = "zstd"
+GAME_LOGS_WATERMARK = "game_logs_change_seq"   # Watermark on game_logs.change_seq (the old 'game_logs' one was on game_log_id)
+
+# ------------------------ Optional Dependencies ------------------------
+
+def _require_pyarrow():
+    """Import pyarrow lazily so the rest of the pipeline runs without it."""
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError as e:
+        raise ImportError("Parquet export requires pyarrow (pip install pyarrow).") from e
+    return pyarrow, pyarrow.parquet
+
+
+def _require_duckdb():
+    """Import duckdb lazily so the rest of the pipeline runs without it."""
+    try:
+        import duckdb
+    except ImportError as e:
+        raise ImportError("Columnar queries require duckdb (pip install duckdb).") from e
+    return duckdb
+
+# ------------------------ Watermarks ------------------------
+
+def _create_watermark_table(conn: sqlite3.Connection) -> None:
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS export_watermarks (
+        dataset TEXT PRIMARY KEY,
+        last_id INTEGER NOT NULL
+    );
+    """)
+
+
+def _get_watermark(database: str, dataset: str) -> int:
+    """Return the highest source row id already exported for a dataset."""
+    storage.run_write(database, _create_watermark_table)
+    row = storage.get_connection(database).execute(
+        "SELECT last_id FROM export_watermarks WHERE dataset = ?;", (dataset,)
+    ).fetchone()
+    return row[0] if row else 0
+
+
+def _set_watermark(conn: sqlite3.Connection, dataset: str, last_id: int) -> None:
+    conn.execute("""
+        INSERT INTO export_watermarks (dataset, last_id) VALUES (?, ?)
+        ON CONFLICT(dataset) DO UPDATE SET last_id = excluded.last_id;
+    """, (dataset, last_id))
+
+# ------------------------ Helpers ------------------------
+
+def season_for_date(game_date: str) -> str:
+    """Map an ISO game date to its NBA season label, e.g. '2024-11-05' -> '2024-25'."""
+    year, month = int(game_date[:4]), int(game_date[5:7])
+    start = year if month >= 8 else year - 1
+    return f"{start}-{str(start + 1)[-2:]}"
+
+
+def _write_partition(rows: List[tuple], column_names: List[str], path: str, partition_columns=()) -> None:
+    """
+    Write rows to a single Parquet file, creating the partition directory.
+    Partition columns are left out of the file since the directory names carry them.
+    """
+    pa, pq = _require_pyarrow()
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    columns = {name: [row[i] for row in rows]
+               for i, name in enumerate(column_names) if name not in partition_columns}
+    pq.write_table(pa.table(columns), path, compression=COMPRESSION)
+
+# ------------------------ Export ------------------------
+
+def export_game_logs(database: str = DATABASE_NAME, root: str = EXPORT_ROOT) -> int:
+    """
+    Incrementally export 'game_logs' to root/game_logs/season=.../game_date=.../.
+    Game logs are upserted in place and every insert or change bumps the row's
+    change_seq, so every date with a row changed since the last export (stat
+    corrections included) is rewritten as a whole partition. Returns the number of rows written.
+    """
+    _require_pyarrow()
+    watermark = _get_watermark(database, GAME_LOGS_WATERMARK)
+    cursor = storage.get_connection(database).cursor()
+    cursor.execute("SELECT MAX(change_seq) FROM game_logs;")
+    max_seq = cursor.fetchone()[0] or 0
+    if max_seq <= watermark:
+        logging.info("Columnar export: no new or changed game logs.")
+        return 0
+
+    cursor.execute(
+        "SELECT DISTINCT game_date FROM game_logs WHERE change_seq > ? AND game_date IS NOT NULL;",
+        (watermark,),
+    )
+    touched_dates = sorted(row[0] for row in cursor.fetchall())
+
+    written = 0
+    for game_date in touched_dates:
+        cursor.execute("SELECT * FROM game_logs WHERE game_date = ? ORDER BY game_log_id;", (game_date,))
+        column_names = [desc[0] for desc in cursor.description]
+        rows = cursor.fetchall()
+        path = os.path.join(root, "game_logs", f"season={season_for_date(game_date)}",
+                            f"game_date={game_date}", "part-0.parquet")
+        _write_partition(rows, column_names, path, partition_columns=("game_date",))
+        written += len(rows)
+
+    storage.run_write(database, _set_watermark, GAME_LOGS_WATERMARK, max_seq)
+    logging.info(f"Columnar export: wrote {written} game log rows across {len(touched_dates)} dates.")
+    return written
+
+
+def export_prop_lines(database: str = DATABASE_NAME, root: str = EXPORT_ROOT) -> int:
+    """
+    Incrementally export 'prop_lines' to root/prop_lines/date=.../market=.../.
+    Prop snapshots are append-only, so each export adds one file per partition
+    holding only rows newer than the watermark; finished days are then compacted
+    to one file per partition. Returns the number of rows written.
+    """
+    _require_pyarrow()
+    watermark = _get_watermark(database, "prop_lines")
+    cursor = storage.get_connection(database).cursor()
+    cursor.execute("SELECT * FROM prop_lines WHERE id > ? ORDER BY id;", (watermark,))
+    column_names = [desc[0] for desc in cursor.description]
+    timestamp_index = column_names.index("script_timestamp")
+    market_index = column_names.index("market")
+
+    written = 0
+    last_id = watermark
+    while True:
+        rows = cursor.fetchmany(CHUNK_SIZE)
+        if not rows:
+            break
+        partitions: Dict[tuple, List[tuple]] = defaultdict(list)
+        for row in rows:
+            partitions[(row[timestamp_index][:10], row[market_index])].append(row)
+        first_id = rows[0][0]
+        for (snapshot_date, market), partition_rows in partitions.items():
+            path = os.path.join(root, "prop_lines", f"date={snapshot_date}",
+                                f"market={market}", f"part-{first_id}.parquet")
+            _write_partition(partition_rows, column_names, path, partition_columns=("market",))
+        written += len(rows)
+        last_id = rows[-1][0]
+
+    if last_id > watermark:
+        storage.run_write(database, _set_watermark, "prop_lines", last_id)
+    logging.info(f"Columnar export: wrote {written} prop line rows.")
+    compact_prop_lines(root)
+    return written
+
+
+def rewrite_prop_lines(database: str, partitions, root: str = EXPORT_ROOT) -> int:
+    """
+    Rewrite whole prop_lines (date, market) partitions from SQLite. Replacing stored
+    snapshots (archive.reprocess_offers) gives their rows new ids, and the id-watermark
+    export would keep the old rows next to the new ones. Rows past the watermark are
+    exported first, so the rewritten partitions stop exactly at it. Returns the rows written.
+    """
+    export_prop_lines(database, root)
+    watermark = _get_watermark(database, "prop_lines")
+    cursor = storage.get_connection(database).cursor()
+
+    written = 0
+    for snapshot_date, market in sorted(partitions):
+        partition = os.path.join(root, "prop_lines", f"date={snapshot_date}", f"market={market}")
+        cursor.execute("""
+            SELECT * FROM prop_lines
+            WHERE script_timestamp >= ? AND script_timestamp < date(?, '+1 day') AND market = ? AND id <= ?
+            ORDER BY id;
+        """, (snapshot_date, snapshot_date, market, watermark))
+        column_names = [desc[0] for desc in cursor.description]
+        rows = cursor.fetchall()
+        old_files = []
+        if os.path.isdir(partition):
+            old_files = sorted(name for name in os.listdir(partition) if name.endswith(".parquet"))
+        target = f"part-{rows[0][0]}.parquet" if rows else None
+        if rows:
+            temporary = os.path.join(partition, "rewriting.tmp")
+            _write_partition(rows, column_names, temporary, partition_columns=("market",))
+            os.replace(temporary, os.path.join(partition, target))
+        for name in old_files:
+            if name != target:
+                os.remove(os.path.join(partition, name))
+        written += len(rows)
+    logging.info(f"Columnar export: rewrote {len(partitions)} prop_lines partitions with {written} rows.")
+    return written
+
+
+def compact_prop_lines(root: str = EXPORT_ROOT, before: Optional[str] = None) -> int:
+    """
+    Merge the per-poll files of each prop_lines (date, market) partition into one
+    file once its day is over (dates before `before`, default today). Polls keep
+    appending small files for the current day only. Returns the partitions compacted.
+    """
+    pa, pq = _require_pyarrow()
+    before = before or datetime.now().strftime("%Y-%m-%d")
+    dataset_dir = os.path.join(root, "prop_lines")
+    if not os.path.isdir(dataset_dir):
+        return 0
+
+    compacted = 0
+    for date_dir in sorted(os.listdir(dataset_dir)):
+        if not date_dir.startswith("date=") or date_dir[len("date="):] >= before:
+            continue
+        for market_dir in sorted(os.listdir(os.path.join(dataset_dir, date_dir))):
+            partition = os.path.join(dataset_dir, date_dir, market_dir)
+            files = sorted(name for name in os.listdir(partition) if name.endswith(".parquet"))
+            if len(files) < 2:
+                continue
+            tables = [pq.read_table(os.path.join(partition, name)) for name in files]
+            # Files written before a prop_lines migration lack the newer columns
+            table = pa.concat_tables(tables, promote_options="default").sort_by("id")
+            temporary = os.path.join(partition, "compacting.tmp")
+            pq.write_table(table, temporary, compression=COMPRESSION)
+            os.replace(temporary, os.path.join(partition, files[0]))
+            for name in files[1:]:
+                os.remove(os.path.join(partition, name))
+            compacted += 1
+    if compacted:
+        logging.info(f"Columnar export: compacted {compacted} prop_lines partitions.")
+    return compacted
+
+
+def _export_errors() -> tuple:
+    """Errors an export can raise: SQLite, file system, and pyarrow conversion (e.g. mixed-type columns)."""
+    errors = (sqlite3.Error, OSError, ValueError, TypeError)
+    try:
+        import pyarrow
+    except ImportError:
+        return errors
+    return errors + (pyarrow.ArrowException,)
+
+
+def export_after_ingest(export_func, database: str = DATABASE_NAME) -> None:
+    """Run an export at the end of an ingest without failing the ingest itself."""
+    try:
+        export_func(database)
+    except ImportError as e:
+        logging.info(f"Skipping columnar export: {e}")
+    except _export_errors() as e:
+        logging.error(f"Columnar export failed: {e}")
+
+# ------------------------ Query ------------------------
+
+def query(sql: str, params: Optional[List[Any]] = None, root: str = EXPORT_ROOT):
+    """
+    Run an analytical SQL query over the Parquet datasets and return a DataFrame.
+    The datasets are exposed as views named 'game_logs' and 'prop_lines'; filters on
+    partition columns (season, game_date, date, market) prune whole files.
+    """
+    duckdb = _require_duckdb()
+    conn = duckdb.connect()
+    try:
+        for dataset in ("game_logs", "prop_lines"):
+            dataset_dir = os.path.join(root, dataset)
+            if os.path.isdir(dataset_dir):
+                pattern = os.path.join(dataset_dir, "**", "*.parquet").replace("'", "''")
+                conn.execute(
+                    f"CREATE VIEW {dataset} AS "
+                    f"SELECT * FROM read_parquet('{pattern}', hive_partitioning = true, union_by_name = true);"
+                )
+        return conn.execute(sql, params or []).df()
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    export_game_logs()
+    export_prop_lines()
@@ -1,6 +1,28 @@
 import os
+import sys
+import csv
+import gzip
+import atexit
+import logging
 import sqlite3
-import pandas as pd
+import threading
+from collections import Counter
+from datetime import datetime, timedelta
+
+import storage
+import readers
+
+# Maintenance defaults
+RETENTION_DAYS = 30              # Keep full prop snapshots this long
+ANALYZE_INTERVAL_HOURS = 24      # Re-run ANALYZE at most this often
+VACUUM_INTERVAL_HOURS = 24       # Reclaim free pages at most this often
+VACUUM_PAGES = 2000              # Pages to free per incremental vacuum run
+INDEX_SUGGESTION_MIN_COUNT = 5   # Recorded uses before an index is suggested
+ARCHIVE_DIRECTORY = "archive"
+
+# (database path, table, columns) -> uses seen by this process and not yet flushed to query_log
+_query_patterns = Counter()
+_query_patterns_lock = threading.Lock()
 
 
 def list_sqlite_databases(directory):
@@ -11,8 +33,7 @@ def list_sqlite_databases(directory):
 def list_tables(database):
     """List all tables in a SQLite database."""
     try:
-        conn = sqlite3.connect(database)
-        cursor = conn.cursor()
+        cursor = storage.get_connection(database).cursor()
 
         # Fetch all table names
         cursor.execute("SELECT name FROM sqlite_master WHERE type='table';")
@@ -22,15 +43,14 @@ def list_tables(database):
     except sqlite3.Error as e:
         print(f"SQLite error occurred while fetching tables from {database}: {e}")
         return []
-    finally:
-        conn.close()
 
 
 def display_table_schema_and_sample(database, table):
     """Display the schema and a sample of data for a specific table."""
+    import pandas as pd
+
     try:
-        conn = sqlite3.connect(database)
-        cursor = conn.cursor()
+        cursor = storage.get_connection(database).cursor()
 
         # Display schema
         print(f"\nSchema for table: {table}")
@@ -44,15 +64,10 @@ def display_table_schema_and_sample(database, table):
 
         # Display sample data
         print("\nSample data:")
-        cursor.execute(f"SELECT * FROM {table} LIMIT 5;")
-        rows = cursor.fetchall()
-        if not rows:
+        df = readers.first_frame(database, table, limit=5)
+        if df is None:
             print("  (No data found)")
         else:
-            # Fetch column names for headers
-            column_names = [desc[0] for desc in cursor.description]
-            # Use Pandas to display rows cleanly
-            df = pd.DataFrame(rows, columns=column_names)
 
             # Drop `PLUS_MINUS_PER_MIN` if it exists
             if "PLUS_MINUS_PER_MIN" in df.columns:
@@ -73,8 +88,6 @@ def display_table_schema_and_sample(database, table):
 
     except sqlite3.Error as e:
         print(f"SQLite error occurred while fetching data from {table}: {e}")
-    finally:
-        conn.close()
 
 
 def explore_databases():
@@ -150,17 +163,306 @@ def manage_tables():
             return
 
         # Delete table
-        conn = sqlite3.connect(selected_db)
-        cursor = conn.cursor()
-        cursor.execute(f"DROP TABLE IF EXISTS {selected_table};")
-        conn.commit()
+        storage.run_write(selected_db, lambda conn: conn.execute(f"DROP TABLE IF EXISTS {selected_table};"))
         print(f"Table '{selected_table}' has been successfully deleted from '{selected_db}'.")
     except (ValueError, KeyError, IndexError):
         print("Invalid selection. Returning to main menu.")
     except sqlite3.Error as e:
         print(f"SQLite error occurred while deleting table {selected_table}: {e}")
+
+
+# ------------------------ Maintenance ------------------------
+
+def _ensure_maintenance_tables(cursor):
+    """Create the bookkeeping tables used by the maintenance routines."""
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS maintenance_log (
+        task TEXT PRIMARY KEY,
+        last_run TEXT
+    );
+    """)
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS query_log (
+        table_name TEXT NOT NULL,
+        columns TEXT NOT NULL,
+        uses INTEGER NOT NULL DEFAULT 0,
+        last_seen TEXT,
+        PRIMARY KEY (table_name, columns)
+    );
+    """)
+
+
+def _task_due(cursor, task, interval_hours):
+    """Return True when a maintenance task has not run within its interval."""
+    cursor.execute("SELECT last_run FROM maintenance_log WHERE task = ?;", (task,))
+    row = cursor.fetchone()
+    if not row or not row[0]:
+        return True
+    last_run = datetime.strptime(row[0], "%Y-%m-%d %H:%M:%S")
+    return datetime.now() - last_run >= timedelta(hours=interval_hours)
+
+
+def _mark_task_run(cursor, task):
+    """Record that a maintenance task has just run."""
+    cursor.execute("""
+        INSERT INTO maintenance_log (task, last_run) VALUES (?, ?)
+        ON CONFLICT(task) DO UPDATE SET last_run = excluded.last_run;
+    """, (task, datetime.now().strftime("%Y-%m-%d %H:%M:%S")))
+
+
+def _save_query_patterns(conn, patterns):
+    cursor = conn.cursor()
+    _ensure_maintenance_tables(cursor)
+    last_seen = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    cursor.executemany("""
+        INSERT INTO query_log (table_name, columns, uses, last_seen) VALUES (?, ?, ?, ?)
+        ON CONFLICT(table_name, columns) DO UPDATE SET
+            uses = uses + excluded.uses,
+            last_seen = excluded.last_seen;
+    """, [(table, column_list, uses, last_seen) for table, column_list, uses in patterns])
+
+
+def record_query_pattern(database, table, columns, uses=1):
+    """
+    Count that a query filtered or sorted `table` on `columns` (in order), `uses` times.
+    The index advisor uses these counts to decide which indexes pay off. Counts are
+    kept in memory, so read paths never write; flush_query_patterns() stores them,
+    from run_maintenance and when the process exits.
+    """
+    with _query_patterns_lock:
+        _query_patterns[(os.path.abspath(database), table, ",".join(columns))] += uses
+
+
+def flush_query_patterns(database=None):
+    """Add the counts recorded in this process to query_log (of one database, or all of them)."""
+    path = None if database is None else os.path.abspath(database)
+    with _query_patterns_lock:
+        flushed = [key for key in _query_patterns if path is None or key[0] == path]
+        by_database = {}
+        for key in flushed:
+            by_database.setdefault(key[0], []).append((key[1], key[2], _query_patterns.pop(key)))
+    for db_path, patterns in by_database.items():
+        if not os.path.exists(db_path):
+            continue
+        try:
+            storage.run_write(db_path, _save_query_patterns, patterns)
+        except sqlite3.Error as e:
+            logging.warning(f"Saving query patterns to {db_path} failed: {e}")
+
+
+atexit.register(flush_query_patterns)  # Registered after storage's, so it runs before the writers close
+
+
+def _existing_index_columns(cursor, table):
+    """Return the column lists of every index on a table."""
+    cursor.execute(f"PRAGMA index_list({table});")
+    index_names = [row[1] for row in cursor.fetchall()]
+    indexed = []
+    for index_name in index_names:
+        cursor.execute(f"PRAGMA index_info({index_name});")
+        indexed.append([row[2] for row in sorted(cursor.fetchall())])
+    return indexed
+
+
+def suggest_indexes(database, min_count=INDEX_SUGGESTION_MIN_COUNT):
+    """
+    Suggest indexes for recorded query patterns that no existing index covers.
+    Returns a list of (table, columns, uses, create_statement) tuples, most used first.
+    """
+    suggestions = []
+    try:
+        storage.run_write(database, lambda conn: _ensure_maintenance_tables(conn.cursor()))
+        cursor = storage.get_connection(database).cursor()
+
+        cursor.execute("""
+            SELECT table_name, columns, uses FROM query_log
+            WHERE uses >= ? ORDER BY uses DESC;
+        """, (min_count,))
+        patterns = cursor.fetchall()
+        tables = set(list_tables(database))
+
+        for table, column_list, uses in patterns:
+            if table not in tables:
+                continue
+            columns = column_list.split(",")
+            # An index is only useful for this pattern if the pattern is a prefix of it
+            covered = any(existing[:len(columns)] == columns
+                          for existing in _existing_index_columns(cursor, table))
+            if covered:
+                continue
+            index_name = f"idx_{table}_{'_'.join(columns)}".lower()
+            statement = f"CREATE INDEX IF NOT EXISTS {index_name} ON {table} ({', '.join(columns)});"
+            suggestions.append((table, columns, uses, statement))
+    except sqlite3.Error as e:
+        print(f"SQLite error occurred while suggesting indexes for {database}: {e}")
+    return suggestions
+
+
+def _apply_retention(conn, table, cutoff, archive_dir):
+    """Delete (and optionally archive) expired rows; returns the number removed."""
+    cursor = conn.cursor()
+
+    # Opening and closing main lines per offer survive retention; alternate lines stored
+    # with keep_all_lines are never the opening or closing line, so they age out in full
+    cursor.execute(f"PRAGMA table_info({table});")
+    main_filter = "WHERE COALESCE(is_main, 1) = 1" if "is_main" in {row[1] for row in cursor.fetchall()} else ""
+    cursor.execute("DROP TABLE IF EXISTS temp.retention_keep;")
+    cursor.execute(f"""
+        CREATE TEMP TABLE retention_keep AS
+        SELECT MIN(id) AS id FROM {table} {main_filter} GROUP BY event_id, player, market, selection, bookie
+        UNION
+        SELECT MAX(id) AS id FROM {table} {main_filter} GROUP BY event_id, player, market, selection, bookie;
+    """)
+    expired_filter = f"""
+        FROM {table}
+        WHERE script_timestamp < ?
+          AND id NOT IN (SELECT id FROM temp.retention_keep)
+    """
+
+    if archive_dir:
+        os.makedirs(archive_dir, exist_ok=True)
+        cursor.execute(f"SELECT * {expired_filter} ORDER BY id;", (cutoff,))
+        column_names = [desc[0] for desc in cursor.description]
+        archive_path = os.path.join(
+            archive_dir, f"{table}_before_{cutoff[:10]}_{datetime.now():%Y%m%d%H%M%S}.csv.gz"
+        )
+        archived = 0
+        with gzip.open(archive_path, "wt", newline="") as archive_file:
+            writer = csv.writer(archive_file)
+            writer.writerow(column_names)
+            while True:
+                rows = cursor.fetchmany(10000)
+                if not rows:
+                    break
+                writer.writerows(rows)
+                archived += len(rows)
+        if archived:
+            print(f"Archived {archived} rows from '{table}' to {archive_path}.")
+        else:
+            os.remove(archive_path)
+
+    cursor.execute(f"DELETE {expired_filter};", (cutoff,))
+    removed = cursor.rowcount
+    cursor.execute("DROP TABLE IF EXISTS temp.retention_keep;")
+    return removed
+
+
+def apply_retention(database, table="prop_lines", keep_days=RETENTION_DAYS, archive_dir=None):
+    """
+    Age out old prop snapshots.
+    Rows newer than `keep_days` are kept in full. For older rows only the opening
+    and closing line of each offer (event, player, market, selection, bookie) is kept.
+    When `archive_dir` is set, the removed rows are first written to a gzipped CSV there.
+    Returns the number of rows removed.
+    """
+    if table not in list_tables(database):
+        return 0
+    cutoff = (datetime.now() - timedelta(days=keep_days)).strftime("%Y-%m-%d %H:%M:%S")
+    try:
+        removed = storage.run_write(database, _apply_retention, table, cutoff, archive_dir)
+        print(f"Retention removed {removed} rows older than {cutoff} from '{table}'.")
+        return removed
+    except sqlite3.Error as e:
+        print(f"SQLite error occurred while applying retention to {table}: {e}")
+        return 0
+
+
+def _create_indexes(conn, statements):
+    cursor = conn.cursor()
+    for statement in statements:
+        cursor.execute(statement)
+    cursor.execute("ANALYZE;")
+
+
+def run_maintenance(database, force=False, keep_days=RETENTION_DAYS, archive_dir=None, create_indexes=False):
+    """
+    Run scheduled maintenance on a database: retention, incremental vacuum,
+    ANALYZE and index suggestions. Vacuum and ANALYZE only run when their
+    interval has elapsed unless `force` is set.
+    """
+    if "prop_lines" in list_tables(database):
+        apply_retention(database, "prop_lines", keep_days=keep_days, archive_dir=archive_dir)
+
+    # Wait for queued writes so VACUUM does not contend with the writer thread
+    storage.run_write(database, lambda conn: None)
+    # VACUUM cannot run inside a transaction, so use a dedicated autocommit connection
+    conn = None
+    try:
+        conn = storage.connect(database, isolation_level=None)
+        cursor = conn.cursor()
+        _ensure_maintenance_tables(cursor)
+
+        # Incremental vacuum needs auto_vacuum=INCREMENTAL, which only takes effect after a full VACUUM
+        cursor.execute("PRAGMA auto_vacuum;")
+        if cursor.fetchone()[0] != 2:
+            print(f"Enabling incremental auto-vacuum on {database} (one-time full VACUUM)...")
+            cursor.execute("PRAGMA auto_vacuum = INCREMENTAL;")
+            cursor.execute("VACUUM;")
+            _mark_task_run(cursor, "vacuum")
+        elif force or _task_due(cursor, "vacuum", VACUUM_INTERVAL_HOURS):
+            cursor.execute("PRAGMA freelist_count;")
+            free_pages = cursor.fetchone()[0]
+            cursor.execute(f"PRAGMA incremental_vacuum({VACUUM_PAGES});").fetchall()
+            _mark_task_run(cursor, "vacuum")
+            print(f"Incremental vacuum released up to {min(free_pages, VACUUM_PAGES)} of {free_pages} free pages.")
+
+        if force or _task_due(cursor, "analyze", ANALYZE_INTERVAL_HOURS):
+            cursor.execute("ANALYZE;")
+            _mark_task_run(cursor, "analyze")
+            print(f"ANALYZE completed on {database}.")
+        else:
+            cursor.execute("PRAGMA optimize;")
+    except sqlite3.Error as e:
+        print(f"SQLite error occurred during maintenance of {database}: {e}")
+        return
     finally:
-        conn.close()
+        if conn is not None:
+            conn.close()
+
+    flush_query_patterns(database)
+    suggestions = suggest_indexes(database)
+    if not suggestions:
+        print("No index suggestions.")
+        return
+    print("\nIndex suggestions:")
+    for table, columns, uses, statement in suggestions:
+        print(f"  {table} ({', '.join(columns)}) used {uses} times: {statement}")
+
+    if create_indexes:
+        try:
+            storage.run_write(database, _create_indexes, [statement for *_, statement in suggestions])
+            print(f"Created {len(suggestions)} suggested indexes.")
+        except sqlite3.Error as e:
+            print(f"SQLite error occurred while creating indexes: {e}")
+
+
+def print_status(directory=None):
+    """Print every database in the directory with its size, tables and row counts."""
+    directory = directory or os.getcwd()
+    databases = list_sqlite_databases(directory)
+    if not databases:
+        print("No SQLite databases found.")
+        return
+    for db in sorted(databases):
+        path = os.path.join(directory, db)
+        print(f"\n{db} ({os.path.getsize(path) / 1048576:.1f} MB)")
+        cursor = storage.get_connection(path).cursor()
+        for table in list_tables(path):
+            if table.startswith("sqlite_"):
+                continue
+            cursor.execute(f'SELECT COUNT(*) FROM "{table}";')
+            print(f"  {table:<32} {cursor.fetchone()[0]:>12,} rows")
+
+
+def maintain_databases(force=False, create_indexes=False):
+    """Run maintenance on every SQLite database in the current directory."""
+    databases = list_sqlite_databases(os.getcwd())
+    if not databases:
+        print("No SQLite databases found.")
+        return
+    for db in databases:
+        print(f"\n--- Maintaining {db} ---")
+        run_maintenance(db, force=force, archive_dir=ARCHIVE_DIRECTORY, create_indexes=create_indexes)
 
 
 def main():
@@ -169,7 +471,8 @@ def main():
         print("\n--- SQLite Database Tool ---")
         print("1. Explore Databases")
         print("2. Manage Tables")
-        print("3. Exit")
+        print("3. Run Maintenance")
+        print("4. Exit")
         choice = input("\nSelect an option: ").strip()
 
         if choice == "1":
@@ -177,6 +480,9 @@ def main():
         elif choice == "2":
             manage_tables()
         elif choice == "3":
+            create = input("Create suggested indexes? (yes/no): ").strip().lower() == "yes"
+            maintain_databases(force=True, create_indexes=create)
+        elif choice == "4":
             print("Exiting program. Goodbye!")
             break
         else:
@@ -184,5 +490,9 @@ def main():
 
 
 if __name__ == "__main__":
-    main()
+    # `python db_status.py maintain [--force] [--create-indexes]` runs unattended, e.g. from cron
+    if len(sys.argv) > 1 and sys.argv[1] == "maintain":
+        maintain_databases(force="--force" in sys.argv, create_indexes="--create-indexes" in sys.argv)
+    else:
+        main()
 
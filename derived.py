@@ -0,0 +1,197 @@
+# derived.py
+
+import os
+import sqlite3
+import logging
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+import storage
+import metrics
+
+# ------------------------ Configuration ------------------------
+
+DATABASE_NAME = "nba_game_logs.db"
+SOURCE_TABLE = "game_logs"
+DERIVED_TABLE = "game_logs_derived"
+FORMULAS_TABLE = "derived_formulas"
+KEY_COLUMNS = ["PLAYER_ID", "GAME_ID", "SEASON_ID", "GAME_DATE"]
+MIN_PLAYER_PARTITIONS = 1        # Seasons are further split by PLAYER_ID % n to fill the pool
+
+PER_MINUTE_COLUMNS = [
+    "FGM", "FGA", "FG3M", "FG3A", "FTM", "FTA",
+    "OREB", "DREB", "REB", "AST", "STL", "BLK",
+    "TOV", "PF", "PTS", "PLUS_MINUS", "FANTASY_PTS",
+]
+
+# Output column -> expression over game_logs columns. Expressions are evaluated on whole
+# NumPy columns; div() returns NaN (stored as NULL) where the denominator is zero or missing.
+FORMULAS: Dict[str, str] = {
+    **{f"{column}_PER_MIN": f"div({column}, MIN)" for column in PER_MINUTE_COLUMNS},
+    **{f"{column}_PER_36": f"36 * div({column}, MIN)" for column in ["PTS", "REB", "AST", "FG3M", "STL", "BLK", "TOV"]},
+    "PRA": "PTS + REB + AST",
+    "PRA_PER_MIN": "div(PTS + REB + AST, MIN)",
+    "TS_PCT": "div(PTS, 2 * (FGA + 0.44 * FTA))",
+    "USAGE_PROXY": "36 * div(FGA + 0.44 * FTA + TOV, MIN)",  # Possessions used per 36 minutes
+}
+
+# ------------------------ Formula Evaluation ------------------------
+
+def div(numerator: np.ndarray, denominator: np.ndarray) -> np.ndarray:
+    """Elementwise division with NaN wherever the denominator is zero or missing."""
+    numerator = np.asarray(numerator, dtype=float)
+    denominator = np.asarray(denominator, dtype=float)
+    result = np.full(np.broadcast(numerator, denominator).shape, np.nan)
+    np.divide(numerator, denominator, out=result, where=(denominator != 0) & ~np.isnan(denominator))
+    return result
+
+
+_HELPERS = {"div": div, "np": np}
+
+
+def required_columns(formulas: Dict[str, str]) -> List[str]:
+    """Source columns referenced by the formulas, in first-use order."""
+    columns: List[str] = []
+    for expression in formulas.values():
+        for name in compile(expression, "<formula>", "eval").co_names:
+            if name not in _HELPERS and name not in columns:
+                columns.append(name)
+    return columns
+
+
+def evaluate(formulas: Dict[str, str], columns: Dict[str, np.ndarray]) -> Dict[str, np.ndarray]:
+    """Evaluate every formula over a block of rows given as {column: array}."""
+    namespace = {"__builtins__": {}, **_HELPERS, **columns}
+    length = len(next(iter(columns.values()))) if columns else 0
+    results = {}
+    for name, expression in formulas.items():
+        value = eval(compile(expression, name, "eval"), namespace)
+        results[name] = np.broadcast_to(np.asarray(value, dtype=float), (length,))
+    return results
+
+# ------------------------ Shards ------------------------
+
+def _compute_shard(args) -> Tuple[str, int, int, List[tuple]]:
+    """
+    Compute the formulas for one (season, player partition) shard in a worker
+    process and return the finished rows; only the main process writes.
+    """
+    database, formulas, season, partition, partitions = args
+    source = required_columns(formulas)
+    conn = storage.connect(database)
+    try:
+        cursor = conn.execute(f"""
+            SELECT {', '.join(KEY_COLUMNS + source)} FROM {SOURCE_TABLE}
+            WHERE SEASON_ID = ? AND PLAYER_ID % ? = ?;
+        """, (season, partitions, partition))
+        rows = cursor.fetchall()
+    finally:
+        conn.close()
+    if not rows:
+        return season, partition, partitions, []
+
+    keys = [row[:len(KEY_COLUMNS)] for row in rows]
+    values = np.array([row[len(KEY_COLUMNS):] for row in rows], dtype=float)
+    results = evaluate(formulas, {column: values[:, index] for index, column in enumerate(source)})
+    values = np.column_stack([results[name] for name in formulas])
+    matrix = values.astype(object)
+    matrix[np.isnan(values)] = None
+    return season, partition, partitions, [key + tuple(row) for key, row in zip(keys, matrix.tolist())]
+
+# ------------------------ Writer ------------------------
+
+def _prepare_table(conn: sqlite3.Connection, formulas: Dict[str, str]) -> bool:
+    """
+    Create the derived table for the current formulas. If the stored formula set
+    differs, the table is rebuilt and True is returned so every season is recomputed.
+    """
+    conn.execute(f"CREATE TABLE IF NOT EXISTS {FORMULAS_TABLE} (name TEXT PRIMARY KEY, expression TEXT);")
+    stored = dict(conn.execute(f"SELECT name, expression FROM {FORMULAS_TABLE};").fetchall())
+    changed = stored != formulas
+    if changed:
+        conn.execute(f"DROP TABLE IF EXISTS {DERIVED_TABLE};")
+        conn.execute(f"DELETE FROM {FORMULAS_TABLE};")
+        conn.executemany(f"INSERT INTO {FORMULAS_TABLE} (name, expression) VALUES (?, ?);", formulas.items())
+    conn.execute(f"""
+    CREATE TABLE IF NOT EXISTS {DERIVED_TABLE} (
+        PLAYER_ID INTEGER,
+        GAME_ID TEXT,
+        SEASON_ID TEXT,
+        GAME_DATE TEXT,
+        {', '.join(f'{name} REAL' for name in formulas)},
+        PRIMARY KEY (PLAYER_ID, GAME_ID)
+    );
+    """)
+    conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{DERIVED_TABLE}_season ON {DERIVED_TABLE} (SEASON_ID, PLAYER_ID);")
+    return changed
+
+
+def _replace_shard(conn: sqlite3.Connection, formulas: Dict[str, str], season: str,
+                   partition: int, partitions: int, rows: List[tuple]) -> int:
+    """Swap a shard's rows in one transaction, so readers never see a half-written season."""
+    conn.execute(f"DELETE FROM {DERIVED_TABLE} WHERE SEASON_ID = ? AND PLAYER_ID % ? = ?;",
+                 (season, partitions, partition))
+    columns = KEY_COLUMNS + list(formulas)
+    conn.executemany(f"""
+        INSERT INTO {DERIVED_TABLE} ({', '.join(columns)}) VALUES ({', '.join('?' for _ in columns)});
+    """, rows)
+    return len(rows)
+
+# ------------------------ Driver ------------------------
+
+def compute_derived(database: str = DATABASE_NAME, formulas: Optional[Dict[str, str]] = None,
+                    seasons: Optional[Sequence[str]] = None, workers: Optional[int] = None) -> int:
+    """
+    Recompute derived stats for the given seasons (all seasons by default, and
+    always all of them after a formula change). Shards of (season, player
+    partition) are computed across a process pool and written as they finish
+    through the database's single writer. Returns the number of rows written.
+    """
+    formulas = dict(formulas or FORMULAS)
+    if storage.run_write(database, _prepare_table, formulas):
+        logging.info("Derived formulas changed; recomputing every season.")
+        seasons = None
+    if seasons is None:
+        cursor = storage.get_connection(database).execute(f"SELECT DISTINCT SEASON_ID FROM {SOURCE_TABLE};")
+        seasons = [row[0] for row in cursor.fetchall()]
+    if not seasons:
+        logging.warning(f"No seasons found in {SOURCE_TABLE}.")
+        return 0
+
+    workers = workers or os.cpu_count() or 1
+    # Enough shards to keep every worker busy even when only one season is recomputed
+    partitions = max(MIN_PLAYER_PARTITIONS, -(-workers // len(seasons)))
+    tasks = [(database, formulas, season, partition, partitions)
+             for season in seasons for partition in range(partitions)]
+
+    written = 0
+    pending = []
+
+    def queue_writes(results, m):
+        for season, partition, shard_partitions, rows in results:
+            pending.append(storage.submit_write(database, _replace_shard, formulas, season,
+                                                partition, shard_partitions, rows))
+            m.rows += len(rows)
+
+    with metrics.track("derived", "compute") as m:
+        if workers == 1 or len(tasks) == 1:
+            queue_writes(map(_compute_shard, tasks), m)
+        else:
+            with ProcessPoolExecutor(max_workers=min(workers, len(tasks))) as executor:
+                futures = [executor.submit(_compute_shard, task) for task in tasks]
+                queue_writes((future.result() for future in as_completed(futures)), m)
+    with metrics.track("derived", "write") as m:
+        for future in pending:
+            written += future.result()
+        m.rows += written
+    logging.info(f"Computed {len(formulas)} derived stats for {written} rows across "
+                 f"{len(seasons)} season(s) in {len(tasks)} shard(s).")
+    return written
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    compute_derived()
+    metrics.export(DATABASE_NAME)
@@ -0,0 +1,308 @@
+# features.py
+
+import os
+import sqlite3
+import logging
+from collections import defaultdict
+from datetime import date
+from typing import Any, Dict, Optional, Tuple
+
+import storage
+
+# ------------------------ Configuration ------------------------
+
+DATABASE_NAME = "nba_game_logs.db"   # Legacy game_logs table with MATCHUP, WL and uppercase columns
+PLAYERS_DB = "nba.db"                # Source of player positions (players.position)
+FEATURE_STATS = ["PTS", "REB", "AST", "FG3M", "STL", "BLK", "TOV"]
+ALL_POSITIONS = "ALL"
+CHANGE_SEQ_STATE = "game_logs_change_seq"   # Last game_logs.CHANGE_SEQ the defense totals reflect
+
+# ------------------------ Parsing ------------------------
+
+def parse_matchup(matchup: str) -> Tuple[Optional[str], Optional[str], Optional[int]]:
+    """
+    Split a MATCHUP string into (team, opponent, home).
+    'LAL vs. BOS' is a LAL home game; 'LAL @ BOS' is a LAL road game.
+    """
+    if not matchup:
+        return None, None, None
+    if " vs. " in matchup:
+        team, opponent = matchup.split(" vs. ", 1)
+        return team.strip(), opponent.strip(), 1
+    if " @ " in matchup:
+        team, opponent = matchup.split(" @ ", 1)
+        return team.strip(), opponent.strip(), 0
+    return None, None, None
+
+
+def possessions(fga: float, fta: float, oreb: float, tov: float) -> float:
+    """Standard box-score possession estimate used as the pace proxy."""
+    return (fga or 0) - (oreb or 0) + (tov or 0) + 0.44 * (fta or 0)
+
+# ------------------------ Schema ------------------------
+
+def _create_feature_tables(conn: sqlite3.Connection) -> None:
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS game_context (
+        PLAYER_ID INTEGER NOT NULL,
+        GAME_ID TEXT NOT NULL,
+        GAME_DATE TEXT,
+        SEASON_ID TEXT,
+        TEAM TEXT,
+        OPPONENT TEXT,
+        HOME INTEGER,
+        REST_DAYS INTEGER,
+        BACK_TO_BACK INTEGER,
+        POSITION TEXT,
+        PRIMARY KEY (PLAYER_ID, GAME_ID)
+    );
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_game_context_team_date ON game_context (TEAM, GAME_DATE);")
+    stat_columns = ", ".join(f"{stat}_ALLOWED REAL NOT NULL DEFAULT 0" for stat in FEATURE_STATS)
+    # Totals per defending team, season and opposing position; ALL rows also carry games and pace
+    conn.execute(f"""
+    CREATE TABLE IF NOT EXISTS team_defense (
+        TEAM TEXT NOT NULL,
+        SEASON_ID TEXT NOT NULL,
+        POSITION TEXT NOT NULL,
+        GAMES INTEGER NOT NULL DEFAULT 0,
+        POSSESSIONS REAL NOT NULL DEFAULT 0,
+        {stat_columns},
+        PRIMARY KEY (TEAM, SEASON_ID, POSITION)
+    );
+    """)
+    conn.execute("""
+    CREATE TABLE IF NOT EXISTS feature_state (
+        name TEXT PRIMARY KEY,
+        value INTEGER NOT NULL
+    );
+    """)
+
+# ------------------------ Incremental Build ------------------------
+
+def primary_position(position: Optional[str]) -> str:
+    """Reduce a listed position ('G-F', 'Forward-Center', 'C') to its first letter: G, F or C."""
+    primary = (position or "").split("-")[0].strip()[:1].upper()
+    return primary if primary in ("G", "F", "C") else "UNK"
+
+
+def _load_positions(players_db: str) -> Dict[int, str]:
+    """Map player_id -> primary position from the players table, if that database exists."""
+    if not players_db or not os.path.exists(players_db):
+        return {}
+    try:
+        cursor = storage.get_connection(players_db).execute("SELECT player_id, position FROM players;")
+        return {player_id: primary_position(position) for player_id, position in cursor.fetchall() if position}
+    except sqlite3.Error:
+        return {}
+
+
+def _update_positions(conn: sqlite3.Connection, positions: Dict[int, str]) -> set:
+    """
+    Re-label featurized rows whose player's position is now known or changed.
+    Returns the (defending team, season) groups those rows count towards.
+    """
+    conn.execute("CREATE TEMP TABLE IF NOT EXISTS player_positions (PLAYER_ID INTEGER PRIMARY KEY, POSITION TEXT);")
+    conn.execute("DELETE FROM temp.player_positions;")
+    conn.executemany("INSERT INTO temp.player_positions VALUES (?, ?);", positions.items())
+    affected = set(conn.execute("""
+        SELECT DISTINCT gc.OPPONENT, gc.SEASON_ID FROM game_context gc
+        JOIN temp.player_positions p ON p.PLAYER_ID = gc.PLAYER_ID
+        WHERE gc.POSITION IS NOT p.POSITION;
+    """).fetchall())
+    if affected:
+        conn.execute("""
+            UPDATE game_context SET POSITION = (
+                SELECT p.POSITION FROM temp.player_positions p WHERE p.PLAYER_ID = game_context.PLAYER_ID
+            )
+            WHERE PLAYER_ID IN (
+                SELECT p.PLAYER_ID FROM temp.player_positions p
+                WHERE p.POSITION IS NOT game_context.POSITION
+            );
+        """)
+    return affected
+
+
+def _recompute_defense(conn: sqlite3.Connection, groups: set) -> None:
+    """
+    Rebuild the team_defense rows of the given (team, season) groups from every
+    featurized game, so games whose rows arrive over several runs count once.
+    """
+    conn.execute("CREATE TEMP TABLE IF NOT EXISTS defense_groups (TEAM TEXT, SEASON_ID TEXT, PRIMARY KEY (TEAM, SEASON_ID));")
+    conn.execute("DELETE FROM temp.defense_groups;")
+    conn.executemany("INSERT INTO temp.defense_groups VALUES (?, ?);", groups)
+    conn.execute("""
+        DELETE FROM team_defense
+        WHERE (TEAM, SEASON_ID) IN (SELECT TEAM, SEASON_ID FROM temp.defense_groups);
+    """)
+
+    allowed = [f"{stat}_ALLOWED" for stat in FEATURE_STATS]
+    sums = ", ".join(f"SUM(COALESCE(gl.{stat}, 0))" for stat in FEATURE_STATS)
+    featurized = """
+        FROM game_context gc
+        JOIN game_logs gl ON gl.PLAYER_ID = gc.PLAYER_ID AND gl.GAME_ID = gc.GAME_ID
+        JOIN temp.defense_groups g ON g.TEAM = gc.OPPONENT AND g.SEASON_ID = gc.SEASON_ID
+    """
+    # The opponent is the defending team for a player's production
+    conn.execute(f"""
+        INSERT INTO team_defense (TEAM, SEASON_ID, POSITION, {', '.join(allowed)})
+        SELECT gc.OPPONENT, gc.SEASON_ID, gc.POSITION, {sums} {featurized}
+        GROUP BY gc.OPPONENT, gc.SEASON_ID, gc.POSITION;
+    """)
+
+    # Games and pace sit on the ALL rows: one game per (game, offensive team), with pace the
+    # possessions() estimate averaged over both teams when both sides of the game are featurized
+    conn.execute(f"""
+        WITH team_games AS (
+            SELECT gc.GAME_ID, gc.TEAM, gc.OPPONENT, gc.SEASON_ID,
+                   SUM(COALESCE(gl.FGA, 0) - COALESCE(gl.OREB, 0) + COALESCE(gl.TOV, 0)
+                       + 0.44 * COALESCE(gl.FTA, 0)) AS POSSESSIONS
+            FROM game_context gc
+            JOIN game_logs gl ON gl.PLAYER_ID = gc.PLAYER_ID AND gl.GAME_ID = gc.GAME_ID
+            WHERE gc.GAME_ID IN (SELECT gc.GAME_ID {featurized})
+            GROUP BY gc.GAME_ID, gc.TEAM
+        )
+        INSERT INTO team_defense (TEAM, SEASON_ID, POSITION, GAMES, POSSESSIONS, {', '.join(allowed)})
+        SELECT offense.OPPONENT, offense.SEASON_ID, ?, COUNT(*),
+               SUM(CASE WHEN defense.POSSESSIONS IS NULL THEN offense.POSSESSIONS
+                        ELSE (offense.POSSESSIONS + defense.POSSESSIONS) / 2 END),
+               {', '.join('0' for _ in allowed)}
+        FROM team_games offense
+        JOIN temp.defense_groups g ON g.TEAM = offense.OPPONENT AND g.SEASON_ID = offense.SEASON_ID
+        LEFT JOIN team_games defense ON defense.GAME_ID = offense.GAME_ID AND defense.TEAM = offense.OPPONENT
+        GROUP BY offense.OPPONENT, offense.SEASON_ID;
+    """, (ALL_POSITIONS,))
+    conn.execute(f"""
+        INSERT INTO team_defense (TEAM, SEASON_ID, POSITION, {', '.join(allowed)})
+        SELECT gc.OPPONENT, gc.SEASON_ID, ?, {sums} {featurized}
+        GROUP BY gc.OPPONENT, gc.SEASON_ID
+        ON CONFLICT(TEAM, SEASON_ID, POSITION) DO UPDATE SET
+            {', '.join(f'{column} = excluded.{column}' for column in allowed)};
+    """, (ALL_POSITIONS,))
+
+
+def _update_features(conn: sqlite3.Connection, positions: Dict[int, str]) -> int:
+    _create_feature_tables(conn)
+    affected = _update_positions(conn, positions) if positions else set()
+
+    # Featurized games whose logs changed since the last run (stat corrections) re-total their groups
+    changed_seq = None
+    if "CHANGE_SEQ" in {row[1] for row in conn.execute("PRAGMA table_info(game_logs);")}:
+        row = conn.execute("SELECT value FROM feature_state WHERE name = ?;", (CHANGE_SEQ_STATE,)).fetchone()
+        seen_seq = row[0] if row else 0
+        changed_seq = conn.execute("SELECT COALESCE(MAX(CHANGE_SEQ), 0) FROM game_logs;").fetchone()[0]
+        if changed_seq > seen_seq:
+            affected.update(conn.execute("""
+                SELECT DISTINCT gc.OPPONENT, gc.SEASON_ID
+                FROM game_logs gl
+                JOIN game_context gc ON gc.PLAYER_ID = gl.PLAYER_ID AND gc.GAME_ID = gl.GAME_ID
+                WHERE gl.CHANGE_SEQ > ?;
+            """, (seen_seq,)).fetchall())
+
+    # Only rows not yet featurized; previously processed games keep their context rows
+    cursor = conn.execute("""
+        SELECT gl.PLAYER_ID, gl.GAME_ID, gl.GAME_DATE, gl.SEASON_ID, gl.MATCHUP
+        FROM game_logs gl
+        WHERE NOT EXISTS (
+            SELECT 1 FROM game_context gc WHERE gc.PLAYER_ID = gl.PLAYER_ID AND gc.GAME_ID = gl.GAME_ID
+        );
+    """)
+    new_rows = cursor.fetchall()
+
+    # Team schedule (existing + new) for rest days and back-to-backs
+    team_dates: Dict[str, set] = defaultdict(set)
+    if new_rows:
+        for team, game_date in conn.execute("SELECT DISTINCT TEAM, GAME_DATE FROM game_context;"):
+            team_dates[team].add(game_date)
+    parsed = []
+    for row in new_rows:
+        team, opponent, home = parse_matchup(row[4])
+        if team is None:
+            continue
+        team_dates[team].add(row[2])
+        parsed.append((row, team, opponent, home))
+    previous_date: Dict[Tuple[str, str], Optional[str]] = {}
+    for team, dates in team_dates.items():
+        ordered = sorted(dates)
+        for earlier, later in zip([None] + ordered[:-1], ordered):
+            previous_date[(team, later)] = earlier
+
+    context_rows = []
+    for (player_id, game_id, game_date, season_id, _), team, opponent, home in parsed:
+        earlier = previous_date.get((team, game_date))
+        rest_days = (date.fromisoformat(game_date[:10]) - date.fromisoformat(earlier[:10])).days if earlier else None
+        context_rows.append((player_id, game_id, game_date, season_id, team, opponent, home,
+                             rest_days, 1 if rest_days == 1 else 0, positions.get(player_id, "UNK")))
+        affected.add((opponent, season_id))
+
+    conn.executemany("""
+        INSERT OR IGNORE INTO game_context (
+            PLAYER_ID, GAME_ID, GAME_DATE, SEASON_ID, TEAM, OPPONENT, HOME, REST_DAYS, BACK_TO_BACK, POSITION
+        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?);
+    """, context_rows)
+    if affected:
+        _recompute_defense(conn, affected)
+    if changed_seq is not None:
+        conn.execute("""
+            INSERT INTO feature_state (name, value) VALUES (?, ?)
+            ON CONFLICT(name) DO UPDATE SET value = excluded.value;
+        """, (CHANGE_SEQ_STATE, changed_seq))
+    return len(context_rows)
+
+
+def update_features(database: str = DATABASE_NAME, players_db: str = PLAYERS_DB) -> int:
+    """
+    Featurize game log rows added since the last run: opponent, home/away, rest
+    days and back-to-backs per player-game. The opponent allowances by position
+    and the possessions-based pace proxy are recomputed for every (team, season)
+    the new rows, rows changed since the last run (by game_logs.CHANGE_SEQ), or
+    players whose position changed, count towards.
+    Returns the number of new player-game rows.
+    """
+    positions = _load_positions(players_db)
+    added = storage.run_write(database, _update_features, positions)
+    logging.info(f"Feature tables updated with {added} new player-game rows.")
+    return added
+
+# ------------------------ Lookup ------------------------
+
+def matchup_context(database: str, player_id: int, game_id: str) -> Optional[Dict[str, Any]]:
+    """
+    Return a player's matchup context for one game by key lookup: opponent,
+    home, rest, back-to-back, the opponent's per-game allowances to the
+    player's position and overall, and the opponent's pace proxy.
+    """
+    conn = storage.get_connection(database)
+    row = conn.execute("""
+        SELECT GAME_DATE, SEASON_ID, TEAM, OPPONENT, HOME, REST_DAYS, BACK_TO_BACK, POSITION
+        FROM game_context WHERE PLAYER_ID = ? AND GAME_ID = ?;
+    """, (player_id, game_id)).fetchone()
+    if row is None:
+        return None
+    game_date, season_id, team, opponent, home, rest_days, back_to_back, position = row
+    context = {
+        "game_date": game_date, "team": team, "opponent": opponent, "home": home,
+        "rest_days": rest_days, "back_to_back": back_to_back, "position": position,
+    }
+
+    allowed = ", ".join(f"{stat}_ALLOWED" for stat in FEATURE_STATS)
+    overall = conn.execute(f"""
+        SELECT GAMES, POSSESSIONS, {allowed} FROM team_defense
+        WHERE TEAM = ? AND SEASON_ID = ? AND POSITION = ?;
+    """, (opponent, season_id, ALL_POSITIONS)).fetchone()
+    if overall is None or not overall[0]:
+        return context
+    games = overall[0]
+    context["opponent_pace"] = overall[1] / games
+    context["opponent_allowed"] = {stat: overall[2 + i] / games for i, stat in enumerate(FEATURE_STATS)}
+    by_position = conn.execute(f"""
+        SELECT {allowed} FROM team_defense WHERE TEAM = ? AND SEASON_ID = ? AND POSITION = ?;
+    """, (opponent, season_id, position)).fetchone()
+    if by_position is not None:
+        context["opponent_allowed_to_position"] = {stat: by_position[i] / games for i, stat in enumerate(FEATURE_STATS)}
+    return context
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    update_features()
@@ -0,0 +1,142 @@
+# fixtures.py
+
+import os
+import gzip
+import json
+import time
+import hashlib
+import logging
+from urllib.parse import urlsplit
+from typing import Any, Dict, Optional
+
+# ------------------------ Configuration ------------------------
+
+FIXTURE_ROOT = os.environ.get("NBAPROPS_FIXTURES", "fixtures")   # Recorded responses, one gzip file each
+HTTP_MODE = os.environ.get("NBAPROPS_HTTP_MODE", "live")         # live | record | replay
+MOCK_URL = os.environ.get("NBAPROPS_MOCK_URL", "")               # e.g. http://127.0.0.1:8765 (see mock_server.py)
+MAX_RETRIES = 5                  # Retries on HTTP 429 before giving up
+RETRY_BACKOFF = 1.0              # Seconds; doubled per attempt when no Retry-After header is sent
+HTTP_MODES = ("live", "record", "replay")
+
+# ------------------------ Fixture Files ------------------------
+
+def normalize_params(params: Optional[Dict[str, Any]]) -> Dict[str, str]:
+    """Query parameters as strings, the way they go over the wire."""
+    return {str(key): str(value) for key, value in (params or {}).items()}
+
+
+def fixture_key(path: str, params: Optional[Dict[str, Any]]) -> str:
+    """Stable key for a request: URL path plus sorted parameters, independent of host and order."""
+    payload = json.dumps([path, sorted(normalize_params(params).items())])
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def fixture_path(url: str, params: Optional[Dict[str, Any]], root: Optional[str] = None) -> str:
+    """fixtures/<endpoint>/<key>.json.gz, e.g. fixtures/leaguegamelog/3fa1....json.gz"""
+    path = urlsplit(url).path
+    endpoint = os.path.basename(path.rstrip("/")) or "root"
+    return os.path.join(root or FIXTURE_ROOT, endpoint, f"{fixture_key(path, params)}.json.gz")
+
+
+def save_fixture(url: str, params: Optional[Dict[str, Any]], status: int, body: bytes,
+                 root: Optional[str] = None) -> str:
+    """Write one response to disk, compressed, and return its path."""
+    path = fixture_path(url, params, root)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    record = {
+        "url": url,
+        "params": normalize_params(params),
+        "status": status,
+        "recorded_at": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "body": body.decode("utf-8"),
+    }
+    temporary = f"{path}.tmp"
+    with gzip.open(temporary, "wt", encoding="utf-8") as fixture:
+        json.dump(record, fixture)
+    os.replace(temporary, path)
+    return path
+
+
+def load_fixture(url: str, params: Optional[Dict[str, Any]], root: Optional[str] = None) -> Optional[Dict[str, Any]]:
+    """Return a recorded response ({url, params, status, body}) or None if none was recorded."""
+    path = fixture_path(url, params, root)
+    if not os.path.exists(path):
+        return None
+    with gzip.open(path, "rt", encoding="utf-8") as fixture:
+        return json.load(fixture)
+
+# ------------------------ HTTP ------------------------
+
+def _replayed_response(url: str, status: int, body: bytes):
+    import requests
+
+    response = requests.Response()
+    response.status_code = status
+    response.url = url
+    response._content = body
+    response.headers["Content-Type"] = "application/json"
+    return response
+
+
+def _target_url(url: str) -> str:
+    """Send the request to the mock server when MOCK_URL is set, keeping the path."""
+    if not MOCK_URL:
+        return url
+    parts = urlsplit(url)
+    return MOCK_URL.rstrip("/") + parts.path
+
+
+def get(url: str, params: Optional[Dict[str, Any]] = None, headers: Optional[Dict[str, str]] = None,
+        timeout: float = 60, mode: Optional[str] = None, root: Optional[str] = None):
+    """
+    Drop-in for requests.get used by every fetcher.
+
+    live:   request the URL (or MOCK_URL), retrying 429 responses with backoff;
+            successful leaguegamelog and offers bodies from the real APIs are archived
+            (archive.py) without waiting for the write.
+    record: as live, and also save each successful response as a fixture.
+    replay: serve the recorded fixture without touching the network; a missing
+            fixture raises requests.exceptions.ConnectionError like an outage would.
+    """
+    import requests
+
+    mode = mode or HTTP_MODE
+    if mode == "replay":
+        record = load_fixture(url, params, root)
+        if record is None:
+            raise requests.exceptions.ConnectionError(f"No recorded fixture for {url} with {normalize_params(params)}")
+        return _replayed_response(url, record["status"], record["body"].encode("utf-8"))
+
+    target = _target_url(url)
+    for attempt in range(MAX_RETRIES + 1):
+        response = requests.get(target, params=params, headers=headers, timeout=timeout)
+        if response.status_code != 429 or attempt == MAX_RETRIES:
+            break
+        try:
+            delay = float(response.headers.get("Retry-After", ""))
+        except ValueError:
+            delay = RETRY_BACKOFF * 2 ** attempt
+        logging.warning(f"Throttled by {urlsplit(target).netloc}; retrying in {delay:.1f}s "
+                        f"(attempt {attempt + 1}/{MAX_RETRIES}).")
+        time.sleep(delay)
+
+    if mode == "record" and response.ok:
+        save_fixture(url, params, response.status_code, response.content, root)
+    if response.ok and not MOCK_URL:
+        # Keep the raw payload so history can be re-parsed later (see archive.py); mock data is not history
+        import archive
+        archive.archive_response(url, params, response.content)
+    return response
+
+
+def configure(mode: Optional[str] = None, mock_url: Optional[str] = None, root: Optional[str] = None) -> None:
+    """Override the environment-derived settings, e.g. from command-line flags."""
+    global HTTP_MODE, MOCK_URL, FIXTURE_ROOT
+    if mode is not None:
+        if mode not in HTTP_MODES:
+            raise ValueError(f"Unknown HTTP mode '{mode}'; expected one of {', '.join(HTTP_MODES)}.")
+        HTTP_MODE = mode
+    if mock_url is not None:
+        MOCK_URL = mock_url
+    if root is not None:
+        FIXTURE_ROOT = root
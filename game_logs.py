@@ -1,19 +1,12 @@
-import requests
-import pandas as pd
 import sqlite3
 import logging
 
-# Set up logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler("nba_game_log_fetch.log"),  # Log to a file
-        logging.StreamHandler()                        # Log to console
-    ]
-)
+import storage
+import fixtures
+import features
 
-logging.info("Script started.")
+LOG_FILE = "nba_game_log_fetch.log"
+DATABASE_NAME = "nba_game_logs.db"
 
 # Define the API endpoint and headers
 url = "https://stats.nba.com/stats/leaguegamelog"
@@ -42,103 +35,178 @@ params = {
     "Sorter": "DATE",
 }
 
-logging.info("API endpoint and headers defined.")
-logging.info("Query parameters set.")
-
-try:
-    # Make the API request
-    logging.info("Sending request to NBA stats API...")
-    response = requests.get(url, headers=headers, params=params, timeout=60)
-    response.raise_for_status()  # Raise an error if the request fails
-    logging.info("Request successful. Response received.")
-
-    # Parse JSON data
-    logging.info("Parsing response JSON data...")
-    data = response.json()
-    logging.info("JSON data parsed successfully.")
 
+def fetch_league_game_log(query_params=params):
+    """Request the league game log and return the parsed JSON, or {} if the request fails."""
+    import requests
+
+    try:
+        # Make the API request
+        logging.info("Sending request to NBA stats API...")
+        response = fixtures.get(url, headers=headers, params=query_params, timeout=60)
+        response.raise_for_status()  # Raise an error if the request fails
+        logging.info("Request successful. Response received.")
+
+        # Parse JSON data
+        logging.info("Parsing response JSON data...")
+        data = response.json()
+        logging.info("JSON data parsed successfully.")
+        return data
+    except requests.exceptions.RequestException as e:
+        logging.error(f"Request failed: {e}")
+        return {}
+
+
+def _create_game_logs_table(conn):
+    """Create the 'game_logs' table if it doesn't exist."""
+    create_table_query = """
+    CREATE TABLE IF NOT EXISTS game_logs (
+        SEASON_ID TEXT,
+        PLAYER_ID INTEGER,
+        PLAYER_NAME TEXT,
+        TEAM_ID INTEGER,
+        TEAM_ABBREVIATION TEXT,
+        TEAM_NAME TEXT,
+        GAME_ID TEXT,
+        GAME_DATE TEXT,
+        MATCHUP TEXT,
+        WL TEXT,
+        MIN INTEGER,
+        FGM INTEGER,
+        FGA INTEGER,
+        FG_PCT REAL,
+        FG3M INTEGER,
+        FG3A INTEGER,
+        FG3_PCT REAL,
+        FTM INTEGER,
+        FTA INTEGER,
+        FT_PCT REAL,
+        OREB INTEGER,
+        DREB INTEGER,
+        REB INTEGER,
+        AST INTEGER,
+        STL INTEGER,
+        BLK INTEGER,
+        TOV INTEGER,
+        PF INTEGER,
+        PTS INTEGER,
+        PLUS_MINUS INTEGER,
+        FANTASY_PTS REAL,
+        VIDEO_AVAILABLE INTEGER,
+        CHANGE_SEQ INTEGER,
+        PRIMARY KEY (GAME_ID, PLAYER_ID)
+    );
+    """
+    conn.execute(create_table_query)
+
+    # CHANGE_SEQ is bumped by every merge that inserts or corrects a row; the feature build keys off it.
+    # Tables created before it existed get it with every row marked changed once.
+    if "CHANGE_SEQ" not in {row[1] for row in conn.execute("PRAGMA table_info(game_logs);")}:
+        conn.execute("ALTER TABLE game_logs ADD COLUMN CHANGE_SEQ INTEGER;")
+        conn.execute("UPDATE game_logs SET CHANGE_SEQ = 1;")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_game_logs_change_seq ON game_logs (CHANGE_SEQ);")
+
+
+def _max_variables(conn):
+    """Bound parameters allowed per statement (999 on SQLite builds older than 3.32)."""
+    try:
+        return conn.getlimit(sqlite3.SQLITE_LIMIT_VARIABLE_NUMBER)
+    except AttributeError:  # Python < 3.11
+        return 999
+
+
+def _merge_game_log(conn, columns, rows):
+    """
+    Load rows into a temporary staging table, then merge them into 'game_logs'
+    with one set-based upsert. Rows whose values are unchanged are skipped, so a
+    re-run only writes what is new or corrected, stamped with the next CHANGE_SEQ.
+    Returns the number of rows written.
+    """
+    _create_game_logs_table(conn)
+    table_columns = {row[1] for row in conn.execute("PRAGMA table_info(game_logs);")} - {"CHANGE_SEQ"}
+    keep = [index for index, column in enumerate(columns) if column in table_columns]
+    columns = [columns[index] for index in keep]
+    column_list = ", ".join(columns)
+
+    # Staging keyed like the target, so duplicates within one payload collapse (last row wins)
+    conn.execute("DROP TABLE IF EXISTS temp.game_logs_staging;")
+    conn.execute(f"""
+        CREATE TEMP TABLE game_logs_staging AS SELECT {column_list} FROM game_logs WHERE 0;
+    """)
+    conn.execute("CREATE UNIQUE INDEX temp.idx_game_logs_staging_key ON game_logs_staging (GAME_ID, PLAYER_ID);")
+
+    # Multi-row INSERTs sized so each statement stays under the bound-variable limit
+    rows_per_chunk = max(1, _max_variables(conn) // len(columns))
+    row_placeholders = "(" + ", ".join("?" for _ in columns) + ")"
+    for start in range(0, len(rows), rows_per_chunk):
+        chunk = rows[start:start + rows_per_chunk]
+        conn.execute(
+            f"INSERT OR REPLACE INTO game_logs_staging ({column_list}) "
+            f"VALUES {', '.join(row_placeholders for _ in chunk)};",
+            [row[index] for row in chunk for index in keep],
+        )
+
+    updates = [column for column in columns if column not in ("GAME_ID", "PLAYER_ID")]
+    change_seq = conn.execute("SELECT COALESCE(MAX(CHANGE_SEQ), 0) + 1 FROM game_logs;").fetchone()[0]
+    before = conn.total_changes
+    conn.execute(f"""
+        INSERT INTO game_logs ({column_list}, CHANGE_SEQ)
+        SELECT {column_list}, ? FROM game_logs_staging WHERE true
+        ON CONFLICT (GAME_ID, PLAYER_ID) DO UPDATE SET
+            {', '.join(f"{column} = excluded.{column}" for column in updates)},
+            CHANGE_SEQ = excluded.CHANGE_SEQ
+        WHERE {' OR '.join(f"{column} IS NOT excluded.{column}" for column in updates)};
+    """, (change_seq,))
+    written = conn.total_changes - before
+    conn.execute("DROP TABLE temp.game_logs_staging;")
+    return written
+
+
+def store_league_game_log(data, database=DATABASE_NAME):
+    """Merge a league game log response into the 'game_logs' table and refresh the feature tables."""
     # Extract headers and rows from the resultSets
     logging.info("Extracting headers and rows from the response...")
     result_sets = data.get("resultSets", [])
-    if result_sets:
-        game_log = result_sets[0]  # Assuming the first resultSet contains game logs
-        headers = game_log.get("headers", [])
-        rows = game_log.get("rowSet", [])
-        logging.info("Headers and rows extracted.")
-
-        # Convert data to a pandas DataFrame
-        logging.info("Converting data to a pandas DataFrame...")
-        df = pd.DataFrame(rows, columns=headers)
-        logging.info("Data successfully converted to DataFrame.")
-        logging.info(f"DataFrame shape: {df.shape}")
-
-        # Log data types and sample data
-        logging.info("Logging column data types and a sample of the data:")
-        logging.info(f"Column data types:\n{df.dtypes}")
-        logging.info(f"Sample data:\n{df.head()}")
-
-        # Database connection and storage
-        logging.info("Connecting to SQLite database...")
-        conn = sqlite3.connect("nba_game_logs.db")
-        cursor = conn.cursor()
-
-        # Create the table if it doesn't exist
-        logging.info("Creating table 'game_logs' if not exists...")
-        create_table_query = """
-        CREATE TABLE IF NOT EXISTS game_logs (
-            SEASON_ID TEXT,
-            PLAYER_ID INTEGER,
-            PLAYER_NAME TEXT,
-            TEAM_ID INTEGER,
-            TEAM_ABBREVIATION TEXT,
-            TEAM_NAME TEXT,
-            GAME_ID TEXT,
-            GAME_DATE TEXT,
-            MATCHUP TEXT,
-            WL TEXT,
-            MIN INTEGER,
-            FGM INTEGER,
-            FGA INTEGER,
-            FG_PCT REAL,
-            FG3M INTEGER,
-            FG3A INTEGER,
-            FG3_PCT REAL,
-            FTM INTEGER,
-            FTA INTEGER,
-            FT_PCT REAL,
-            OREB INTEGER,
-            DREB INTEGER,
-            REB INTEGER,
-            AST INTEGER,
-            STL INTEGER,
-            BLK INTEGER,
-            TOV INTEGER,
-            PF INTEGER,
-            PTS INTEGER,
-            PLUS_MINUS INTEGER,
-            FANTASY_PTS REAL,
-            VIDEO_AVAILABLE INTEGER,
-            PRIMARY KEY (GAME_ID, PLAYER_ID)
-        );
-        """
-        cursor.execute(create_table_query)
-        conn.commit()
-        logging.info("Table 'game_logs' is ready.")
-
-        # Insert data into the database
-        logging.info("Inserting data into the 'game_logs' table...")
-        df.to_sql("game_logs", conn, if_exists="append", index=False, method="multi")
-        logging.info("Data inserted successfully into 'game_logs'.")
-
-        # Close the database connection
-        conn.close()
-        logging.info("Database connection closed.")
-    else:
+    if not result_sets:
         logging.warning("No resultSets found in the response.")
-except requests.exceptions.RequestException as e:
-    logging.error(f"Request failed: {e}")
-except Exception as e:
-    logging.error(f"An unexpected error occurred: {e}")
-
-logging.info("Script finished.")
-
+        return 0
+
+    game_log = result_sets[0]  # Assuming the first resultSet contains game logs
+    columns = game_log.get("headers", [])
+    rows = game_log.get("rowSet", [])
+    logging.info(f"Headers and rows extracted: {len(rows)} rows, {len(columns)} columns.")
+    if not columns or not rows:
+        return 0
+
+    # Stage and upsert through the shared writer; re-running with the same season is a no-op
+    logging.info("Merging data into the 'game_logs' table...")
+    written = storage.run_write(database, _merge_game_log, columns, rows)
+    logging.info(f"Merged {len(rows)} fetched rows into 'game_logs': {written} new or changed.")
+
+    # Refresh opponent, rest and pace features for the newly stored games
+    features.update_features(database)
+    return written
+
+
+def main():
+    logging.info("Script started.")
+    try:
+        data = fetch_league_game_log()
+        if data:
+            store_league_game_log(data)
+    except Exception as e:
+        logging.error(f"An unexpected error occurred: {e}")
+    logging.info("Script finished.")
+
+
+if __name__ == "__main__":
+    # Set up logging
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(levelname)s - %(message)s',
+        handlers=[
+            logging.FileHandler(LOG_FILE),  # Log to a file
+            logging.StreamHandler()         # Log to console
+        ]
+    )
+    main()
@@ -1,30 +1,25 @@
 # logs.py
 
-import requests
-import pandas as pd
 import sqlite3
 import logging
 from datetime import datetime
 from typing import List, Dict, Any, Tuple
 
-# ------------------------ Configuration ------------------------
+import storage
+import fixtures
+import columnar
+import metrics
 
-# Set up logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler("nba_game_log_fetch.log"),  # Log to a file
-        logging.StreamHandler()                        # Log to console
-    ]
-)
+# ------------------------ Configuration ------------------------
 
-logging.info("Script started.")
+LOG_FILE = "nba_game_log_fetch.log"
 
 # Define the API endpoint and headers
 # NOTE: Replace 'YOUR_API_KEY_HERE' with your actual NBA API key if required.
 # The NBA Stats API typically doesn't require an API key, but headers are necessary to mimic a browser request.
 url = "https://stats.nba.com/stats/leaguegamelog"
+# The game log carries no positions; the league player index does
+positions_url = "https://stats.nba.com/stats/playerindex"
 headers = {
     "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) "
                   "AppleWebKit/537.36 (KHTML, like Gecko) "
@@ -57,74 +52,80 @@ DATABASE_NAME = "nba.db"
 
 # ------------------------ Database Initialization ------------------------
 
+def _create_tables(conn: sqlite3.Connection) -> None:
+    """
+    Create the 'players' and 'game_logs' tables if they do not already exist.
+    """
+    cursor = conn.cursor()
+
+    # Create 'players' table
+    create_players_table = """
+    CREATE TABLE IF NOT EXISTS players (
+        player_id INTEGER PRIMARY KEY,
+        primary_name TEXT UNIQUE NOT NULL,
+        alternate_names TEXT,
+        position TEXT,
+        current_team TEXT
+    );
+    """
+    cursor.execute(create_players_table)
+
+    # Create 'game_logs' table
+    create_game_logs_table = """
+    CREATE TABLE IF NOT EXISTS game_logs (
+        game_log_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        player_id INTEGER NOT NULL,
+        game_id TEXT NOT NULL,
+        game_date TEXT,
+        team_id INTEGER,
+        team_abbreviation TEXT,
+        minutes_played INTEGER,
+        fgm INTEGER,
+        fga INTEGER,
+        fg_pct REAL,
+        fg3m INTEGER,
+        fg3a INTEGER,
+        fg3_pct REAL,
+        ftm INTEGER,
+        fta INTEGER,
+        ft_pct REAL,
+        oreb INTEGER,
+        dreb INTEGER,
+        reb INTEGER,
+        ast INTEGER,
+        stl INTEGER,
+        blk INTEGER,
+        tov INTEGER,
+        pf INTEGER,
+        pts INTEGER,
+        plus_minus INTEGER,
+        fantasy_pts REAL,
+        video_available INTEGER,
+        change_seq INTEGER,
+        FOREIGN KEY (player_id) REFERENCES players(player_id),
+        UNIQUE (player_id, game_id)
+    );
+    """
+    cursor.execute(create_game_logs_table)
+
+    # change_seq is bumped by every ingest batch that inserts or changes a row; exports key off it.
+    # Tables created before it existed get it with every row marked changed once.
+    cursor.execute("PRAGMA table_info(game_logs);")
+    if "change_seq" not in {row[1] for row in cursor.fetchall()}:
+        cursor.execute("ALTER TABLE game_logs ADD COLUMN change_seq INTEGER;")
+        cursor.execute("UPDATE game_logs SET change_seq = 1;")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_game_logs_change_seq ON game_logs (change_seq);")
+
 def initialize_database(db_name: str) -> None:
     """
     Initialize the SQLite database with 'players' and 'game_logs' tables.
     Creates the tables if they do not already exist.
     """
     try:
-        conn = sqlite3.connect(db_name)
-        cursor = conn.cursor()
-
-        # Enable foreign key constraints
-        cursor.execute("PRAGMA foreign_keys = ON;")
-
-        # Create 'players' table
-        create_players_table = """
-        CREATE TABLE IF NOT EXISTS players (
-            player_id INTEGER PRIMARY KEY,
-            primary_name TEXT UNIQUE NOT NULL,
-            alternate_names TEXT,
-            position TEXT,
-            current_team TEXT
-        );
-        """
-        cursor.execute(create_players_table)
-
-        # Create 'game_logs' table
-        create_game_logs_table = """
-        CREATE TABLE IF NOT EXISTS game_logs (
-            game_log_id INTEGER PRIMARY KEY AUTOINCREMENT,
-            player_id INTEGER NOT NULL,
-            game_id TEXT NOT NULL,
-            game_date TEXT,
-            team_id INTEGER,
-            team_abbreviation TEXT,
-            minutes_played INTEGER,
-            fgm INTEGER,
-            fga INTEGER,
-            fg_pct REAL,
-            fg3m INTEGER,
-            fg3a INTEGER,
-            fg3_pct REAL,
-            ftm INTEGER,
-            fta INTEGER,
-            ft_pct REAL,
-            oreb INTEGER,
-            dreb INTEGER,
-            reb INTEGER,
-            ast INTEGER,
-            stl INTEGER,
-            blk INTEGER,
-            tov INTEGER,
-            pf INTEGER,
-            pts INTEGER,
-            plus_minus INTEGER,
-            fantasy_pts REAL,
-            video_available INTEGER,
-            FOREIGN KEY (player_id) REFERENCES players(player_id),
-            UNIQUE (player_id, game_id)
-        );
-        """
-        cursor.execute(create_game_logs_table)
-
-        # Commit changes
-        conn.commit()
+        storage.run_write(db_name, _create_tables)
         logging.info(f"Database '{db_name}' initialized with 'players' and 'game_logs' tables.")
     except sqlite3.Error as e:
         logging.error(f"Error initializing database '{db_name}': {e}")
-    finally:
-        conn.close()
 
 # ------------------------ API Fetching Functions ------------------------
 
@@ -132,16 +133,43 @@ def fetch_game_logs(params: Dict[str, Any]) -> Dict[str, Any]:
     """
     Fetch game logs from the NBA Stats API based on provided parameters.
     """
+    import requests
+
     try:
         logging.info("Sending request to NBA Stats API...")
-        response = requests.get(url, headers=headers, params=params, timeout=60)
-        response.raise_for_status()  # Raise an error if the request fails
+        with metrics.track("logs", "fetch") as m:
+            response = fixtures.get(url, headers=headers, params=params, timeout=60)
+            response.raise_for_status()  # Raise an error if the request fails
+            m.bytes += len(response.content)
+            data = response.json()
         logging.info("Request successful. Response received.")
-        return response.json()
+        return data
     except requests.exceptions.RequestException as e:
         logging.error(f"Request failed: {e}")
         return {}
 
+def fetch_player_positions(season: str) -> Dict[int, str]:
+    """
+    Fetch every player's listed position (e.g. 'G', 'F-C') for a season from the
+    NBA Stats player index. Returns {player_id: position}, empty if the request fails.
+    """
+    import requests
+
+    try:
+        response = fixtures.get(positions_url, headers=headers,
+                                params={"LeagueID": "00", "Season": season, "Historical": "0"}, timeout=60)
+        response.raise_for_status()
+        result_set = response.json().get("resultSets", [{}])[0]
+    except (requests.exceptions.RequestException, ValueError, IndexError) as e:
+        logging.error(f"Fetching player positions failed: {e}")
+        return {}
+    columns = result_set.get("headers", [])
+    if "PERSON_ID" not in columns or "POSITION" not in columns:
+        logging.warning("Player index response has no PERSON_ID/POSITION columns.")
+        return {}
+    id_index, position_index = columns.index("PERSON_ID"), columns.index("POSITION")
+    return {row[id_index]: row[position_index] for row in result_set.get("rowSet", []) if row[position_index]}
+
 # ------------------------ Data Parsing Functions ------------------------
 
 def parse_players(game_logs: List[Dict[str, Any]]) -> List[Tuple[int, str, str, str, str]]:
@@ -207,153 +235,229 @@ def parse_game_log_data(game_logs: List[Dict[str, Any]]) -> List[Dict[str, Any]]
 
 # ------------------------ Database Operations ------------------------
 
-def upsert_player(conn: sqlite3.Connection, player_data: Tuple[int, str, str, str, str]) -> None:
+def upsert_players(conn: sqlite3.Connection, players: List[Tuple[int, str, str, str, str]]) -> None:
     """
-    Insert a new player or update an existing player's information.
+    Insert new players or update existing players' information in one statement.
+    Runs inside the caller's transaction; errors propagate so the writer rolls the batch back.
     """
-    try:
-        cursor = conn.cursor()
-        cursor.execute("""
-            INSERT INTO players (player_id, primary_name, alternate_names, position, current_team)
-            VALUES (?, ?, ?, ?, ?)
-            ON CONFLICT(player_id) DO UPDATE SET
-                primary_name=excluded.primary_name,
-                alternate_names=excluded.alternate_names,
-                position=excluded.position,
-                current_team=excluded.current_team;
-        """, player_data)
-        conn.commit()
-        logging.info(f"Upserted player '{player_data[1]}' (ID: {player_data[0]}).")
-    except sqlite3.Error as e:
-        logging.error(f"Error upserting player '{player_data[1]}' (ID: {player_data[0]}): {e}")
-
-def upsert_game_log(conn: sqlite3.Connection, game_log_data: Dict[str, Any]) -> None:
+    conn.executemany("""
+        INSERT INTO players (player_id, primary_name, alternate_names, position, current_team)
+        VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT(player_id) DO UPDATE SET
+            primary_name=excluded.primary_name,
+            -- The game log never has alternate names; keep the ones reconcile-names added
+            alternate_names=COALESCE(NULLIF(excluded.alternate_names, ''), players.alternate_names),
+            -- The game log has no positions; keep the ones update_player_positions stored
+            position=COALESCE(NULLIF(excluded.position, ''), players.position),
+            current_team=excluded.current_team;
+    """, players)
+    logging.debug("Upserted %d players.", len(players))
+
+def upsert_game_logs(conn: sqlite3.Connection, game_logs: List[Dict[str, Any]]) -> None:
     """
-    Insert a new game log or update an existing one if it exists.
+    Insert new game logs or update existing ones in one statement. Each log carries
+    the batch's change_seq, which is only written to rows that are new or changed.
+    Runs inside the caller's transaction; errors propagate so the writer rolls the batch back.
     """
-    try:
-        cursor = conn.cursor()
-        cursor.execute("""
-            INSERT INTO game_logs (
-                player_id, game_id, game_date, team_id, team_abbreviation,
-                minutes_played, fgm, fga, fg_pct, fg3m, fg3a, fg3_pct,
-                ftm, fta, ft_pct, oreb, dreb, reb, ast, stl, blk,
-                tov, pf, pts, plus_minus, fantasy_pts, video_available
-            ) VALUES (
-                :player_id, :game_id, :game_date, :team_id, :team_abbreviation,
-                :minutes_played, :fgm, :fga, :fg_pct, :fg3m, :fg3a, :fg3_pct,
-                :ftm, :fta, :ft_pct, :oreb, :dreb, :reb, :ast, :stl, :blk,
-                :tov, :pf, :pts, :plus_minus, :fantasy_pts, :video_available
-            )
-            ON CONFLICT(player_id, game_id) DO UPDATE SET
-                game_date=excluded.game_date,
-                team_id=excluded.team_id,
-                team_abbreviation=excluded.team_abbreviation,
-                minutes_played=excluded.minutes_played,
-                fgm=excluded.fgm,
-                fga=excluded.fga,
-                fg_pct=excluded.fg_pct,
-                fg3m=excluded.fg3m,
-                fg3a=excluded.fg3a,
-                fg3_pct=excluded.fg3_pct,
-                ftm=excluded.ftm,
-                fta=excluded.fta,
-                ft_pct=excluded.ft_pct,
-                oreb=excluded.oreb,
-                dreb=excluded.dreb,
-                reb=excluded.reb,
-                ast=excluded.ast,
-                stl=excluded.stl,
-                blk=excluded.blk,
-                tov=excluded.tov,
-                pf=excluded.pf,
-                pts=excluded.pts,
-                plus_minus=excluded.plus_minus,
-                fantasy_pts=excluded.fantasy_pts,
-                video_available=excluded.video_available;
-        """, game_log_data)
-        conn.commit()
-        logging.info(f"Upserted game log for player ID {game_log_data['player_id']} in game ID {game_log_data['game_id']}.")
-    except sqlite3.Error as e:
-        logging.error(f"Error upserting game log for player ID {game_log_data['player_id']} in game ID {game_log_data['game_id']}: {e}")
-
-# ------------------------ Main Execution Flow ------------------------
-
-def main():
+    conn.executemany("""
+        INSERT INTO game_logs (
+            player_id, game_id, game_date, team_id, team_abbreviation,
+            minutes_played, fgm, fga, fg_pct, fg3m, fg3a, fg3_pct,
+            ftm, fta, ft_pct, oreb, dreb, reb, ast, stl, blk,
+            tov, pf, pts, plus_minus, fantasy_pts, video_available, change_seq
+        ) VALUES (
+            :player_id, :game_id, :game_date, :team_id, :team_abbreviation,
+            :minutes_played, :fgm, :fga, :fg_pct, :fg3m, :fg3a, :fg3_pct,
+            :ftm, :fta, :ft_pct, :oreb, :dreb, :reb, :ast, :stl, :blk,
+            :tov, :pf, :pts, :plus_minus, :fantasy_pts, :video_available, :change_seq
+        )
+        ON CONFLICT(player_id, game_id) DO UPDATE SET
+            game_date=excluded.game_date,
+            team_id=excluded.team_id,
+            team_abbreviation=excluded.team_abbreviation,
+            minutes_played=excluded.minutes_played,
+            fgm=excluded.fgm,
+            fga=excluded.fga,
+            fg_pct=excluded.fg_pct,
+            fg3m=excluded.fg3m,
+            fg3a=excluded.fg3a,
+            fg3_pct=excluded.fg3_pct,
+            ftm=excluded.ftm,
+            fta=excluded.fta,
+            ft_pct=excluded.ft_pct,
+            oreb=excluded.oreb,
+            dreb=excluded.dreb,
+            reb=excluded.reb,
+            ast=excluded.ast,
+            stl=excluded.stl,
+            blk=excluded.blk,
+            tov=excluded.tov,
+            pf=excluded.pf,
+            pts=excluded.pts,
+            plus_minus=excluded.plus_minus,
+            fantasy_pts=excluded.fantasy_pts,
+            video_available=excluded.video_available,
+            change_seq=excluded.change_seq
+        -- Rows that come back unchanged keep their change_seq, so exports skip them
+        WHERE game_date IS NOT excluded.game_date
+            OR team_id IS NOT excluded.team_id
+            OR team_abbreviation IS NOT excluded.team_abbreviation
+            OR minutes_played IS NOT excluded.minutes_played
+            OR fgm IS NOT excluded.fgm
+            OR fga IS NOT excluded.fga
+            OR fg_pct IS NOT excluded.fg_pct
+            OR fg3m IS NOT excluded.fg3m
+            OR fg3a IS NOT excluded.fg3a
+            OR fg3_pct IS NOT excluded.fg3_pct
+            OR ftm IS NOT excluded.ftm
+            OR fta IS NOT excluded.fta
+            OR ft_pct IS NOT excluded.ft_pct
+            OR oreb IS NOT excluded.oreb
+            OR dreb IS NOT excluded.dreb
+            OR reb IS NOT excluded.reb
+            OR ast IS NOT excluded.ast
+            OR stl IS NOT excluded.stl
+            OR blk IS NOT excluded.blk
+            OR tov IS NOT excluded.tov
+            OR pf IS NOT excluded.pf
+            OR pts IS NOT excluded.pts
+            OR plus_minus IS NOT excluded.plus_minus
+            OR fantasy_pts IS NOT excluded.fantasy_pts
+            OR video_available IS NOT excluded.video_available;
+    """, game_logs)
+    logging.debug("Upserted %d game logs.", len(game_logs))
+
+def store_game_logs(conn: sqlite3.Connection, players: List[Tuple[int, str, str, str, str]],
+                    parsed_game_logs: List[Dict[str, Any]]) -> None:
     """
-    Main function to orchestrate fetching, parsing, and storing game logs.
+    Upsert parsed players and game logs as one batch on the given connection.
+    Meant for storage.run_write, which makes the batch a single transaction.
     """
-    # Initialize the database and tables
-    initialize_database(DATABASE_NAME)
+    _create_tables(conn)  # Also migrates older tables to carry change_seq
+    change_seq = conn.execute("SELECT COALESCE(MAX(change_seq), 0) + 1 FROM game_logs;").fetchone()[0]
+    complete_logs = []
+    for log in parsed_game_logs:
+        # Ensure that player_id and game_id exist before inserting
+        if log['player_id'] and log['game_id']:
+            complete_logs.append(dict(log, change_seq=change_seq))
+        else:
+            logging.warning(f"Incomplete game log data: {log}")
 
-    # Connect to the database
-    try:
-        conn = sqlite3.connect(DATABASE_NAME)
-        logging.info(f"Connected to database '{DATABASE_NAME}'.")
-    except sqlite3.Error as e:
-        logging.error(f"Error connecting to database '{DATABASE_NAME}': {e}")
-        return
+    upsert_players(conn, players)
+    upsert_game_logs(conn, complete_logs)
 
-    # Fetch game logs from the API
-    response_json = fetch_game_logs(params)
+def update_player_positions(conn: sqlite3.Connection, positions: Dict[int, str]) -> int:
+    """Set players.position for known players whose position changed. Returns the number updated."""
+    before = conn.total_changes
+    conn.executemany("UPDATE players SET position = ? WHERE player_id = ? AND position IS NOT ?;",
+                     [(position, player_id, position) for player_id, position in positions.items()])
+    return conn.total_changes - before
 
-    # Check if response contains data
-    if not response_json:
-        logging.warning("No data received from API. Exiting.")
-        conn.close()
-        return
+# ------------------------ Main Execution Flow ------------------------
+
+def ingest_game_logs(response_json: Dict[str, Any], database: str = DATABASE_NAME) -> int:
+    """
+    Parse a leaguegamelog response and upsert its players and game logs.
+    Returns the number of game logs stored.
+    """
+    import pandas as pd
 
     # Extract headers and rows from the resultSets
     result_sets = response_json.get("resultSets", [])
     if not result_sets:
-        logging.warning("No resultSets found in the response. Exiting.")
-        conn.close()
-        return
+        logging.warning("No resultSets found in the response. Nothing stored.")
+        return 0
 
     game_log_set = result_sets[0]  # Assuming the first resultSet contains game logs
     headers = game_log_set.get("headers", [])
     rows = game_log_set.get("rowSet", [])
 
     if not headers or not rows:
-        logging.warning("No headers or rows found in the first resultSet. Exiting.")
-        conn.close()
-        return
+        logging.warning("No headers or rows found in the first resultSet. Nothing stored.")
+        return 0
 
     # Convert data to a pandas DataFrame
-    df = pd.DataFrame(rows, columns=headers)
+    with metrics.track("logs", "transform") as m:
+        df = pd.DataFrame(rows, columns=headers)
+        game_logs = df.to_dict(orient='records')
+        m.rows += len(game_logs)
     logging.info("Data successfully converted to DataFrame.")
     logging.info(f"DataFrame shape: {df.shape}")
 
-    # Log data types and sample data
-    logging.info("Logging column data types and a sample of the data:")
-    logging.info(f"Column data types:\n{df.dtypes}")
-    logging.info(f"Sample data:\n{df.head()}")
+    # Log data types and sample data (formatting these is not free, so only when debugging)
+    if logging.getLogger().isEnabledFor(logging.DEBUG):
+        logging.debug(f"Column data types:\n{df.dtypes}")
+        logging.debug(f"Sample data:\n{df.head()}")
 
     # Parse player data and game log data
-    game_logs = df.to_dict(orient='records')
-    players = parse_players(game_logs)
-    parsed_game_logs = parse_game_log_data(game_logs)
+    with metrics.track("logs", "parse") as m:
+        players = parse_players(game_logs)
+        parsed_game_logs = parse_game_log_data(game_logs)
+        m.rows += len(parsed_game_logs)
 
     logging.info(f"Parsed {len(players)} unique players.")
     logging.info(f"Parsed {len(parsed_game_logs)} game logs.")
 
-    # Upsert players and game logs into the database
-    for player in players:
-        upsert_player(conn, player)
+    # Upsert players and game logs into the database through the shared writer
+    with metrics.track("logs", "write") as m:
+        storage.run_write(database, store_game_logs, players, parsed_game_logs)
+        m.rows += len(players) + len(parsed_game_logs)
+    logging.info(f"Stored game logs in database '{database}'.")
 
-    for log in parsed_game_logs:
-        # Ensure that player_id and game_id exist before inserting
-        if log['player_id'] and log['game_id']:
-            upsert_game_log(conn, log)
-        else:
-            logging.warning(f"Incomplete game log data: {log}")
+    # Refresh the Parquet copy of the touched dates for analytical queries
+    columnar.export_after_ingest(columnar.export_game_logs, database)
+    return len(parsed_game_logs)
+
+
+def ingest_player_positions(database: str = DATABASE_NAME, season: str = params["Season"]) -> int:
+    """
+    Fetch the season's player positions and store them on the players table, which
+    features.py reads for allowances by position. Returns the number of players updated.
+    """
+    positions = fetch_player_positions(season)
+    if not positions:
+        return 0
+    updated = storage.run_write(database, update_player_positions, positions)
+    logging.info(f"Updated positions for {updated} players.")
+    return updated
+
+
+def main():
+    """
+    Main function to orchestrate fetching, parsing, and storing game logs.
+    """
+    logging.info("Script started.")
+
+    # Initialize the database and tables
+    initialize_database(DATABASE_NAME)
+
+    # Fetch game logs from the API
+    response_json = fetch_game_logs(params)
+
+    # Check if response contains data
+    if not response_json:
+        logging.warning("No data received from API. Exiting.")
+        return
+
+    try:
+        ingest_game_logs(response_json, DATABASE_NAME)
+        ingest_player_positions(DATABASE_NAME, params["Season"])
+    except sqlite3.Error as e:
+        # The writer rolled the whole batch back, so nothing partial was stored
+        logging.error(f"Storing game logs failed: {e}")
 
-    # Close the database connection
-    conn.close()
-    logging.info(f"Database '{DATABASE_NAME}' connection closed.")
+    metrics.export(DATABASE_NAME)
 
     logging.info("Script finished.")
 
 if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(levelname)s - %(message)s',
+        handlers=[
+            logging.FileHandler(LOG_FILE),  # Log to a file
+            logging.StreamHandler()         # Log to console
+        ]
+    )
     main()
 
@@ -0,0 +1,192 @@
+# markets.py
+
+import sqlite3
+import logging
+from typing import Any, Dict, Iterable, List, Tuple
+
+import numpy as np
+
+import storage
+
+# ------------------------ Configuration ------------------------
+
+CONSENSUS_TABLE = "prop_consensus"
+
+# ------------------------ Odds Math ------------------------
+
+def american_to_implied(odds: np.ndarray) -> np.ndarray:
+    """Convert American odds to implied probabilities (NaN stays NaN)."""
+    odds = np.asarray(odds, dtype=float)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.where(odds < 0, -odds / (100.0 - odds), 100.0 / (odds + 100.0))
+
+
+def _best_per_group(values: np.ndarray, groups: np.ndarray, n_groups: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Return (best value, row index of the best value) per group, ignoring NaN.
+    Higher American odds always pay more, so "best" is simply the maximum.
+    Groups without a value get NaN and index -1.
+    """
+    best_value = np.full(n_groups, np.nan)
+    best_index = np.full(n_groups, -1, dtype=np.int64)
+    rows = np.flatnonzero(~np.isnan(values))
+    if rows.size == 0:
+        return best_value, best_index
+    # Sort by group then value; the last row of each group run holds the maximum
+    order = rows[np.lexsort((values[rows], groups[rows]))]
+    sorted_groups = groups[order]
+    last = np.append(sorted_groups[1:] != sorted_groups[:-1], True)
+    best_value[sorted_groups[last]] = values[order[last]]
+    best_index[sorted_groups[last]] = order[last]
+    return best_value, best_index
+
+# ------------------------ Consensus ------------------------
+
+def compute_consensus(snapshot: Iterable[Any]) -> List[Tuple]:
+    """
+    Combine one props snapshot across books.
+    Offers are grouped by (event, player, market, line). Each book that quotes both
+    sides is de-vigged by normalizing its implied over/under probabilities to sum to 1;
+    the consensus fair probability is the mean across those books. The best available
+    over and under price and the book offering it are reported for every group.
+
+    `snapshot` holds PropOffer records (or any objects with the same attributes).
+    Returns rows in CONSENSUS_TABLE column order.
+    """
+    groups: Dict[tuple, int] = {}
+    group_keys: List[tuple] = []
+    pairs: Dict[tuple, int] = {}
+    pair_group: List[int] = []
+    pair_bookie: List[str] = []
+    over: List[float] = []
+    under: List[float] = []
+    script_timestamp = None
+
+    # One Python pass assigns integer group and (group, book) ids; the math below is vectorized
+    for offer in snapshot:
+        side = str(offer.selection)[:1].lower()
+        if side not in ("o", "u"):
+            continue
+        try:
+            line = float(offer.prop_line)
+            odds = float(offer.odds)
+        except (TypeError, ValueError):
+            continue
+        script_timestamp = offer.script_timestamp
+        key = (str(offer.event_id), offer.player, offer.market, line)
+        group = groups.get(key)
+        if group is None:
+            group = groups[key] = len(group_keys)
+            group_keys.append(key)
+        pair_key = (group, offer.bookie)
+        pair = pairs.get(pair_key)
+        if pair is None:
+            pair = pairs[pair_key] = len(pair_group)
+            pair_group.append(group)
+            pair_bookie.append(offer.bookie)
+            over.append(np.nan)
+            under.append(np.nan)
+        if side == "o":
+            over[pair] = odds
+        else:
+            under[pair] = odds
+
+    n_groups = len(group_keys)
+    if n_groups == 0:
+        return []
+
+    pair_groups = np.asarray(pair_group, dtype=np.int64)
+    over_odds = np.asarray(over, dtype=float)
+    under_odds = np.asarray(under, dtype=float)
+    p_over = american_to_implied(over_odds)
+    p_under = american_to_implied(under_odds)
+
+    # De-vig books that quote both sides
+    two_sided = ~np.isnan(p_over) & ~np.isnan(p_under)
+    total = p_over + p_under
+    fair_over = np.where(two_sided, p_over / np.where(two_sided, total, 1.0), 0.0)
+    books = np.bincount(pair_groups, weights=two_sided, minlength=n_groups)
+    fair_sum = np.bincount(pair_groups, weights=fair_over, minlength=n_groups)
+    hold_sum = np.bincount(pair_groups, weights=np.where(two_sided, total - 1.0, 0.0), minlength=n_groups)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        consensus_over = np.where(books > 0, fair_sum / books, np.nan)
+        average_hold = np.where(books > 0, hold_sum / books, np.nan)
+
+    best_over, best_over_pair = _best_per_group(over_odds, pair_groups, n_groups)
+    best_under, best_under_pair = _best_per_group(under_odds, pair_groups, n_groups)
+
+    def _value(array, index):
+        value = array[index]
+        return None if np.isnan(value) else float(value)
+
+    rows = []
+    for index, (event_id, player, market, line) in enumerate(group_keys):
+        consensus = _value(consensus_over, index)
+        rows.append((
+            script_timestamp, event_id, player, market, line, int(books[index]),
+            consensus, None if consensus is None else 1.0 - consensus, _value(average_hold, index),
+            _value(best_over, index), pair_bookie[best_over_pair[index]] if best_over_pair[index] >= 0 else None,
+            _value(best_under, index), pair_bookie[best_under_pair[index]] if best_under_pair[index] >= 0 else None,
+        ))
+    return rows
+
+# ------------------------ Storage ------------------------
+
+def _save_consensus(conn: sqlite3.Connection, rows: List[Tuple]) -> None:
+    cursor = conn.cursor()
+    cursor.execute(f"""
+    CREATE TABLE IF NOT EXISTS {CONSENSUS_TABLE} (
+        script_timestamp TEXT NOT NULL,
+        event_id TEXT,
+        player TEXT,
+        market TEXT,
+        prop_line REAL,
+        books INTEGER,
+        consensus_over_prob REAL,
+        consensus_under_prob REAL,
+        average_hold REAL,
+        best_over_odds REAL,
+        best_over_book TEXT,
+        best_under_odds REAL,
+        best_under_book TEXT
+    );
+    """)
+    cursor.execute(f"""
+    CREATE INDEX IF NOT EXISTS idx_{CONSENSUS_TABLE}_offer
+    ON {CONSENSUS_TABLE} (event_id, player, market, prop_line, script_timestamp);
+    """)
+    cursor.execute(f"""
+    CREATE INDEX IF NOT EXISTS idx_{CONSENSUS_TABLE}_snapshot ON {CONSENSUS_TABLE} (script_timestamp);
+    """)
+    cursor.executemany(f"""
+    INSERT INTO {CONSENSUS_TABLE} (
+        script_timestamp, event_id, player, market, prop_line, books,
+        consensus_over_prob, consensus_under_prob, average_hold,
+        best_over_odds, best_over_book, best_under_odds, best_under_book
+    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?);
+    """, rows)
+
+
+def _replace_consensus(conn: sqlite3.Connection, script_timestamp: str, market: str, rows: List[Tuple]) -> int:
+    _save_consensus(conn, [])  # Creates the table if needed
+    conn.execute(f"DELETE FROM {CONSENSUS_TABLE} WHERE script_timestamp = ? AND market = ?;", (script_timestamp, market))
+    _save_consensus(conn, rows)
+    return len(rows)
+
+
+def replace_consensus(database: str, script_timestamp: str, market: str, snapshot: Iterable[Any]):
+    """
+    Recompute the consensus of one market in one stored snapshot, replacing its old rows,
+    e.g. after the snapshot was re-parsed. Queued on the shared writer; returns its future.
+    """
+    rows = compute_consensus(snapshot)
+    return storage.submit_write(database, _replace_consensus, script_timestamp, market, rows)
+
+
+def update_consensus(database: str, snapshot: Iterable[Any]) -> int:
+    """Compute consensus rows for a snapshot and store them. Returns the number of rows written."""
+    rows = compute_consensus(snapshot)
+    if rows:
+        storage.run_write(database, _save_consensus, rows)
+    logging.info(f"Stored {len(rows)} consensus lines.")
+    return len(rows)
@@ -0,0 +1,171 @@
+# metrics.py
+
+import os
+import time
+import sqlite3
+import logging
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Any, Dict, Iterator, List, Optional
+
+import storage
+
+# ------------------------ Configuration ------------------------
+
+METRICS_FILE = "metrics.prom"    # Prometheus textfile-collector output
+METRICS_TABLE = "pipeline_metrics"
+METRIC_PREFIX = "nbaprops"
+
+_lock = threading.Lock()
+_stages: Dict[tuple, "StageStats"] = {}
+
+# ------------------------ Recording ------------------------
+
+class StageStats:
+    """Cumulative counters for one (pipeline, stage) pair."""
+
+    __slots__ = ("calls", "seconds", "rows", "bytes", "errors", "last_seconds")
+
+    def __init__(self):
+        self.calls = 0
+        self.seconds = 0.0
+        self.rows = 0
+        self.bytes = 0
+        self.errors = 0
+        self.last_seconds = 0.0
+
+
+class StageRecord:
+    """Per-call handle yielded by track(); add the rows and bytes the stage handled."""
+
+    __slots__ = ("rows", "bytes")
+
+    def __init__(self):
+        self.rows = 0
+        self.bytes = 0
+
+
+@contextmanager
+def track(pipeline: str, stage: str) -> Iterator[StageRecord]:
+    """
+    Time a pipeline stage and count its rows, bytes and errors.
+
+        with metrics.track("props", "fetch") as m:
+            response = requests.get(...)
+            m.bytes += len(response.content)
+
+    Exceptions are counted as errors and re-raised.
+    """
+    record = StageRecord()
+    started = time.perf_counter()
+    failed = False
+    try:
+        yield record
+    except BaseException:
+        failed = True
+        raise
+    finally:
+        elapsed = time.perf_counter() - started
+        with _lock:
+            stats = _stages.get((pipeline, stage))
+            if stats is None:
+                stats = _stages[(pipeline, stage)] = StageStats()
+            stats.calls += 1
+            stats.seconds += elapsed
+            stats.last_seconds = elapsed
+            stats.rows += record.rows
+            stats.bytes += record.bytes
+            stats.errors += failed
+
+
+def snapshot() -> List[Dict[str, Any]]:
+    """Return the current counters as a list of dicts, one per stage."""
+    with _lock:
+        return [
+            {"pipeline": pipeline, "stage": stage, "calls": s.calls, "seconds": s.seconds,
+             "rows": s.rows, "bytes": s.bytes, "errors": s.errors, "last_seconds": s.last_seconds}
+            for (pipeline, stage), s in sorted(_stages.items())
+        ]
+
+
+def reset() -> None:
+    """Clear all counters."""
+    with _lock:
+        _stages.clear()
+
+# ------------------------ Export ------------------------
+
+def to_prometheus() -> str:
+    """Render the counters in the Prometheus text exposition format."""
+    families = [
+        ("stage_calls_total", "counter", "Number of times the stage ran.", "calls"),
+        ("stage_seconds_total", "counter", "Total wall-clock seconds spent in the stage.", "seconds"),
+        ("stage_last_seconds", "gauge", "Wall-clock seconds of the most recent run.", "last_seconds"),
+        ("stage_rows_total", "counter", "Rows handled by the stage.", "rows"),
+        ("stage_bytes_total", "counter", "Bytes handled by the stage.", "bytes"),
+        ("stage_errors_total", "counter", "Runs of the stage that raised an error.", "errors"),
+    ]
+    stages = snapshot()
+    lines = []
+    for name, kind, help_text, field in families:
+        metric = f"{METRIC_PREFIX}_{name}"
+        lines.append(f"# HELP {metric} {help_text}")
+        lines.append(f"# TYPE {metric} {kind}")
+        for s in stages:
+            lines.append(f'{metric}{{pipeline="{s["pipeline"]}",stage="{s["stage"]}"}} {s[field]}')
+    return "\n".join(lines) + "\n"
+
+
+def write_prometheus(path: str = METRICS_FILE) -> None:
+    """Atomically write the Prometheus text output, e.g. for node_exporter's textfile collector."""
+    temp_path = f"{path}.tmp"
+    with open(temp_path, "w") as metrics_file:
+        metrics_file.write(to_prometheus())
+    os.replace(temp_path, path)
+
+
+def _save_metrics(conn: sqlite3.Connection, recorded_at: str, stages: List[Dict[str, Any]]) -> None:
+    conn.execute(f"""
+    CREATE TABLE IF NOT EXISTS {METRICS_TABLE} (
+        recorded_at TEXT NOT NULL,
+        pipeline TEXT NOT NULL,
+        stage TEXT NOT NULL,
+        calls INTEGER,
+        seconds REAL,
+        rows INTEGER,
+        bytes INTEGER,
+        errors INTEGER
+    );
+    """)
+    conn.executemany(f"""
+        INSERT INTO {METRICS_TABLE} (recorded_at, pipeline, stage, calls, seconds, rows, bytes, errors)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?);
+    """, [(recorded_at, s["pipeline"], s["stage"], s["calls"], s["seconds"], s["rows"], s["bytes"], s["errors"])
+          for s in stages])
+
+
+def save_to_table(database: str) -> None:
+    """Append the current counters to the metrics table in a database."""
+    stages = snapshot()
+    if stages:
+        storage.run_write(database, _save_metrics, datetime.now().strftime("%Y-%m-%d %H:%M:%S"), stages)
+
+
+def export(database: Optional[str] = None, path: Optional[str] = METRICS_FILE) -> None:
+    """
+    Log a one-line summary per stage and export the counters to a Prometheus
+    text file and/or a metrics table. Export failures are logged, never raised.
+    """
+    for s in snapshot():
+        logging.info(
+            f"[metrics] {s['pipeline']}.{s['stage']}: {s['calls']} calls, {s['seconds']:.3f}s, "
+            f"{s['rows']} rows, {s['bytes']} bytes, {s['errors']} errors"
+        )
+    try:
+        if path:
+            write_prometheus(path)
+        if database:
+            save_to_table(database)
+    except (OSError, sqlite3.Error) as e:
+        logging.error(f"Failed to export metrics: {e}")
@@ -1,63 +1,114 @@
 import sqlite3
 
-def calculate_per_minute_stats(database, table_name, new_table_name):
-    """Calculate per-minute stats for relevant columns and create a new table."""
-    try:
-        conn = sqlite3.connect(database)
-        cursor = conn.cursor()
+import storage
+import metrics
+import readers
+
+# Define relevant columns to calculate per-minute stats
+RELEVANT_COLUMNS = [
+    "FGM", "FGA", "FG3M", "FG3A", "FTM", "FTA",
+    "OREB", "DREB", "REB", "AST", "STL", "BLK",
+    "TOV", "PF", "PTS", "PLUS_MINUS", "FANTASY_PTS"
+]
+KEY_COLUMNS = ("GAME_ID", "PLAYER_ID")
 
-        # Define relevant columns to calculate per-minute stats
-        relevant_columns = [
-            "FGM", "FGA", "FG3M", "FG3A", "FTM", "FTA", 
-            "OREB", "DREB", "REB", "AST", "STL", "BLK", 
-            "TOV", "PF", "PTS", "PLUS_MINUS", "FANTASY_PTS"
-        ]
+def _create_per_minute_table(conn, new_table_name, original_schema):
+    """
+    Create the per-minute table keyed on (GAME_ID, PLAYER_ID). A table from before
+    the key existed is dropped, so it is rebuilt from the source table; source
+    columns added since the table was created are added to it.
+    Returns True when the table is new and has to be filled from scratch.
+    """
+    cursor = conn.cursor()
+    cursor.execute(f"PRAGMA table_info({new_table_name});")
+    existing = cursor.fetchall()
+    keyed = any(col[5] for col in existing)
+    if not keyed:
+        cursor.execute(f"DROP TABLE IF EXISTS {new_table_name};")
+    else:
+        present = {col[1] for col in existing}
+        for col in original_schema:
+            if col[1] not in present:
+                cursor.execute(f"ALTER TABLE {new_table_name} ADD COLUMN {col[1]} {col[2]};")
+    create_table_query = f"CREATE TABLE IF NOT EXISTS {new_table_name} ("
+    for col in original_schema:
+        create_table_query += f"{col[1]} {col[2]}, "
+    for col in RELEVANT_COLUMNS:
+        create_table_query += f"{col}_PER_MIN REAL, "
+    create_table_query += f"PRIMARY KEY ({', '.join(KEY_COLUMNS)}));"
+    cursor.execute(create_table_query)
+    return not keyed
+
+def calculate_per_minute_stats(database, table_name, new_table_name, rows=None, column_names=None):
+    """
+    Calculate per-minute stats for relevant columns and upsert them into a table
+    keyed on (GAME_ID, PLAYER_ID), one writer transaction per chunk.
+    Pass rows and column_names (e.g. a freshly fetched game log) to use them
+    instead of reading the whole source table back from SQLite.
+    """
+    try:
+        cursor = storage.get_connection(database).cursor()
 
         # Check if MIN column exists and is of the correct type
         cursor.execute(f"PRAGMA table_info({table_name});")
-        schema = {col[1]: col[2] for col in cursor.fetchall()}
+        original_schema = cursor.fetchall()
+        schema = {col[1]: col[2] for col in original_schema}
         if "MIN" not in schema or schema["MIN"] not in ("REAL", "INTEGER"):
             print("Error: 'MIN' column is missing or not a numeric type.")
             return
+        if not all(col in schema for col in KEY_COLUMNS):
+            print(f"Error: '{table_name}' has no {' / '.join(KEY_COLUMNS)} columns to key the per-minute rows on.")
+            return
 
-        # Create the new table schema
-        cursor.execute(f"PRAGMA table_info({table_name});")
-        original_schema = cursor.fetchall()
-        create_table_query = f"CREATE TABLE IF NOT EXISTS {new_table_name} ("
-        for col in original_schema:
-            create_table_query += f"{col[1]} {col[2]}, "
-        for col in relevant_columns:
-            create_table_query += f"{col}_PER_MIN REAL, "
-        create_table_query = create_table_query.rstrip(", ") + ");"
-        cursor.execute(create_table_query)
+        # Create the new table schema; a rebuilt table needs every source row, not just the handed-over ones
+        rebuilt = storage.run_write(database, _create_per_minute_table, new_table_name, original_schema)
 
-        # Fetch data from the original table
-        cursor.execute(f"SELECT * FROM {table_name};")
-        rows = cursor.fetchall()
-        column_names = [desc[0] for desc in cursor.description]
+        # Stream the original table in chunks unless the rows were handed over in memory
+        if rows is None or rebuilt:
+            column_names = [col[1] for col in original_schema]
+            chunks = readers.iter_chunks(database, table_name, column_names)
+        else:
+            # Handed-over rows keep only the columns the source table has, like the game log merge
+            keep = [index for index, column in enumerate(column_names) if column in schema]
+            column_names = [column_names[index] for index in keep]
+            chunks = iter([[[row[index] for index in keep] for row in rows]])
 
-        # Process each row and calculate per-minute stats
-        for row in rows:
-            row_dict = dict(zip(column_names, row))
-            if row_dict["MIN"] and row_dict["MIN"] > 0:  # Avoid division by zero
-                for col in relevant_columns:
-                    row_dict[f"{col}_PER_MIN"] = row_dict[col] / row_dict["MIN"] if row_dict[col] is not None else None
-            else:
-                for col in relevant_columns:
-                    row_dict[f"{col}_PER_MIN"] = None
+        # Process each chunk and calculate per-minute stats, so memory stays bounded at any table size
+        output_columns = column_names + [f"{col}_PER_MIN" for col in RELEVANT_COLUMNS]
+        placeholders = ", ".join(["?" for _ in output_columns])
+        updates = ", ".join(f"{col} = excluded.{col}" for col in output_columns if col not in KEY_COLUMNS)
+        upsert_query = f"""
+            INSERT INTO {new_table_name} ({', '.join(output_columns)}) VALUES ({placeholders})
+            ON CONFLICT({', '.join(KEY_COLUMNS)}) DO UPDATE SET {updates};
+        """
+        while True:
+            with metrics.track("per_minute", "read") as m:
+                chunk = next(chunks, None)
+                m.rows += len(chunk or [])
+            if chunk is None:
+                break
 
-            # Insert the data into the new table
-            placeholders = ", ".join(["?" for _ in row_dict])
-            insert_query = f"INSERT INTO {new_table_name} ({', '.join(row_dict.keys())}) VALUES ({placeholders});"
-            cursor.execute(insert_query, tuple(row_dict.values()))
+            output_rows = []
+            with metrics.track("per_minute", "transform") as m:
+                for row in chunk:
+                    row_dict = dict(zip(column_names, row))
+                    if row_dict["MIN"] and row_dict["MIN"] > 0:  # Avoid division by zero
+                        for col in RELEVANT_COLUMNS:
+                            row_dict[f"{col}_PER_MIN"] = row_dict[col] / row_dict["MIN"] if row_dict[col] is not None else None
+                    else:
+                        for col in RELEVANT_COLUMNS:
+                            row_dict[f"{col}_PER_MIN"] = None
+                    output_rows.append(tuple(row_dict[col] for col in output_columns))
+                m.rows += len(output_rows)
 
-        conn.commit()
-        print(f"New table '{new_table_name}' with per-minute stats created successfully.")
+            # Upsert the chunk through the shared writer; re-runs and corrections replace rows in place
+            with metrics.track("per_minute", "write") as m:
+                storage.run_write(database, lambda conn: conn.executemany(upsert_query, output_rows))
+                m.rows += len(output_rows)
+        print(f"Table '{new_table_name}' with per-minute stats updated successfully.")
 
     except sqlite3.Error as e:
         print(f"SQLite error occurred: {e}")
-    finally:
-        conn.close()
 
 if __name__ == "__main__":
     database_path = "nba_game_logs.db"  # Change to your database path
@@ -65,4 +116,5 @@ if __name__ == "__main__":
     new_table_name = "game_logs_per_minute"  # Name for the new table
 
     calculate_per_minute_stats(database_path, original_table_name, new_table_name)
+    metrics.export(database_path)
 
@@ -0,0 +1,221 @@
+# mock_server.py
+
+import json
+import time
+import random
+import logging
+import argparse
+import threading
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlsplit
+from typing import Dict, Optional, Tuple
+
+import fixtures
+
+# ------------------------ Configuration ------------------------
+
+HOST = "127.0.0.1"
+PORT = 8765
+SLATE_OFFERS = (150, 5, 3)       # Synthetic offers per market at scale 1: (offers, books, lines per book)
+SLATE_GAME_LOGS = (450, 20)      # Synthetic league game log at scale 1: (players, games)
+PAGINATION_PARAMS = ("page", "limit")
+
+# ------------------------ Server ------------------------
+
+class MockServer:
+    """
+    Local stand-in for stats.nba.com and api.bettingpros.com.
+
+    Responses come from recorded fixtures (see fixtures.py). Offers requests with
+    page/limit are paginated from the unpaged recording. When nothing was recorded
+    and `synthetic` is on, a deterministic payload from benchmarks.py is served,
+    `scale` times the size of a normal slate. Latency, jitter, a requests-per-second
+    limit and periodic 429s exercise the client's concurrency and retry handling.
+    """
+
+    def __init__(self, host: str = HOST, port: int = 0, root: Optional[str] = None,
+                 latency: float = 0.0, jitter: float = 0.0, rate_limit: Optional[float] = None,
+                 throttle_every: int = 0, retry_after: float = 1.0, scale: int = 1, synthetic: bool = True):
+        self.root = root
+        self.latency = latency
+        self.jitter = jitter
+        self.rate_limit = rate_limit
+        self.throttle_every = throttle_every
+        self.retry_after = retry_after
+        self.scale = scale
+        self.synthetic = synthetic
+        self.stats = {"requests": 0, "throttled": 0, "served": 0, "missing": 0}
+        self._lock = threading.Lock()
+        self._recent = deque()
+        self._synthetic_cache: Dict[Tuple, bytes] = {}
+        self._server = ThreadingHTTPServer((host, port), self._handler_class())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> str:
+        self._thread = threading.Thread(target=self._server.serve_forever, name="mock-server", daemon=True)
+        self._thread.start()
+        logging.info(f"Mock server listening on {self.url}")
+        return self.url
+
+    def stop(self) -> None:
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self) -> "MockServer":
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.stop()
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                server._handle(self)
+
+            def log_message(self, format, *args):
+                logging.debug(f"[mock] {self.address_string()} {format % args}")
+
+        return Handler
+
+    # ------------------------ Request Handling ------------------------
+
+    def _throttled(self) -> bool:
+        now = time.monotonic()
+        with self._lock:
+            self.stats["requests"] += 1
+            count = self.stats["requests"]
+            if self.throttle_every and count % self.throttle_every == 0:
+                self.stats["throttled"] += 1
+                return True
+            if self.rate_limit:
+                while self._recent and now - self._recent[0] > 1.0:
+                    self._recent.popleft()
+                if len(self._recent) >= self.rate_limit:
+                    self.stats["throttled"] += 1
+                    return True
+                self._recent.append(now)
+        return False
+
+    def _handle(self, handler: BaseHTTPRequestHandler) -> None:
+        parts = urlsplit(handler.path)
+        params = dict(parse_qsl(parts.query, keep_blank_values=True))
+        if self.latency or self.jitter:
+            time.sleep(self.latency + random.uniform(0, self.jitter))
+
+        if self._throttled():
+            self._send(handler, 429, b'{"message": "Too Many Requests"}', {"Retry-After": str(self.retry_after)})
+            return
+
+        status, body = self._payload(parts.path, params)
+        with self._lock:
+            self.stats["served" if status == 200 else "missing"] += 1
+        self._send(handler, status, body)
+
+    @staticmethod
+    def _send(handler: BaseHTTPRequestHandler, status: int, body: bytes, headers: Optional[Dict[str, str]] = None) -> None:
+        handler.send_response(status)
+        handler.send_header("Content-Type", "application/json")
+        handler.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            handler.send_header(name, value)
+        handler.end_headers()
+        handler.wfile.write(body)
+
+    def _payload(self, path: str, params: Dict[str, str]) -> Tuple[int, bytes]:
+        record = fixtures.load_fixture(path, params, self.root)
+        if record is not None:
+            return record["status"], record["body"].encode("utf-8")
+
+        # Serve one page of a recording (or synthetic payload) made without page/limit
+        unpaged = {key: value for key, value in params.items() if key not in PAGINATION_PARAMS}
+        record = fixtures.load_fixture(path, unpaged, self.root)
+        if record is not None:
+            body = record["body"].encode("utf-8")
+        elif self.synthetic:
+            body = self._synthetic(path, unpaged)
+        else:
+            return 404, json.dumps({"message": f"No fixture for {path}"}).encode("utf-8")
+        if body is None:
+            return 404, json.dumps({"message": f"No fixture for {path}"}).encode("utf-8")
+        return 200, self._paginate(body, params)
+
+    def _synthetic(self, path: str, params: Dict[str, str]) -> Optional[bytes]:
+        import benchmarks
+
+        endpoint = path.rstrip("/").rsplit("/", 1)[-1]
+        key = (endpoint, tuple(sorted(params.items())))
+        body = self._synthetic_cache.get(key)
+        if body is not None:
+            return body
+        if endpoint == "leaguegamelog":
+            players, games = SLATE_GAME_LOGS
+            payload = benchmarks.make_game_log_payload(players * self.scale, games)
+        elif endpoint == "playerindex":
+            payload = benchmarks.make_player_index_payload(SLATE_GAME_LOGS[0] * self.scale)
+        elif endpoint == "offers":
+            offers, books, lines = SLATE_OFFERS
+            seed = benchmarks.SEED + int(params.get("market_id", 0) or 0)
+            payload = benchmarks.make_offers_payload(offers * self.scale, books, lines, seed=seed)
+        else:
+            return None
+        body = self._synthetic_cache[key] = json.dumps(payload).encode("utf-8")
+        return body
+
+    @staticmethod
+    def _paginate(body: bytes, params: Dict[str, str]) -> bytes:
+        """Slice an offers payload to the requested page, adding bettingpros-style _pagination."""
+        if "limit" not in params:
+            return body
+        payload = json.loads(body)
+        offers = payload.get("offers")
+        if not isinstance(offers, list):
+            return body
+        limit = max(1, int(params["limit"]))
+        page = max(1, int(params.get("page", 1)))
+        payload["offers"] = offers[(page - 1) * limit:page * limit]
+        payload["_pagination"] = {
+            "page": page, "limit": limit,
+            "total_items": len(offers), "total_pages": max(1, -(-len(offers) // limit)),
+        }
+        return json.dumps(payload).encode("utf-8")
+
+# ------------------------ Command Line ------------------------
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description="Serve recorded or synthetic NBA stats and props responses locally.")
+    parser.add_argument("--host", default=HOST)
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--fixtures", default=None, help="Fixture directory (default: fixtures.FIXTURE_ROOT).")
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds added to every response.")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Extra random latency, up to this many seconds.")
+    parser.add_argument("--rate-limit", type=float, default=None, help="Requests per second before answering 429.")
+    parser.add_argument("--throttle-every", type=int, default=0, help="Answer every Nth request with 429.")
+    parser.add_argument("--retry-after", type=float, default=1.0, help="Retry-After seconds sent with 429s.")
+    parser.add_argument("--scale", type=int, default=1, help="Synthetic slate size multiplier.")
+    parser.add_argument("--no-synthetic", action="store_true", help="Answer 404 when no fixture was recorded.")
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    server = MockServer(args.host, args.port, args.fixtures, args.latency, args.jitter, args.rate_limit,
+                        args.throttle_every, args.retry_after, args.scale, not args.no_synthetic)
+    server.start()
+    print(f"Point the pipeline at it with NBAPROPS_MOCK_URL={server.url}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,87 +1,171 @@
+import re
 import sqlite3
-from fuzzywuzzy import fuzz, process
 import logging
-
-# Logging setup
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler("name_management.log"),  # Log to a file
-        logging.StreamHandler()                      # Log to console
-    ]
-)
+import unicodedata
+
+import storage
+import metrics
+import readers
+
+LOG_FILE = "name_management.log"
+
+NAME_SUFFIXES = {"jr", "sr", "ii", "iii", "iv", "v"}
+
+def normalize_name(name):
+    """Reduce a player name to a comparison key: no accents, punctuation, case or suffixes."""
+    if not name:
+        return ""
+    name = unicodedata.normalize("NFKD", str(name)).encode("ascii", "ignore").decode("ascii").lower()
+    tokens = re.sub(r"[^a-z0-9 ]", "", name.replace("-", " ")).split()
+    while len(tokens) > 1 and tokens[-1] in NAME_SUFFIXES:
+        tokens.pop()
+    return " ".join(tokens)
+
+class PlayerResolver:
+    """
+    Maps player name strings to NBA player_ids using players.primary_name and
+    players.alternate_names (comma, semicolon or pipe separated). Names that
+    normalize to the same key for different players are left unresolved rather
+    than guessed. Results are cached, so each distinct name is resolved once.
+    """
+
+    def __init__(self, names=None):
+        self._ids = {}
+        self._ambiguous = set()
+        self._cache = {}
+        for name, player_id in (names or []):
+            self.add(name, player_id)
+
+    @classmethod
+    def from_database(cls, database, table="players"):
+        """Build a resolver from a players table; an empty resolver if the table is missing."""
+        return cls.from_connection(storage.get_connection(database), table)
+
+    @classmethod
+    def from_connection(cls, conn, table="players"):
+        resolver = cls()
+        try:
+            cursor = conn.execute(f"SELECT player_id, primary_name, alternate_names FROM {table};")
+            for player_id, primary_name, alternate_names in cursor.fetchall():
+                resolver.add(primary_name, player_id)
+                for alternate in re.split(r"[,;|]", alternate_names or ""):
+                    resolver.add(alternate, player_id)
+        except sqlite3.Error as e:
+            logging.warning(f"Player resolver could not read {table}: {e}")
+        return resolver
+
+    def add(self, name, player_id):
+        key = normalize_name(name)
+        if not key or player_id is None:
+            return
+        existing = self._ids.get(key)
+        if existing is not None and existing != player_id:
+            self._ambiguous.add(key)
+        self._ids[key] = player_id
+        self._cache.clear()
+
+    def resolve(self, name):
+        """Return the player_id for a name, or None when unknown or ambiguous."""
+        if name in self._cache:
+            return self._cache[name]
+        key = normalize_name(name)
+        player_id = None if key in self._ambiguous else self._ids.get(key)
+        self._cache[name] = player_id
+        return player_id
+
+    __call__ = resolve
+
+    def __len__(self):
+        return len(self._ids)
 
 def fetch_all_tables(database):
     """Fetch all table names in a SQLite database."""
-    conn = sqlite3.connect(database)
-    cursor = conn.cursor()
+    cursor = storage.get_connection(database).cursor()
     cursor.execute("SELECT name FROM sqlite_master WHERE type='table';")
     tables = [row[0] for row in cursor.fetchall()]
-    conn.close()
     return tables
 
 def fetch_unique_names_from_tables(database, tables, column):
     """Fetch unique names from a specified column across multiple tables."""
-    conn = sqlite3.connect(database)
-    cursor = conn.cursor()
     unique_names = set()
-    for table in tables:
-        try:
-            query = f"SELECT DISTINCT {column} FROM {table};"
-            cursor.execute(query)
-            names = [row[0] for row in cursor.fetchall()]
-            unique_names.update(names)
-        except sqlite3.Error as e:
-            logging.warning(f"Skipped table {table} due to error: {e}")
-    conn.close()
+    with metrics.track("names", "fetch_props_names") as m:
+        for table in tables:
+            try:
+                for names in readers.iter_distinct(database, table, column):
+                    unique_names.update(names)
+            except sqlite3.Error as e:
+                logging.warning(f"Skipped table {table} due to error: {e}")
+        m.rows += len(unique_names)
     return unique_names
 
 def fetch_game_logs_names(database, table, primary_column, alternate_column):
     """Fetch unique names from the PLAYER_NAME and AlternateName columns."""
-    conn = sqlite3.connect(database)
-    cursor = conn.cursor()
-    query = f"SELECT DISTINCT {primary_column}, {alternate_column} FROM {table};"
-    cursor.execute(query)
-    rows = cursor.fetchall()
-    conn.close()
-
-    # Combine names from both columns
+    # Combine names from both columns, reading each as sorted distinct chunks
     names = set()
-    for primary, alternate in rows:
-        names.add(primary)
-        if alternate:
-            names.add(alternate)
+    with metrics.track("names", "fetch_game_logs_names") as m:
+        for column in (primary_column, alternate_column):
+            for chunk in readers.iter_distinct(database, table, column):
+                names.update(name for name in chunk if name)
+                m.rows += len(chunk)
     return names
 
 def update_alternate_name(database, table, primary_column, alternate_column, primary_name, alternate_name):
     """Update the alternate name for a specific primary name."""
+    query = f"UPDATE {table} SET {alternate_column} = ? WHERE {primary_column} = ?;"
     try:
-        conn = sqlite3.connect(database)
-        cursor = conn.cursor()
-
-        query = f"UPDATE {table} SET {alternate_column} = ? WHERE {primary_column} = ?;"
-        cursor.execute(query, (alternate_name, primary_name))
-        conn.commit()
+        with metrics.track("names", "write") as m:
+            storage.run_write(database, lambda conn: conn.execute(query, (alternate_name, primary_name)))
+            m.rows += 1
         logging.info(f"Updated AlternateName: {alternate_name} for PLAYER_NAME: {primary_name}.")
     except sqlite3.Error as e:
         logging.error(f"SQLite error occurred while updating alternate name: {e}")
-    finally:
-        conn.close()
+
+def _add_player_alternate_name(conn, primary_name, alternate_name):
+    cursor = conn.execute("SELECT alternate_names FROM players WHERE primary_name = ?;", (primary_name,))
+    row = cursor.fetchone()
+    if row is None:
+        return 0
+    alternates = [name.strip() for name in re.split(r"[,;|]", row[0] or "") if name.strip()]
+    if alternate_name in alternates:
+        return 0
+    conn.execute("UPDATE players SET alternate_names = ? WHERE primary_name = ?;",
+                 (", ".join(alternates + [alternate_name]), primary_name))
+    return 1
+
+def add_player_alternate_name(database, primary_name, alternate_name):
+    """
+    Append an alternate name to players.alternate_names, which PlayerResolver reads
+    when resolving prop offers to player_ids. Returns 1 if the name was added.
+    """
+    try:
+        added = storage.run_write(database, _add_player_alternate_name, primary_name, alternate_name)
+        if added:
+            logging.info(f"Added alternate name {alternate_name} for player {primary_name} in {database}.")
+        else:
+            logging.warning(f"No player {primary_name} in {database}, or {alternate_name} already listed.")
+        return added
+    except sqlite3.Error as e:
+        logging.error(f"SQLite error occurred while adding alternate name: {e}")
+        return 0
 
 def verify_names(props_names, game_logs_names):
     """Verify props names against game logs names."""
+    from fuzzywuzzy import fuzz, process
+
     unmatched_names = []
-    for name in props_names:
-        best_match, score = process.extractOne(name, game_logs_names, scorer=fuzz.ratio)
-        if score < 100:
-            unmatched_names.append((name, best_match, score))
+    with metrics.track("names", "verify") as m:
+        for name in props_names:
+            best_match, score = process.extractOne(name, game_logs_names, scorer=fuzz.ratio)
+            if score < 100:
+                unmatched_names.append((name, best_match, score))
+        m.rows += len(props_names)
     return unmatched_names
 
-def main():
+def main(interactive=True):
     # Database and table configurations
     props_db = "nba_props.db"
     game_logs_db = "nba_game_logs.db"
+    players_db = "nba.db"
     props_column = "Player"
     game_logs_table = "game_logs"
     game_logs_column = "PLAYER_NAME"
@@ -109,17 +193,26 @@ def main():
             for name, best_match, score in unmatched:
                 logging.info(f"Name: {name}, Closest Match: {best_match}, Similarity: {score}%")
 
-            # Prompt user to resolve mismatches
-            for name, best_match, score in unmatched:
+            # Prompt user to resolve mismatches (skipped for unattended runs)
+            added = 0
+            for name, best_match, score in (unmatched if interactive else []):
                 print(f"\nPotential mismatch: Name: {name}, Closest Match: {best_match}, Similarity: {score}%")
                 user_input = input(f"Is '{name}' the same as '{best_match}'? (y/n): ").strip().lower()
                 if user_input == 'y':
                     update_alternate_name(game_logs_db, game_logs_table, game_logs_column, alternate_column, best_match, name)
+                    added += add_player_alternate_name(players_db, best_match, name)
                 else:
                     print(f"Skipping update for '{name}'. You can manually resolve this later.")
 
+            # Offers stored under the newly confirmed names can now be keyed on player_id
+            if added:
+                import props
+                props.backfill_player_ids(players_db)
+
         # Summary
         logging.info(f"Total unmatched names: {len(unmatched)}")
+        metrics.export(game_logs_db)
+        return unmatched
 
     except sqlite3.Error as e:
         logging.error(f"SQLite error occurred: {e}")
@@ -127,5 +220,14 @@ def main():
         logging.error(f"Unexpected error: {e}")
 
 if __name__ == "__main__":
+    # Logging setup
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(levelname)s - %(message)s',
+        handlers=[
+            logging.FileHandler(LOG_FILE),  # Log to a file
+            logging.StreamHandler()         # Log to console
+        ]
+    )
     main()
 
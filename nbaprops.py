@@ -0,0 +1,166 @@
+# nbaprops.py
+
+"""
+Single entry point for the pipeline stages:
+
+    python nbaprops.py ingest-logs --then per-minute
+    python nbaprops.py derive-stats --workers 8
+    python nbaprops.py snapshot-props --all-lines
+    python nbaprops.py reprocess-archive --all-lines
+    python nbaprops.py reconcile-names --no-prompt
+    python nbaprops.py status
+
+Stage modules are imported only when their stage runs, so a command pays
+for pandas, requests or fuzzywuzzy only if it uses them. Stages chained
+with --then run in one process and hand their results to later stages
+through a shared context instead of reading them back from SQLite.
+"""
+
+import sys
+import time
+import logging
+import argparse
+from typing import Any, Callable, Dict
+
+LOG_FILE = "nbaprops.log"
+
+# ------------------------ Stages ------------------------
+
+def ingest_logs(args: argparse.Namespace, context: Dict[str, Any]) -> None:
+    """Fetch the league game log once and store it in both the normalized and legacy databases."""
+    import logs
+    import game_logs
+    import metrics
+
+    response_json = logs.fetch_game_logs(logs.params)
+    if not response_json:
+        logging.warning("No data received from API.")
+        return
+    logs.initialize_database(logs.DATABASE_NAME)
+    logs.ingest_game_logs(response_json, logs.DATABASE_NAME)
+    # Positions first: the feature build in store_league_game_log reads them from the players table
+    logs.ingest_player_positions(logs.DATABASE_NAME, logs.params["Season"])
+    game_logs.store_league_game_log(response_json, game_logs.DATABASE_NAME)
+    metrics.export(logs.DATABASE_NAME)
+    context["game_logs"] = response_json
+
+
+def per_minute(args: argparse.Namespace, context: Dict[str, Any]) -> None:
+    """Build the per-minute table, from the just-ingested game log when one is in the context."""
+    import minute
+    import metrics
+
+    database = "nba_game_logs.db"
+    rows = column_names = None
+    result_sets = context.get("game_logs", {}).get("resultSets", [])
+    if result_sets:
+        column_names = result_sets[0].get("headers", [])
+        rows = result_sets[0].get("rowSet", [])
+    minute.calculate_per_minute_stats(database, "game_logs", "game_logs_per_minute",
+                                      rows=rows, column_names=column_names)
+    metrics.export(database)
+
+
+def derive_stats(args: argparse.Namespace, context: Dict[str, Any]) -> None:
+    """Recompute the declarative derived stats (per-minute, per-36, TS%, PRA, usage) across a process pool."""
+    import derived
+    import metrics
+
+    derived.compute_derived(derived.DATABASE_NAME, workers=args.workers)
+    metrics.export(derived.DATABASE_NAME)
+
+
+def snapshot_props(args: argparse.Namespace, context: Dict[str, Any]) -> None:
+    """Poll every prop market once and store the snapshot."""
+    import props
+
+    event_ids = args.event_ids or props.EVENT_IDS
+    context["props_snapshot"] = props.track_prop_markets(event_ids, keep_all_lines=args.all_lines)
+
+
+def reprocess_archive(args: argparse.Namespace, context: Dict[str, Any]) -> None:
+    """Re-run archived raw game log and offers payloads through the current parsers."""
+    import archive
+    import metrics
+
+    archive.reprocess(workers=args.workers, keep_all_lines=args.all_lines)
+    metrics.export(archive.ARCHIVE_DB)
+
+
+def reconcile_names(args: argparse.Namespace, context: Dict[str, Any]) -> None:
+    """Match props player names against game log names, prompting for fixes unless --no-prompt."""
+    import names_manager
+
+    context["unmatched_names"] = names_manager.main(interactive=not args.no_prompt)
+
+
+def status(args: argparse.Namespace, context: Dict[str, Any]) -> None:
+    """Print the databases, their tables and row counts."""
+    import db_status
+
+    db_status.print_status()
+
+
+STAGES: Dict[str, Callable[[argparse.Namespace, Dict[str, Any]], None]] = {
+    "ingest-logs": ingest_logs,
+    "snapshot-props": snapshot_props,
+    "per-minute": per_minute,
+    "derive-stats": derive_stats,
+    "reprocess-archive": reprocess_archive,
+    "reconcile-names": reconcile_names,
+    "status": status,
+}
+
+# ------------------------ Command Line ------------------------
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="nbaprops", description="NBA props data pipeline.")
+    parser.add_argument("command", choices=list(STAGES), help="Stage to run.")
+    parser.add_argument("--then", action="append", default=[], choices=list(STAGES), metavar="STAGE",
+                        help="Run another stage afterwards in the same process (repeatable).")
+    parser.add_argument("--all-lines", action="store_true",
+                        help="snapshot-props, reprocess-archive: also store alternate lines alongside each main line.")
+    parser.add_argument("--event-ids", type=int, nargs="+",
+                        help="snapshot-props: event IDs to poll instead of the configured ones.")
+    parser.add_argument("--no-prompt", action="store_true",
+                        help="reconcile-names: report mismatches without asking for confirmation.")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="derive-stats, reprocess-archive: worker processes (default: one per core).")
+    parser.add_argument("--http-mode", choices=["live", "record", "replay"], default=None,
+                        help="live requests, record responses as fixtures, or replay fixtures offline.")
+    parser.add_argument("--mock-url", default=None,
+                        help="Send requests to a local mock server (see mock_server.py) instead of the live APIs.")
+    parser.add_argument("--verbose", action="store_true", help="Log at DEBUG level.")
+    return parser
+
+
+def main(argv=None) -> int:
+    args = build_parser().parse_args(argv)
+    logging.basicConfig(
+        level=logging.DEBUG if args.verbose else logging.INFO,
+        format="%(asctime)s - %(levelname)s - %(message)s",
+        handlers=[
+            logging.FileHandler(LOG_FILE),
+            logging.StreamHandler()
+        ]
+    )
+
+    if args.http_mode or args.mock_url:
+        import fixtures
+        fixtures.configure(mode=args.http_mode, mock_url=args.mock_url)
+
+    context: Dict[str, Any] = {}
+    for stage in [args.command] + args.then:
+        started = time.perf_counter()
+        logging.info(f"Running stage '{stage}'...")
+        try:
+            STAGES[stage](args, context)
+        except Exception as e:
+            logging.error(f"Stage '{stage}' failed: {e}")
+            return 1
+        logging.info(f"Stage '{stage}' finished in {time.perf_counter() - started:.2f}s.")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,276 @@
+# projections.py
+
+import os
+import sqlite3
+import logging
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+import storage
+import db_status
+
+# ------------------------ Configuration ------------------------
+
+STATS_DB = "nba_game_logs.db"
+PER_MINUTE_TABLE = "game_logs_per_minute"
+PROPS_DB = "nba.db"
+PROJECTIONS_TABLE = "prop_projections"
+
+DRAWS = 10000
+LOOKBACK_GAMES = 15              # Recent games used to fit minutes and per-minute rates
+MIN_GAMES = 3                    # Players with fewer games are not projected
+MAX_MINUTES = 48.0
+SEED = 12345
+PARALLEL_MIN_PLAYERS = 64        # Smaller slates are simulated in-process
+
+STATS = ["PTS", "REB", "AST", "FG3M", "STL", "BLK", "TOV"]
+
+# Gamma shape of the per-game rate multiplier for each stat (lower = more overdispersed)
+STAT_DISPERSION = {"PTS": 12.0, "REB": 8.0, "AST": 6.0, "FG3M": 4.0, "STL": 3.0, "BLK": 2.5, "TOV": 5.0}
+
+# Shared per-game multiplier (pace/usage) applied to every stat, which correlates them
+GAME_FACTOR_SHAPE = 25.0
+
+# Market -> weight per stat; combo markets are linear combinations of the simulated stats
+MARKET_WEIGHTS = {
+    "Points_o_u": {"PTS": 1},
+    "Rebounds_o_u": {"REB": 1},
+    "Assists_o_u": {"AST": 1},
+    "3PM_o_u": {"FG3M": 1},
+    "Steals_o_u": {"STL": 1},
+    "Blocks_o_u": {"BLK": 1},
+    "Points_Assists": {"PTS": 1, "AST": 1},
+    "Points_Rebounds": {"PTS": 1, "REB": 1},
+    "Rebounds_Assists": {"REB": 1, "AST": 1},
+    "Points_Rebounds_Assists": {"PTS": 1, "REB": 1, "AST": 1},
+    "Fantasy_Score": {"PTS": 1, "REB": 1.2, "AST": 1.5, "STL": 3, "BLK": 3, "TOV": -1},
+}
+
+# ------------------------ Fitting ------------------------
+
+def fit_player_models(database: str = STATS_DB, table: str = PER_MINUTE_TABLE,
+                      lookback: int = LOOKBACK_GAMES) -> Tuple[List[int], np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Fit a minutes distribution and per-minute rates for every player from the
+    per-minute table built by minute.py, using each player's last `lookback` games.
+
+    Returns (player_ids, minutes mean, minutes std, rates[player, stat]).
+    Rates are minute-weighted, i.e. sum(stat) / sum(minutes) over the window.
+    """
+    per_minute = ", ".join(f"{stat}_PER_MIN" for stat in STATS)
+    cursor = storage.get_connection(database).cursor()
+    cursor.execute(f"""
+        SELECT PLAYER_ID, MIN, {per_minute} FROM (
+            SELECT *, ROW_NUMBER() OVER (PARTITION BY PLAYER_ID ORDER BY GAME_DATE DESC) AS recent
+            FROM {table}
+            WHERE MIN > 0
+        )
+        WHERE recent <= ?
+        ORDER BY PLAYER_ID;
+    """, (lookback,))
+    rows = cursor.fetchall()
+    db_status.record_query_pattern(database, table, ["PLAYER_ID", "GAME_DATE"])
+
+    player_ids: List[int] = []
+    minutes_mean, minutes_sd, rates = [], [], []
+    start = 0
+    while start < len(rows):
+        end = start
+        while end < len(rows) and rows[end][0] == rows[start][0]:
+            end += 1
+        if end - start >= MIN_GAMES:
+            block = np.array([row[1:] for row in rows[start:end]], dtype=float)
+            minutes = block[:, 0]
+            stat_totals = np.nansum(block[:, 1:] * minutes[:, None], axis=0)
+            player_ids.append(rows[start][0])
+            minutes_mean.append(minutes.mean())
+            minutes_sd.append(minutes.std(ddof=1))
+            rates.append(stat_totals / minutes.sum())
+        start = end
+
+    return (player_ids, np.array(minutes_mean), np.nan_to_num(np.array(minutes_sd)),
+            np.array(rates).reshape(len(player_ids), len(STATS)))
+
+# ------------------------ Simulation ------------------------
+
+def simulate(minutes_mean: np.ndarray, minutes_sd: np.ndarray, rates: np.ndarray,
+             draws: int = DRAWS, seed=SEED) -> np.ndarray:
+    """
+    Simulate stat lines for a batch of players in one vectorized pass.
+    Minutes are drawn from a truncated normal; each stat is Poisson with a rate of
+    per-minute rate x minutes x a shared game factor x a stat-specific gamma
+    multiplier (a negative binomial overall). Shared minutes and the game factor
+    correlate a player's stats, which matters for combo markets.
+
+    Returns an array of shape (players, stats, draws).
+    """
+    rng = np.random.default_rng(seed)
+    n_players = len(minutes_mean)
+    minutes = np.clip(rng.normal(minutes_mean[:, None], minutes_sd[:, None], (n_players, draws)), 0.0, MAX_MINUTES)
+    exposure = minutes * rng.gamma(GAME_FACTOR_SHAPE, 1.0 / GAME_FACTOR_SHAPE, (n_players, draws))
+
+    outcomes = np.empty((n_players, len(STATS), draws), dtype=np.float32)
+    for index, stat in enumerate(STATS):
+        shape = STAT_DISPERSION[stat]
+        rate = rates[:, index, None] * exposure * rng.gamma(shape, 1.0 / shape, (n_players, draws))
+        outcomes[:, index, :] = rng.poisson(rate)
+    return outcomes
+
+
+def _market_weight_vector(market: str) -> np.ndarray:
+    weights = MARKET_WEIGHTS[market]
+    return np.array([weights.get(stat, 0.0) for stat in STATS], dtype=np.float32)
+
+
+def _price_chunk(args) -> List[Tuple[float, float, float]]:
+    """
+    Simulate one chunk of players and price its lines.
+    `lines` holds (local player index, market, line); returns (mean, p_over, p_under) per line.
+    Runs in a worker process, so only the small per-line results travel back.
+    """
+    minutes_mean, minutes_sd, rates, lines, draws, seed = args
+    outcomes = simulate(minutes_mean, minutes_sd, rates, draws, seed)
+    results = []
+    combos: Dict[str, np.ndarray] = {}
+    for player_index, market, line in lines:
+        if market not in combos:
+            combos[market] = np.einsum("s,psd->pd", _market_weight_vector(market), outcomes)
+        values = combos[market][player_index]
+        results.append((float(values.mean()), float((values > line).mean()), float((values < line).mean())))
+    return results
+
+
+def price_lines(minutes_mean: np.ndarray, minutes_sd: np.ndarray, rates: np.ndarray,
+                lines: Sequence[Tuple[int, str, float]], draws: int = DRAWS, seed=SEED,
+                workers: Optional[int] = None) -> List[Tuple[float, float, float]]:
+    """
+    Price (player index, market, line) triples against simulated outcomes.
+    Players are split into one chunk per worker process with independent random
+    streams; every chunk simulates all of its players and draws in a single batch.
+    Returns (mean, p_over, p_under) for each line, in input order.
+    """
+    n_players = len(minutes_mean)
+    workers = workers or os.cpu_count() or 1
+    if n_players < PARALLEL_MIN_PLAYERS:
+        workers = 1
+    bounds = np.linspace(0, n_players, workers + 1, dtype=int)
+    seeds = np.random.SeedSequence(seed).spawn(workers)
+
+    tasks, positions = [], []
+    for chunk, (start, end) in enumerate(zip(bounds[:-1], bounds[1:])):
+        chunk_lines, chunk_positions = [], []
+        for position, (player_index, market, line) in enumerate(lines):
+            if start <= player_index < end:
+                chunk_lines.append((player_index - start, market, line))
+                chunk_positions.append(position)
+        if chunk_lines:
+            tasks.append((minutes_mean[start:end], minutes_sd[start:end], rates[start:end],
+                          chunk_lines, draws, seeds[chunk]))
+            positions.append(chunk_positions)
+
+    if len(tasks) <= 1:
+        chunk_results = [_price_chunk(task) for task in tasks]
+    else:
+        with ProcessPoolExecutor(max_workers=len(tasks)) as executor:
+            chunk_results = list(executor.map(_price_chunk, tasks))
+
+    results: List[Tuple[float, float, float]] = [None] * len(lines)
+    for chunk_positions, chunk_result in zip(positions, chunk_results):
+        for position, result in zip(chunk_positions, chunk_result):
+            results[position] = result
+    return results
+
+# ------------------------ Slate Pricing ------------------------
+
+def current_lines(database: str = PROPS_DB, table: str = "prop_lines") -> Tuple[Optional[str], List[Tuple[str, Optional[int], str, float]]]:
+    """
+    Return the latest snapshot timestamp and its distinct (player, player_id, market, line)
+    main lines. Offers stored without a player_id are resolved against the players table.
+    """
+    from names_manager import PlayerResolver
+
+    cursor = storage.get_connection(database).cursor()
+    cursor.execute(f"PRAGMA table_info({table});")
+    columns = {row[1] for row in cursor.fetchall()}
+    if not columns:
+        return None, []
+    main_filter = "AND COALESCE(is_main, 1) = 1" if "is_main" in columns else ""
+    player_id = "player_id" if "player_id" in columns else "NULL"
+    cursor.execute(f"SELECT MAX(script_timestamp) FROM {table};")
+    snapshot = cursor.fetchone()[0]
+    cursor.execute(f"""
+        SELECT DISTINCT player, {player_id}, market, prop_line FROM {table}
+        WHERE script_timestamp = ? {main_filter};
+    """, (snapshot,))
+    db_status.record_query_pattern(database, table, ["script_timestamp"])
+    resolver = None
+    lines = []
+    for player, player_id, market, prop_line in cursor.fetchall():
+        try:
+            line = float(prop_line)
+        except (TypeError, ValueError):
+            continue
+        if player_id is None:
+            resolver = resolver or PlayerResolver.from_database(database)
+            player_id = resolver(player)
+        lines.append((player, player_id, market, line))
+    return snapshot, lines
+
+
+def _save_projections(conn: sqlite3.Connection, rows: List[Tuple]) -> None:
+    conn.execute(f"""
+    CREATE TABLE IF NOT EXISTS {PROJECTIONS_TABLE} (
+        script_timestamp TEXT,
+        player TEXT,
+        market TEXT,
+        prop_line REAL,
+        projected_mean REAL,
+        over_prob REAL,
+        under_prob REAL,
+        draws INTEGER
+    );
+    """)
+    conn.execute(f"""
+    CREATE INDEX IF NOT EXISTS idx_{PROJECTIONS_TABLE}_offer
+    ON {PROJECTIONS_TABLE} (player, market, prop_line, script_timestamp);
+    """)
+    conn.executemany(f"""
+        INSERT INTO {PROJECTIONS_TABLE} (
+            script_timestamp, player, market, prop_line, projected_mean, over_prob, under_prob, draws
+        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?);
+    """, rows)
+
+
+def price_slate(props_db: str = PROPS_DB, stats_db: str = STATS_DB, draws: int = DRAWS,
+                seed=SEED, workers: Optional[int] = None, save: bool = True) -> List[Tuple]:
+    """
+    Project every player on the current props board and return
+    (script_timestamp, player, market, line, mean, p_over, p_under, draws) rows,
+    optionally storing them in the projections table of the props database.
+    """
+    snapshot, lines = current_lines(props_db)
+    player_ids, minutes_mean, minutes_sd, rates = fit_player_models(stats_db)
+    player_index = {player_id: index for index, player_id in enumerate(player_ids)}
+
+    priced = [(player_index[player_id], market, line, player)
+              for player, player_id, market, line in lines
+              if player_id in player_index and market in MARKET_WEIGHTS]
+    skipped = len(lines) - len(priced)
+    if skipped:
+        logging.info(f"Skipped {skipped} lines with no fitted player or unsupported market.")
+
+    results = price_lines(minutes_mean, minutes_sd, rates, [(i, m, l) for i, m, l, _ in priced],
+                          draws=draws, seed=seed, workers=workers)
+    rows = [(snapshot, player, market, line, mean, p_over, p_under, draws)
+            for (_, market, line, player), (mean, p_over, p_under) in zip(priced, results)]
+    if save and rows:
+        storage.run_write(props_db, _save_projections, rows)
+    logging.info(f"Priced {len(rows)} lines for {len({row[1] for row in rows})} players.")
+    return rows
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    price_slate()
@@ -1,19 +1,17 @@
-import requests
-import sqlite3
+import os
+import sys
+import calendar
 import logging
-from datetime import datetime
-
-# Logging setup
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s - %(levelname)s - %(message)s",
-    handlers=[
-        logging.FileHandler("prop_markets.log"),
-        logging.StreamHandler()
-    ]
-)
+from datetime import datetime, timezone
+from typing import NamedTuple, Optional
+
+import storage
+import fixtures
+import columnar
+import metrics
 
 # Constants
+LOG_FILE = "prop_markets.log"
 BASE_URL_OFFERS = "https://api.bettingpros.com/v3/offers"
 API_KEY = "CHi8Hy5CEE4khd46XNYL23dCFX96oUdw6qOt1Dnh"
 
@@ -55,6 +53,45 @@ MARKET_MAP = {
 
 DB_FILE = "nba.db"
 
+MAX_OFFER_PAGES = 50             # Safety cap on pages fetched per market
+
+# Replace with actual event IDs fetched dynamically or hardcoded for now
+EVENT_IDS = [25313, 25314, 25315, 25316]  # Example event IDs
+
+# Line-move and arbitrage detector; kept for the life of the process so repeated
+# polls compare against in-memory state
+_change_detector = None
+
+# Parsed offer record. A NamedTuple carries no per-instance dict and is passed
+# to executemany() as-is, so a poll never builds or unpacks per-row dicts.
+# Field order matches the prop_lines insert column order.
+class PropOffer(NamedTuple):
+    script_timestamp: str
+    market: str
+    player: str
+    position: str
+    team: str
+    event_id: object
+    selection: str
+    prop_line: object
+    odds: object
+    bookie: str
+    source_updated: str
+    source_updated_epoch: int
+    is_main: int
+    player_id: Optional[int] = None
+
+PROP_OFFER_COLUMNS = ", ".join(PropOffer._fields)
+
+_bookie_names = {}
+
+def _bookie_name(book_id):
+    """Resolve a book ID to a shared name string, caching unknown IDs too."""
+    name = _bookie_names.get(book_id)
+    if name is None:
+        name = _bookie_names[book_id] = sys.intern(BOOKIE_MAP.get(book_id, f"Book ID {book_id}"))
+    return name
+
 # Fetch offers data
 def fetch_offers(event_ids, market_id, location="OH", limit=100, page=1):
     event_ids_str = ":".join(map(str, event_ids))
@@ -66,13 +103,58 @@ def fetch_offers(event_ids, market_id, location="OH", limit=100, page=1):
         "limit": limit,
         "page": page
     }
-    response = requests.get(BASE_URL_OFFERS, headers=HEADERS, params=params)
-    response.raise_for_status()
-    return response.json()
+    with metrics.track("props", "fetch") as m:
+        response = fixtures.get(BASE_URL_OFFERS, headers=HEADERS, params=params)
+        response.raise_for_status()
+        m.bytes += len(response.content)
+        return response.json()
+
+def fetch_all_offers(event_ids, market_id, location="OH", limit=100):
+    """Fetch every page of offers for a market and return them as one payload."""
+    offers = []
+    for page in range(1, MAX_OFFER_PAGES + 1):
+        data = fetch_offers(event_ids, market_id, location, limit, page)
+        page_offers = data.get("offers", [])
+        offers.extend(page_offers)
+        total_pages = (data.get("_pagination") or {}).get("total_pages")
+        if len(page_offers) < limit or (total_pages is not None and page >= total_pages):
+            break
+    return {"offers": offers}
+
+def _updated_to_epoch(updated):
+    """
+    Convert a line's 'updated' timestamp to epoch seconds (naive values are UTC).
+    Returns 0 for missing or unparseable values so they never win "most recent".
+    """
+    if not updated:
+        return 0
+    try:
+        parsed = datetime.fromisoformat(str(updated).replace("Z", "+00:00"))
+    except ValueError:
+        return 0
+    if parsed.tzinfo is None:
+        return calendar.timegm(parsed.timetuple())
+    return int(parsed.astimezone(timezone.utc).timestamp())
 
 # Parse offers data
-def parse_offers_data(offers_data, market_name, script_timestamp):
+def parse_offers_data(offers_data, market_name, script_timestamp, keep_all_lines=False, resolve_player=None):
+    """
+    Flatten an offers payload into PropOffer records, one per (offer, selection, book).
+    Each book's main line is its most recently updated active line, chosen in a single
+    pass over epoch timestamps. With keep_all_lines=True every active line of a book
+    (alternate and ladder lines included) is kept, with is_main set on the main line.
+    resolve_player maps a player name to an NBA player_id (see PlayerResolver).
+    """
     organized_data = []
+    append = organized_data.append
+    intern = sys.intern
+
+    # Books on one payload share a handful of timestamps; parse each only once
+    epochs = {}
+
+    # Strings repeated across every record are interned so records share one copy
+    market_name = intern(market_name)
+    script_timestamp = intern(script_timestamp)
 
     for offer in offers_data.get('offers', []):
         event_id = offer.get('event_id', 'Unknown')
@@ -80,44 +162,110 @@ def parse_offers_data(offers_data, market_name, script_timestamp):
         participants = offer.get('participants', [{}])
         
         player_info = participants[0].get('player', {})
-        player_name = participants[0].get('name', 'Unknown Player')
-        position = player_info.get('position', 'Unknown')
-        player_team = player_info.get('team', 'Unknown')
+        player_name = intern(participants[0].get('name', 'Unknown Player'))
+        position = intern(player_info.get('position', 'Unknown'))
+        player_team = intern(player_info.get('team', 'Unknown'))
+        player_id = resolve_player(player_name) if resolve_player else None
 
         for selection in selections:
-            label = selection.get('label', 'Unknown Label')  # "Over" or "Under"
+            label = intern(selection.get('label', 'Unknown Label'))  # "Over" or "Under"
             books = selection.get('books', [])
             
             for book in books:
-                most_recent_line = None
+                main_line = None
+                main_epoch = -1
+                active_lines = []
                 for line in book.get('lines', []):
                     if not line.get('active', False):
                         continue
-                    if most_recent_line is None or line['updated'] > most_recent_line['updated']:
-                        most_recent_line = line
-
-                if most_recent_line:
-                    book_id = book.get('id', 'N/A')
-                    bookie_name = BOOKIE_MAP.get(book_id, f"Book ID {book_id}")
-                    organized_data.append({
-                        'script_timestamp': script_timestamp,
-                        'market': market_name,
-                        'player': player_name,
-                        'position': position,
-                        'team': player_team,
-                        'event_id': event_id,
-                        'selection': label,
-                        'prop_line': most_recent_line.get('line', 'N/A'),
-                        'odds': most_recent_line.get('cost', 'N/A'),
-                        'bookie': bookie_name,
-                        'source_updated': most_recent_line.get('updated', 'N/A')
-                    })
+                    updated = line.get('updated')
+                    epoch = epochs.get(updated)
+                    if epoch is None:
+                        epoch = epochs[updated] = _updated_to_epoch(updated)
+                    if epoch > main_epoch:
+                        main_line, main_epoch = line, epoch
+                    if keep_all_lines:
+                        active_lines.append((line, epoch))
+
+                if main_line is None:
+                    continue
+                bookie_name = _bookie_name(book.get('id', 'N/A'))
+                if not keep_all_lines:
+                    active_lines = [(main_line, main_epoch)]
+                for line, epoch in active_lines:
+                    append(PropOffer(
+                        script_timestamp, market_name, player_name, position, player_team, event_id, label,
+                        line.get('line', 'N/A'),
+                        line.get('cost', 'N/A'),
+                        bookie_name,
+                        line.get('updated', 'N/A'),
+                        epoch,
+                        1 if line is main_line else 0,
+                        player_id,
+                    ))
 
     return organized_data
 
+# Columns added to prop_lines after its first release: name -> definition
+PROP_LINES_ADDED_COLUMNS = {
+    "source_updated_epoch": "INTEGER",
+    "is_main": "INTEGER DEFAULT 1",
+    "player_id": "INTEGER",
+}
+
+_migrated_tables = set()  # (absolute database path, table name) already checked by this process
+
+def _migrate_prop_lines(cursor, table_name):
+    """Add any columns missing from an older prop_lines table (checked once per database and table per process)."""
+    database_path = cursor.execute("PRAGMA database_list;").fetchone()[2]
+    key = (os.path.abspath(database_path) if database_path else id(cursor.connection), table_name)
+    if key in _migrated_tables:
+        return
+    cursor.execute(f"PRAGMA table_info({table_name});")
+    existing = {row[1] for row in cursor.fetchall()}
+    for column, definition in PROP_LINES_ADDED_COLUMNS.items():
+        if column not in existing:
+            cursor.execute(f"ALTER TABLE {table_name} ADD COLUMN {column} {definition};")
+    cursor.execute(f"CREATE INDEX IF NOT EXISTS idx_{table_name}_script_timestamp ON {table_name} (script_timestamp);")
+    cursor.execute(f"CREATE INDEX IF NOT EXISTS idx_{table_name}_player_id ON {table_name} (player_id, script_timestamp);")
+    cursor.execute(f"CREATE INDEX IF NOT EXISTS idx_{table_name}_event_id ON {table_name} (event_id);")
+    if "player_id" not in existing:
+        from names_manager import PlayerResolver
+        _backfill_player_ids(cursor, table_name, PlayerResolver.from_connection(cursor.connection))
+    _migrated_tables.add(key)
+
+def _backfill_player_ids(cursor, table_name, resolver):
+    """
+    Fill player_id on rows stored without one. Each distinct name is resolved once
+    into a temporary mapping table, then applied in a single UPDATE pass.
+    """
+    cursor.execute(f"SELECT DISTINCT player FROM {table_name} WHERE player_id IS NULL;")
+    mapping = [(name, resolver.resolve(name)) for (name,) in cursor.fetchall()]
+    mapping = [(name, player_id) for name, player_id in mapping if player_id is not None]
+    if not mapping:
+        return 0
+    cursor.execute("CREATE TEMP TABLE IF NOT EXISTS player_id_map (player TEXT PRIMARY KEY, player_id INTEGER);")
+    cursor.execute("DELETE FROM temp.player_id_map;")
+    cursor.executemany("INSERT INTO temp.player_id_map (player, player_id) VALUES (?, ?);", mapping)
+    cursor.execute(f"""
+    UPDATE {table_name}
+    SET player_id = (SELECT m.player_id FROM temp.player_id_map m WHERE m.player = {table_name}.player)
+    WHERE player_id IS NULL AND player IN (SELECT player FROM temp.player_id_map);
+    """)
+    updated = cursor.rowcount
+    cursor.execute("DROP TABLE temp.player_id_map;")
+    logging.info(f"Backfilled player_id on {updated} {table_name} rows.")
+    return updated
+
+def backfill_player_ids(db_file=DB_FILE, table_name="prop_lines"):
+    """Resolve player_id for stored rows that have none, e.g. after new players were ingested."""
+    from names_manager import PlayerResolver
+
+    resolver = PlayerResolver.from_database(db_file)
+    return storage.run_write(db_file, lambda conn: _backfill_player_ids(conn.cursor(), table_name, resolver))
+
 # Save to database
-def save_to_database(db_file, table_name, data):
-    conn = sqlite3.connect(db_file)
+def _write_prop_lines(conn, table_name, data):
     cursor = conn.cursor()
 
     # Create table if it doesn't exist
@@ -134,44 +282,118 @@ def save_to_database(db_file, table_name, data):
         prop_line REAL,
         odds REAL,
         bookie TEXT,
-        source_updated TEXT
+        source_updated TEXT,
+        source_updated_epoch INTEGER,
+        is_main INTEGER DEFAULT 1,
+        player_id INTEGER
     )
     """)
+    _migrate_prop_lines(cursor, table_name)
+
+    # Insert data into the table; PropOffer records are tuples in column order
+    placeholders = ", ".join("?" for _ in PropOffer._fields)
+    cursor.executemany(f"""
+    INSERT INTO {table_name} ({PROP_OFFER_COLUMNS}) VALUES ({placeholders})
+    """, data)
+
+def save_to_database(db_file, table_name, data):
+    # Writes go through the shared single writer so concurrent jobs never hit "database is locked"
+    storage.run_write(db_file, _write_prop_lines, table_name, data)
+
+def _replace_market_snapshot(conn, table_name, script_timestamp, market_name, data):
+    _write_prop_lines(conn, table_name, [])  # Creates and migrates the table if needed
+    conn.execute(f"DELETE FROM {table_name} WHERE script_timestamp = ? AND market = ?;", (script_timestamp, market_name))
+    _write_prop_lines(conn, table_name, data)
+    return len(data)
 
-    # Insert data into the table
-    for entry in data:
-        cursor.execute(f"""
-        INSERT INTO {table_name} (
-            script_timestamp, market, player, position, team, event_id,
-            selection, prop_line, odds, bookie, source_updated
-        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        """, (
-            entry['script_timestamp'], entry['market'], entry['player'], entry['position'],
-            entry['team'], entry['event_id'], entry['selection'], entry['prop_line'],
-            entry['odds'], entry['bookie'], entry['source_updated']
-        ))
-
-    conn.commit()
-    conn.close()
+def replace_market_snapshot(db_file, table_name, script_timestamp, market_name, data):
+    """
+    Swap the stored rows of one market in one snapshot for `data` in a single transaction,
+    e.g. when re-parsing archived payloads. Queued on the shared writer; returns its future,
+    whose result is the number of rows written.
+    """
+    return storage.submit_write(db_file, _replace_market_snapshot, table_name, script_timestamp, market_name, data)
+
+def get_change_detector():
+    """Return the process-wide change detector, primed from the last stored snapshot on first use."""
+    import alerts
+
+    global _change_detector
+    if _change_detector is None:
+        _change_detector = alerts.ChangeDetector(sinks=[alerts.table_sink(DB_FILE), alerts.log_sink()])
+        loaded = _change_detector.prime(DB_FILE)
+        logging.info(f"Change detector primed with {loaded} offers from the previous snapshot.")
+    return _change_detector
 
 # Main function to fetch and track prop markets
-def track_prop_markets(event_ids):
+def track_prop_markets(event_ids, keep_all_lines=False):
+    # The snapshot consumers are only needed when polling, so importing props stays cheap for parse-only users
+    import markets
+    import board
+    import archive
+    from names_manager import PlayerResolver
+
     script_timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
     table_name = "prop_lines"
+    snapshot = []
+    detector = get_change_detector()  # Must be primed before this snapshot is written
+    resolver = PlayerResolver.from_database(DB_FILE)  # Reloaded per poll to pick up newly ingested players
+
+    # Archived raw pages are tagged with this snapshot's timestamp so it can be re-parsed later
+    with archive.poll(script_timestamp):
+        for market_id, market_name in MARKET_MAP.items():
+            try:
+                logging.info(f"Fetching data for market: {market_name} (ID: {market_id})")
+                offers_data = fetch_all_offers(event_ids, market_id)
+                with metrics.track("props", "parse") as m:
+                    parsed_data = parse_offers_data(offers_data, market_name, script_timestamp, keep_all_lines,
+                                                    resolver.resolve)
+                    m.rows += len(parsed_data)
+                with metrics.track("props", "write") as m:
+                    save_to_database(DB_FILE, table_name, parsed_data)
+                    m.rows += len(parsed_data)
+                snapshot.extend(parsed_data)
+                logging.info(f"Saved {len(parsed_data)} entries for market: {market_name}.")
+            except Exception as e:
+                logging.error(f"Error tracking market {market_name}: {e}")
+
+    # Derive de-vigged consensus and best prices across books for the whole snapshot
+    try:
+        with metrics.track("props", "consensus") as m:
+            m.rows += markets.update_consensus(DB_FILE, snapshot)
+    except Exception as e:
+        logging.error(f"Error computing consensus lines: {e}")
 
-    for market_id, market_name in MARKET_MAP.items():
-        try:
-            logging.info(f"Fetching data for market: {market_name} (ID: {market_id})")
-            offers_data = fetch_offers(event_ids, market_id)
-            parsed_data = parse_offers_data(offers_data, market_name, script_timestamp)
-            save_to_database(DB_FILE, table_name, parsed_data)
-            logging.info(f"Saved {len(parsed_data)} entries for market: {market_name}.")
-        except Exception as e:
-            logging.error(f"Error tracking market {market_name}: {e}")
+    # Fold the snapshot into the valid_from/valid_to line states behind the as-of board
+    try:
+        with metrics.track("props", "line_states") as m:
+            m.rows += board.update_line_states(DB_FILE, snapshot)
+    except Exception as e:
+        logging.error(f"Error updating line states: {e}")
+
+    # Emit line-move, odds-move, arbitrage and middle events for what changed since the last poll
+    try:
+        with metrics.track("props", "alerts") as m:
+            m.rows += len(detector.process(snapshot))
+    except Exception as e:
+        logging.error(f"Error detecting line changes: {e}")
+
+    # Append this snapshot to the Parquet dataset for analytical queries
+    columnar.export_after_ingest(columnar.export_prop_lines, DB_FILE)
+
+    metrics.export(DB_FILE)
+    return snapshot
 
 # Example Usage
 if __name__ == "__main__":
-    # Replace with actual event IDs fetched dynamically or hardcoded for now
-    event_ids = [25313, 25314, 25315, 25316]  # Example event IDs
-    track_prop_markets(event_ids)
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s - %(levelname)s - %(message)s",
+        handlers=[
+            logging.FileHandler(LOG_FILE),
+            logging.StreamHandler()
+        ]
+    )
+    # Pass --all-lines to also store alternate/ladder lines alongside each book's main line
+    track_prop_markets(EVENT_IDS, keep_all_lines="--all-lines" in sys.argv)
 
@@ -0,0 +1,129 @@
+# readers.py
+
+import sqlite3
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Union
+
+import storage
+
+# ------------------------ Configuration ------------------------
+
+CHUNK_SIZE = 50000               # Rows per chunk; bounds memory regardless of table size
+
+# ------------------------ Chunked Readers ------------------------
+
+def table_columns(database: str, table: str) -> List[str]:
+    """Column names of a table, in schema order."""
+    cursor = storage.get_connection(database).execute(f"PRAGMA table_info({table});")
+    columns = [row[1] for row in cursor.fetchall()]
+    if not columns:
+        raise sqlite3.OperationalError(f"no such table: {table}")
+    return columns
+
+
+def iter_chunks(database: str, table: str, columns: Optional[Sequence[str]] = None,
+                where: Optional[str] = None, params: Sequence[Any] = (),
+                key: Union[str, Sequence[str]] = "rowid", chunk_size: Optional[int] = None) -> Iterator[List[tuple]]:
+    """
+    Yield a table's rows as lists of at most chunk_size tuples, in key order.
+
+    Pages are fetched by keyset pagination (WHERE key > last seen key ... LIMIT n)
+    rather than OFFSET, so every page is an index seek and no read transaction is
+    held open between pages; writers keep committing while a long scan runs.
+    The key must be unique and non-NULL and should be indexed: rowid (the
+    default), an INTEGER PRIMARY KEY such as prop_lines.id, or a composite like
+    ("script_timestamp", "id") that an index covers. `columns` projects the read
+    (default all), and `where` / `params` filter it.
+    """
+    chunk_size = chunk_size or CHUNK_SIZE
+    keys = [key] if isinstance(key, str) else list(key)
+    columns = list(columns) if columns else table_columns(database, table)
+    order = ", ".join(keys)
+    # Row-value comparison pages through composite keys in a single index range
+    after = f"({order}) > ({', '.join('?' for _ in keys)})" if len(keys) > 1 else f"{keys[0]} > ?"
+    filters = f"({where})" if where else "1"
+    select = f"SELECT {order}, {', '.join(columns)} FROM {table}"
+    conn = storage.get_connection(database)
+    if keys != ["rowid"]:
+        import db_status  # db_status reads through this module
+
+        # Each scan pages in key order; let the index advisor see which keys are used
+        db_status.record_query_pattern(database, table, keys)
+
+    last = None
+    while True:
+        if last is None:
+            query = f"{select} WHERE {filters} ORDER BY {order} LIMIT ?;"
+            values = [*params, chunk_size]
+        else:
+            query = f"{select} WHERE {filters} AND {after} ORDER BY {order} LIMIT ?;"
+            values = [*params, *last, chunk_size]
+        rows = conn.execute(query, values).fetchall()
+        if not rows:
+            return
+        last = rows[-1][:len(keys)]
+        yield [row[len(keys):] for row in rows]
+        if len(rows) < chunk_size:
+            return
+
+
+def iter_rows(database: str, table: str, columns: Optional[Sequence[str]] = None, **kwargs: Any) -> Iterator[tuple]:
+    """iter_chunks() flattened to one tuple at a time."""
+    for chunk in iter_chunks(database, table, columns, **kwargs):
+        yield from chunk
+
+
+def iter_distinct(database: str, table: str, column: str, where: Optional[str] = None,
+                  params: Sequence[Any] = (), chunk_size: Optional[int] = None) -> Iterator[List[Any]]:
+    """
+    Yield the distinct non-NULL values of one column in sorted chunks, paging on
+    the value itself, so an index on the column turns each page into a range scan.
+    """
+    chunk_size = chunk_size or CHUNK_SIZE
+    filters = f" AND ({where})" if where else ""
+    conn = storage.get_connection(database)
+    last = None
+    while True:
+        after = "" if last is None else f" AND {column} > ?"
+        values = [*params, *([] if last is None else [last]), chunk_size]
+        rows = conn.execute(f"""
+            SELECT DISTINCT {column} FROM {table}
+            WHERE {column} IS NOT NULL{filters}{after} ORDER BY {column} LIMIT ?;
+        """, values).fetchall()
+        if not rows:
+            return
+        last = rows[-1][0]
+        yield [row[0] for row in rows]
+        if len(rows) < chunk_size:
+            return
+
+# ------------------------ Frame and Array Chunks ------------------------
+
+def iter_frames(database: str, table: str, columns: Optional[Sequence[str]] = None, **kwargs: Any):
+    """iter_chunks() as pandas DataFrames with the projected column names."""
+    import pandas as pd
+
+    columns = list(columns) if columns else table_columns(database, table)
+    for chunk in iter_chunks(database, table, columns, **kwargs):
+        yield pd.DataFrame.from_records(chunk, columns=columns)
+
+
+def iter_arrays(database: str, table: str, columns: Optional[Sequence[str]] = None,
+                dtype: Any = None, **kwargs: Any) -> Iterator[Dict[str, Any]]:
+    """
+    iter_chunks() as {column: NumPy array}. With dtype=float, numeric columns come
+    back as float arrays with NULL as NaN; otherwise NumPy infers each column's dtype.
+    """
+    import numpy as np
+
+    columns = list(columns) if columns else table_columns(database, table)
+    for chunk in iter_chunks(database, table, columns, **kwargs):
+        if dtype is None:
+            yield {column: np.array(values) for column, values in zip(columns, zip(*chunk))}
+        else:
+            matrix = np.array(chunk, dtype=dtype).reshape(len(chunk), len(columns))
+            yield {column: matrix[:, index] for index, column in enumerate(columns)}
+
+
+def first_frame(database: str, table: str, limit: int, columns: Optional[Sequence[str]] = None):
+    """The first `limit` rows of a table as a DataFrame, e.g. for a preview."""
+    return next(iter_frames(database, table, columns, chunk_size=limit), None)
@@ -0,0 +1,186 @@
+# storage.py
+
+import os
+import queue
+import atexit
+import sqlite3
+import logging
+import threading
+from concurrent.futures import Future
+from typing import Any, Callable, Dict
+
+# ------------------------ Configuration ------------------------
+
+BUSY_TIMEOUT_MS = 30000          # Wait this long for a lock before raising "database is locked"
+CACHE_SIZE_KB = 64000            # Page cache per connection (~64 MB)
+MMAP_SIZE = 268435456            # Memory-map up to 256 MB of the database file
+
+_local = threading.local()       # Per-thread connection pool: {database path: connection}
+_writers: Dict[str, "_Writer"] = {}
+_writers_lock = threading.Lock()
+_owner_pid = os.getpid()         # Pools and writers inherited across fork() are discarded
+
+# ------------------------ Connections ------------------------
+
+def _discard_after_fork() -> None:
+    """
+    Drop state inherited from a parent process. SQLite connections must not be
+    shared across fork(), and the parent's writer threads do not exist in the child.
+    """
+    global _owner_pid
+    if os.getpid() == _owner_pid:
+        return
+    _owner_pid = os.getpid()
+    _local.connections = {}
+    _writers.clear()
+
+
+def _database_key(database: str) -> str:
+    """Normalize a database path so the same file always maps to the same pool entry."""
+    return database if database == ":memory:" else os.path.abspath(database)
+
+
+def configure_connection(conn: sqlite3.Connection) -> sqlite3.Connection:
+    """
+    Apply the shared pragmas to a connection.
+    WAL lets readers run alongside a writer, and the busy timeout makes
+    writers from other processes wait instead of failing immediately.
+    """
+    conn.execute(f"PRAGMA busy_timeout = {BUSY_TIMEOUT_MS};")
+    conn.execute("PRAGMA journal_mode = WAL;")
+    conn.execute("PRAGMA synchronous = NORMAL;")
+    conn.execute(f"PRAGMA cache_size = -{CACHE_SIZE_KB};")
+    conn.execute(f"PRAGMA mmap_size = {MMAP_SIZE};")
+    conn.execute("PRAGMA temp_store = MEMORY;")
+    return conn
+
+
+def connect(database: str, **kwargs: Any) -> sqlite3.Connection:
+    """
+    Open a new configured connection that the caller owns and must close.
+    Use this for one-off work such as VACUUM; prefer get_connection() otherwise.
+    """
+    conn = sqlite3.connect(database, timeout=BUSY_TIMEOUT_MS / 1000, **kwargs)
+    return configure_connection(conn)
+
+
+def get_connection(database: str) -> sqlite3.Connection:
+    """
+    Return this thread's pooled connection to a database, opening it on first use.
+    Pooled connections stay open for the life of the thread; callers must not close them.
+    """
+    _discard_after_fork()
+    pool = getattr(_local, "connections", None)
+    if pool is None:
+        pool = _local.connections = {}
+    key = _database_key(database)
+    conn = pool.get(key)
+    if conn is None:
+        conn = pool[key] = connect(database)
+    return conn
+
+
+def close_connections() -> None:
+    """Close every pooled connection owned by the calling thread."""
+    pool = getattr(_local, "connections", {})
+    for conn in pool.values():
+        conn.close()
+    pool.clear()
+
+# ------------------------ Single Writer ------------------------
+
+class _Writer:
+    """
+    Serializes all writes to one database through a dedicated thread and connection.
+    Each submitted function runs inside its own BEGIN IMMEDIATE transaction.
+    """
+
+    def __init__(self, database: str):
+        self.database = database
+        self._queue: "queue.Queue" = queue.Queue()
+        self._thread = threading.Thread(
+            target=self._run, name=f"sqlite-writer:{os.path.basename(database)}", daemon=True
+        )
+        self._conn = None
+        self._thread.start()
+
+    def submit(self, func: Callable[..., Any], *args: Any, **kwargs: Any) -> Future:
+        future: Future = Future()
+        self._queue.put((future, func, args, kwargs))
+        return future
+
+    def run_inline(self, func: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+        """Run a nested write on the writer thread within the current transaction."""
+        return func(self._conn, *args, **kwargs)
+
+    def owns_current_thread(self) -> bool:
+        return threading.current_thread() is self._thread
+
+    def close(self) -> None:
+        self._queue.put(None)
+        self._thread.join()
+
+    def _run(self) -> None:
+        # Autocommit mode so transactions are controlled explicitly below
+        self._conn = connect(self.database, isolation_level=None, check_same_thread=False)
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            future, func, args, kwargs = item
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                self._conn.execute("BEGIN IMMEDIATE;")
+                result = func(self._conn, *args, **kwargs)
+                if self._conn.in_transaction:
+                    self._conn.execute("COMMIT;")
+                future.set_result(result)
+            except BaseException as e:
+                if self._conn.in_transaction:
+                    self._conn.execute("ROLLBACK;")
+                future.set_exception(e)
+        self._conn.close()
+
+
+def _get_writer(database: str) -> _Writer:
+    """Return the process-wide writer for a database, starting it on first use."""
+    _discard_after_fork()
+    key = _database_key(database)
+    with _writers_lock:
+        writer = _writers.get(key)
+        if writer is None:
+            writer = _writers[key] = _Writer(key)
+        return writer
+
+
+def submit_write(database: str, func: Callable[..., Any], *args: Any, **kwargs: Any) -> Future:
+    """
+    Queue func(conn, *args, **kwargs) on the database's single writer and return a Future.
+    Writes from every thread in the process are applied one at a time, in submission order.
+    """
+    return _get_writer(database).submit(func, *args, **kwargs)
+
+
+def run_write(database: str, func: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+    """
+    Run func(conn, *args, **kwargs) on the database's single writer and wait for its result.
+    Exceptions raised by func are re-raised in the caller after the transaction is rolled back.
+    """
+    writer = _get_writer(database)
+    if writer.owns_current_thread():
+        return writer.run_inline(func, *args, **kwargs)
+    return writer.submit(func, *args, **kwargs).result()
+
+
+def close_writers() -> None:
+    """Drain pending writes and stop every writer thread."""
+    with _writers_lock:
+        writers = list(_writers.values())
+        _writers.clear()
+    for writer in writers:
+        writer.close()
+    logging.debug(f"Closed {len(writers)} database writer(s).")
+
+
+atexit.register(close_writers)